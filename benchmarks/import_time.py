@@ -0,0 +1,60 @@
+"""
+Import-time benchmark for nafitools.
+
+Imports each module in a fresh interpreter and fails (exit code 1) if a module pulls in one of the
+heavy optional dependencies at import time or takes longer than the budget on top of pandas/numpy.
+
+    python benchmarks/import_time.py --budget 0.5
+"""
+import sys
+import json
+import argparse
+import subprocess
+
+MODULES = ['nafitools', 'nafitools.datatools', 'nafitools.portfolio', 'nafitools.summary_statistics',
+           'nafitools.correlation', 'nafitools.persistence', 'nafitools.preprocess', 'nafitools.missing_value',
+           'nafitools.wrdsdata', 'nafitools.mirror', 'nafitools.quantile_sketch', 'nafitools.turnover',
+           'nafitools.inference', 'nafitools.factor_models', 'nafitools.factors']
+HEAVY = ['wrds', 'matplotlib', 'sklearn', 'statsmodels', 'scipy.stats', 'duckdb']
+
+SNIPPET = """
+import sys, json, time
+import pandas, numpy
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(module, repeat=3):
+    """
+    Return the best import time of a module over fresh interpreters and the heavy modules it loaded.
+    """
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', SNIPPET.format(module=module, heavy=HEAVY)],
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return min(result['seconds'] for result in results), results[0]['heavy']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--budget', type=float, default=0.5, help='Allowed seconds per module on top of pandas/numpy.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module in MODULES:
+        seconds, heavy = measure(module, args.repeat)
+        status = 'ok'
+        if heavy or seconds > args.budget:
+            status = 'FAIL'
+            failed = True
+        print(f"{module:32s} {seconds * 1000:8.1f} ms  {status}  {'loads ' + ', '.join(heavy) if heavy else ''}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
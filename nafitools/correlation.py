@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
-from scipy.stats import pearsonr, spearmanr
+
+from .datatools import PanelFrame, as_panel
+from .inference import newey_west
 
 def cal_corr(group, var1, var2, option='all'):
     """
@@ -15,6 +17,8 @@ def cal_corr(group, var1, var2, option='all'):
     Returns:
         pd.Series: A series containing the correlation between the two variables.
     """
+    from scipy.stats import pearsonr, spearmanr
+
     # Drop NaN values for the variables being correlated
     group = group[[var1, var2]].dropna()
     
@@ -34,65 +38,329 @@ def cal_corr(group, var1, var2, option='all'):
     else:
         raise ValueError("Invalid option for correlation type. Choose from 'pearson', 'spearman', or 'all'.")
 
-def cal_per_corr(df, time_column, specific_date=None):
+def _masked_corr(X):
+    """
+    Pairwise-complete Pearson correlation matrix of the columns of X (NaN marks missing values).
+
+    Sums over the rows where both columns of a pair are observed are computed for all pairs at once with
+    masked matrix products. Columns are centered first to limit cancellation.
+
+    Args:
+        X (np.ndarray): An n x k array.
+
+    Returns:
+        tuple of np.ndarray: The k x k correlation matrix and the k x k number of complete pairs.
+    """
+    valid = ~np.isnan(X)
+    w = valid.astype(np.float64)
+    count = w.sum(axis=0)
+    filled = np.where(valid, X, 0.0)
+    center = filled.sum(axis=0) / np.maximum(count, 1)
+    Z = np.where(valid, X - center, 0.0)
+
+    n = w.T @ w
+    s = Z.T @ w           # s[i, j]: sum of column i over the rows where i and j are observed
+    ss = (Z * Z).T @ w
+    sp = Z.T @ Z
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sp - s * s.T / n
+        var = ss - s ** 2 / n
+        corr = cov / np.sqrt(var * var.T)
+        # A column that is constant on the pair's rows has no defined correlation (as in scipy.stats.pearsonr)
+        scale = (8 * np.finfo(np.float64).eps * np.abs(filled).max(axis=0, initial=0.0)) ** 2
+        constant = (var <= 1e-20 * ss) | (var <= n * scale[:, None])
+    corr[constant | constant.T | (n < 2)] = np.nan
+    return np.clip(corr, -1.0, 1.0), n
+
+
+def _common_rank_corr(X, counts, pairs):
+    """
+    Spearman correlations of pairs of columns of X with ranks within each pair's common rows (NaN marks missing values).
+
+    The rank of a value of column a among the rows where a and b are both observed is the number of such rows with a
+    smaller value, plus half the tied ones. Along the sort order of column a, a cumulative sum of the observed masks
+    of the other columns gives these ranks for every pair (a, b) at once, so no pair is re-ranked separately. The
+    rank sums of all pairs then follow from elementwise products of the rank arrays, in blocks of columns to bound memory.
+
+    Args:
+        X (np.ndarray): An n x k array.
+        counts (np.ndarray): The k x k number of complete pairs (see _masked_corr).
+        pairs (np.ndarray): A symmetric k x k boolean array of the pairs to compute.
+
+    Returns:
+        np.ndarray: The k x k correlations, NaN outside the given pairs.
+    """
+    n, k = X.shape
+    corr = np.full((k, k), np.nan)
+    involved = np.flatnonzero(pairs.any(axis=1))
+    m = len(involved)
+    if m == 0:
+        return corr
+    X = X[:, involved]
+    valid = ~np.isnan(X)
+
+    # Observed rows of every column in value order, with the first and last sorted position of each row's ties
+    sorted_rows, first, last = [], [], []
+    for a in range(m):
+        rows = np.flatnonzero(valid[:, a])
+        rows = rows[np.argsort(X[rows, a], kind='stable')]
+        x = X[rows, a]
+        new = np.concatenate([[True], x[1:] != x[:-1]]) if len(x) else np.zeros(0, dtype=bool)
+        sorted_rows.append(rows)
+        if new.all():
+            first.append(None)
+            last.append(None)
+        else:
+            group = np.cumsum(new) - 1
+            starts = np.flatnonzero(new)
+            first.append(starts[group])
+            last.append((np.append(starts[1:], len(x)) - 1)[group])
+
+    def ranks(a, columns, out):
+        # Average ranks of column a among the rows where each of the columns is also observed (0 elsewhere)
+        rows = sorted_rows[a]
+        inside = valid[rows] if len(columns) == m else valid[rows][:, columns]
+        below = np.cumsum(inside, axis=0, dtype=np.int64)
+        if first[a] is not None:
+            below = np.vstack([np.zeros((1, len(columns)), dtype=np.int64), below])
+            before, through = below[first[a]], below[last[a] + 1]
+            below = before + (through - before + 1) / 2
+        out[:] = 0.0
+        out[rows] = below * inside
+
+    # P[i, r, b]: rank of column a = block[i] in row r within its pair with b, and Q[b, r, i]: rank of b within the
+    # same pair. Rank sums are exact in floating point, so the moments are formed without cancellation issues.
+    everything = np.arange(m)
+    sums, squares, products = np.zeros((m, m)), np.zeros((m, m)), np.zeros((m, m))
+    size = max(1, int(8e6 // (n * m)))
+    for start in range(0, m, size):
+        block = everything[start:start + size]
+        P = np.empty((len(block), n, m))
+        for i, a in enumerate(block):
+            ranks(a, everything, P[i])
+        if len(block) == m:
+            Q = P
+        else:
+            Q = np.empty((m, n, len(block)))
+            for b in everything:
+                ranks(b, block, Q[b])
+        sums[block] = P.sum(axis=1)
+        squares[block] = np.einsum('irb,irb->ib', P, P)
+        products[block] = np.einsum('irb,bri->ib', P, Q)
+
+    count = counts[np.ix_(involved, involved)]
+    variance = count * squares - sums ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        common = np.clip((count * products - sums * sums.T) / np.sqrt(variance * variance.T), -1.0, 1.0)
+    common[(variance <= 0) | (variance.T <= 0) | (count < 2)] = np.nan
+    corr[np.ix_(involved, involved)] = common
+    corr[~pairs] = np.nan
+    return corr
+
+
+def _corr_frame(time_column, times, variables, pearson, spearman, counts):
+    """
+    Long format of per-period correlation arrays: one block of periods per pair of variables.
+    """
+    k, n_periods = len(variables), len(times)
+    i, j = np.triu_indices(k, 1)
+    n_pairs = len(i)
+    return pd.DataFrame({
+        time_column: np.tile(times, n_pairs),
+        'Pearson': pearson[:, i, j].T.ravel(),
+        'Spearman': spearman[:, i, j].T.ravel(),
+        'Var1': np.repeat(np.array(variables, dtype=object)[i], n_periods),
+        'Var2': np.repeat(np.array(variables, dtype=object)[j], n_periods),
+        'N': counts[:, i, j].T.ravel().astype(np.int64),
+    })
+
+
+def cal_per_corr(df, time_column, specific_date=None, output='long', exact=True):
     """
     Calculate Pearson and Spearman correlations for each time period for all pairs of variables.
+
+    Each period's cross-section is ranked once and the full Pearson and Spearman matrices are computed with
+    pairwise-complete NaN handling (see _masked_corr). When two variables have different missing values in a
+    period, their Spearman correlation needs ranks within the common rows; exact=True computes those ranks for all
+    such pairs at once (see _common_rank_corr).
     
     Args:
-        df (pd.DataFrame): The data frame containing the data.
+        df (pd.DataFrame or PanelFrame): The data frame containing the data. For a PanelFrame, its sorting is reused
+            and its id column is not treated as a variable.
         time_column (str): The name of the column representing time periods.
         specific_date (str or None): A specific date to filter the data. If None, calculate for all dates.
+        output (str): 'long' for a data frame, 'array' for 3-D arrays. Defaults to 'long'.
+        exact (bool): Whether to re-rank pairs with different missing values for the Spearman correlation. If False,
+            ranks over each variable's own observations are used. Defaults to True.
     
     Returns:
-        pd.DataFrame: A data frame containing the Pearson and Spearman correlations for each time period.
+        pd.DataFrame: A data frame containing the Pearson and Spearman correlations and the number of complete pairs (N)
+            for each time period and pair of variables (Var1, Var2).
+        dict: With output='array', the periods ('Time'), the variables ('Variables') and T x k x k arrays 'Pearson',
+            'Spearman' and 'N'.
     """
+    if output not in ['long', 'array']:
+        raise ValueError("Invalid output. Choose from 'long' or 'array'.")
+
+    id_column = df.id_column if isinstance(df, PanelFrame) else None
     if specific_date:
-        df = df[df[time_column] == specific_date]
+        data = df.data if isinstance(df, PanelFrame) else df
+        df = data[data[time_column] == specific_date]
+    panel = as_panel(df, time_column)
+
+    variables = [col for col in panel.data.columns if col not in [time_column, id_column]]
+    values = panel.data[variables].to_numpy(dtype=np.float64)
+    # Rank every period's cross-section once
+    ranks = panel.data.groupby(panel.time_codes)[variables].rank().to_numpy(dtype=np.float64)
+
+    n_periods, k = panel.n_periods, len(variables)
+    pearson = np.full((n_periods, k, k), np.nan)
+    spearman = np.full((n_periods, k, k), np.nan)
+    counts = np.zeros((n_periods, k, k))
 
-    variables = [col for col in df.columns if col != time_column]
-    correlations = []
+    for t in range(n_periods):
+        rows = slice(panel.offsets[t], panel.offsets[t + 1])
+        pearson[t], counts[t] = _masked_corr(values[rows])
+        spearman[t], _ = _masked_corr(ranks[rows])
 
-    for i, var1 in enumerate(variables):
-        for var2 in variables[i+1:]:
-            corr_df = df.groupby(time_column).apply(lambda group: cal_corr(group, var1, var2)).reset_index()
-            corr_df['Var1'] = var1
-            corr_df['Var2'] = var2
-            correlations.append(corr_df)
+        if exact:
+            observed = np.diag(counts[t])
+            partial = (counts[t] >= 2) & ((counts[t] < observed[:, None]) | (counts[t] < observed[None, :]))
+            if partial.any():
+                spearman[t][partial] = _common_rank_corr(values[rows], counts[t], partial)[partial]
 
-    all_correlations = pd.concat(correlations, ignore_index=True)
-    return all_correlations
+    if output == 'array':
+        return {'Time': panel.times, 'Variables': variables, 'Pearson': pearson, 'Spearman': spearman, 'N': counts}
 
-def cal_ts_avcorr(correlations_df):
+    return _corr_frame(time_column, panel.times, variables, pearson, spearman, counts)
+
+def cal_ts_avcorr(correlations_df, weighted=False, time_column=None, lags=None):
     """
-    Calculate the time-series averages of the periodic cross-sectional correlations.
+    Calculate the time-series averages of the periodic cross-sectional correlations and their t-statistics.
     
     Args:
         correlations_df (pd.DataFrame): A data frame containing the periodic correlations.
+        weighted (bool): Whether to weight each period by its number of complete pairs (the N column of cal_per_corr).
+            Defaults to False.
+        time_column (str, optional): The name of the column representing time periods. Defaults to the first column.
+        lags (int or str, optional): The number of Newey-West lags, or 'auto' (see inference.newey_west).
     
     Returns:
-        pd.DataFrame: A data frame containing the time-series average Pearson and Spearman correlations.
+        pd.DataFrame: A data frame containing the time-series average Pearson and Spearman correlations, their
+            Newey-West t-statistics (Pearson_t, Spearman_t) and the number of periods (T).
     """
-    avg_corrs = correlations_df.groupby(['Var1', 'Var2'])[['Pearson', 'Spearman']].mean().reset_index()
-    return avg_corrs
+    if weighted and 'N' not in correlations_df.columns:
+        raise ValueError("Weighted averages need the N column of cal_per_corr")
+    time_column = correlations_df.columns[0] if time_column is None else time_column
+
+    # One (period x pair) matrix per correlation, so all pairs are averaged together
+    groups = correlations_df.groupby(['Var1', 'Var2'], sort=True)
+    codes = groups.ngroup().to_numpy()
+    periods, times = pd.factorize(correlations_df[time_column], sort=True)
+    avg_corrs = groups.size().reset_index()[['Var1', 'Var2']]
+    shape = (len(times), len(avg_corrs))
+    weights = np.zeros(shape)
+    weights[periods, codes] = correlations_df['N'].to_numpy(dtype=np.float64) if weighted else 1.0
+
+    for column in ['Pearson', 'Spearman']:
+        values = np.full(shape, np.nan)
+        values[periods, codes] = correlations_df[column].to_numpy(dtype=np.float64)
+        values[~(weights > 0)] = np.nan
+        inference = newey_west(values, lags, weights=weights)
+        avg_corrs[column] = inference['Mean'].to_numpy()
+        avg_corrs[f'{column}_t'] = inference['t'].to_numpy()
 
-def create_corr_mat(avg_corrs, variables):
+    avg_corrs['T'] = groups['Pearson'].count().to_numpy()
+    return avg_corrs[['Var1', 'Var2', 'Pearson', 'Spearman', 'Pearson_t', 'Spearman_t', 'T']]
+
+def create_corr_mat(avg_corrs, variables, formatted=False, return_tstats=False, decimals=2):
     """
     Create a correlation matrix with Pearson correlations below the diagonal and Spearman correlations above the diagonal.
     
     Args:
-        avg_corrs (pd.DataFrame): A data frame containing the average correlations.
+        avg_corrs (pd.DataFrame): A data frame containing the average correlations (e.g. from cal_ts_avcorr).
         variables (list of str): List of column names representing the variables.
+        formatted (bool): Whether to return the matrices as strings rounded to decimals. Defaults to False.
+        return_tstats (bool): Whether to also return the matrix of t-statistics (from Pearson_t and Spearman_t). Defaults to False.
+        decimals (int): Number of decimals of the formatted view. Defaults to 2.
     
     Returns:
         pd.DataFrame: A correlation matrix.
+        (optional) pd.DataFrame: The matrix of t-statistics if return_tstats is True.
     """
-    matrix = pd.DataFrame(index=variables, columns=variables)
+    position = pd.Index(variables)
+    i = position.get_indexer(avg_corrs['Var1'])
+    j = position.get_indexer(avg_corrs['Var2'])
+    known = (i >= 0) & (j >= 0)
+    i, j = i[known], j[known]
 
-    for _, row in avg_corrs.iterrows():
-        var1, var2 = row['Var1'], row['Var2']
-        pearson, spearman = row['Pearson'], row['Spearman']
-        matrix.at[var1, var2] = f"{spearman:.2f}"
-        matrix.at[var2, var1] = f"{pearson:.2f}"
-    
-    np.fill_diagonal(matrix.values, np.nan)
-    return matrix
\ No newline at end of file
+    def fill(lower, upper):
+        matrix = np.full((len(variables), len(variables)), np.nan)
+        matrix[j, i] = avg_corrs[lower].to_numpy(dtype=np.float64)[known]
+        matrix[i, j] = avg_corrs[upper].to_numpy(dtype=np.float64)[known]
+        np.fill_diagonal(matrix, np.nan)
+        matrix = pd.DataFrame(matrix, index=variables, columns=variables)
+        if formatted:
+            matrix = matrix.apply(lambda column: column.map(lambda x: f"{x:.{decimals}f}" if pd.notna(x) else np.nan))
+        return matrix
+
+    matrix = fill('Pearson', 'Spearman')
+    if return_tstats:
+        return matrix, fill('Pearson_t', 'Spearman_t')
+    return matrix
+
+class CorrelationUpdater:
+    def __init__(self, df, time_column, exact=True):
+        """
+        Per-period correlation history that is extended one period at a time.
+
+        The stored per-period correlations are kept and only the cross-sections of new periods are computed, with
+        the same code path as cal_per_corr, so the history is identical to a full recompute.
+
+        Args:
+            df (pd.DataFrame or PanelFrame): The data used to seed the history (see cal_per_corr).
+            time_column (str): The name of the column representing time periods.
+            exact (bool): Passed to cal_per_corr. Defaults to True.
+        """
+        self.time_column = time_column
+        self.exact = exact
+        self.arrays = cal_per_corr(df, time_column, output='array', exact=exact)
+
+    def update(self, df):
+        """
+        Add the correlations of new periods.
+
+        Args:
+            df (pd.DataFrame or PanelFrame): The data of the new periods, with the same variables as the history.
+                All periods must come after the stored ones.
+
+        Returns:
+            pd.DataFrame: The correlations of the new periods, in the format of cal_per_corr.
+        """
+        new = cal_per_corr(df, self.time_column, output='array', exact=self.exact)
+        if list(new['Variables']) != list(self.arrays['Variables']):
+            raise ValueError("The new data must have the same variables as the history")
+        if len(self.arrays['Time']) and len(new['Time']) and new['Time'][0] <= self.arrays['Time'][-1]:
+            raise ValueError("New periods must come after the stored periods")
+
+        self.arrays = {
+            'Time': self.arrays['Time'].append(new['Time']),
+            'Variables': self.arrays['Variables'],
+            **{key: np.concatenate([self.arrays[key], new[key]]) for key in ['Pearson', 'Spearman', 'N']},
+        }
+        return _corr_frame(self.time_column, new['Time'], new['Variables'], new['Pearson'], new['Spearman'], new['N'])
+
+    @property
+    def correlations(self):
+        """
+        The full correlation history, in the format of cal_per_corr.
+        """
+        arrays = self.arrays
+        return _corr_frame(self.time_column, arrays['Time'], arrays['Variables'], arrays['Pearson'], arrays['Spearman'], arrays['N'])
+
+    def averages(self, weighted=False, lags=None):
+        """
+        Time-series averages of the history (see cal_ts_avcorr).
+        """
+        return cal_ts_avcorr(self.correlations, weighted, self.time_column, lags)
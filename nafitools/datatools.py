@@ -4,5 +4,225 @@ import numpy as np
 class datatools:
     def __init__(self):
         pass
-        
-    def 
\ No newline at end of file
+
+
+def concat_frames(frames):
+    """
+    Concatenate data frames row-wise, keeping categorical columns categorical.
+
+    Chunks converted with wrdsdata.compact_dtypes carry the categories of their own values, which pd.concat would
+    turn into object columns. The categories of each such column are merged (union_categoricals) first.
+
+    Args:
+        frames (list of pd.DataFrame): The data frames, with the same columns.
+
+    Returns:
+        pd.DataFrame: The concatenated data frame with a fresh index.
+    """
+    from pandas.api.types import union_categoricals
+
+    frames = list(frames)
+    for column in frames[0].columns if frames else []:
+        if all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames if column in frame):
+            parts = [frame[column] for frame in frames if column in frame]
+            dtype = pd.CategoricalDtype(union_categoricals(parts, ignore_order=True).categories)
+            frames = [frame.assign(**{column: frame[column].astype(dtype)}) if column in frame else frame for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def iter_periods(chunks, time_column):
+    """
+    Regroup a stream of data frames so that every yielded frame holds complete time periods.
+
+    The chunks must be sorted by the time column (as yielded by the wrdsdata iter_* methods). Rows of the
+    last period in a chunk are held back until the next chunk shows that the period is complete, so
+    per-period computations on the yielded frames match those on the full data.
+
+    Args:
+        chunks (iterable of pd.DataFrame): Data frames sorted by the time column.
+        time_column (str): The name of the column representing time periods.
+
+    Yields:
+        pd.DataFrame: Data frames that contain only complete time periods.
+    """
+    carry = None
+    for chunk in chunks:
+        if carry is not None and len(carry):
+            chunk = concat_frames([carry, chunk])
+        if chunk.empty:
+            continue
+        last = chunk[time_column].iloc[-1]
+        is_last = (chunk[time_column] == last).values
+        carry = chunk[is_last]
+        if not is_last.all():
+            yield chunk[~is_last]
+    if carry is not None and len(carry):
+        yield carry
+
+
+class PanelFrame:
+    def __init__(self, df, time_column, id_column=None):
+        """
+        Panel data sorted by (time, id) with integer-coded periods and entities and precomputed period offsets.
+
+        The rows of period k are data.iloc[offsets[k]:offsets[k+1]], so functions that work period by period
+        slice the sorted data instead of grouping or scanning it again. Rows with a missing time are dropped.
+
+        Args:
+            df (pd.DataFrame): The data frame containing the data.
+            time_column (str): The name of the column representing time periods.
+            id_column (str, optional): The name of the column representing unique entity IDs.
+        """
+        self.time_column = time_column
+        self.id_column = id_column
+
+        sort_by = [time_column] + ([id_column] if id_column else [])
+        df = df.dropna(subset=[time_column])
+        self.data = df.sort_values(sort_by, kind='stable').reset_index(drop=True)
+
+        time_codes, self.times = pd.factorize(self.data[time_column], sort=True)
+        self.time_codes = time_codes.astype(np.int64)
+        self.offsets = np.searchsorted(self.time_codes, np.arange(len(self.times) + 1))
+
+        if id_column:
+            id_codes, self.ids = pd.factorize(self.data[id_column], sort=True)
+            self.id_codes = id_codes.astype(np.int64)
+        else:
+            self.id_codes, self.ids = None, None
+
+        self._lag_index = {}
+        self._keys = None
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def n_periods(self):
+        return len(self.times)
+
+    @property
+    def n_entities(self):
+        return len(self.ids) if self.ids is not None else 0
+
+    @property
+    def counts(self):
+        """
+        Number of rows in each period.
+        """
+        return np.diff(self.offsets)
+
+    def period(self, k):
+        """
+        Return the rows of the k-th period.
+        """
+        return self.data.iloc[self.offsets[k]:self.offsets[k + 1]]
+
+    def groups(self):
+        """
+        Iterate over the periods.
+
+        Yields:
+            tuple: The time period and its rows.
+        """
+        for k, time in enumerate(self.times):
+            yield time, self.period(k)
+
+    def period_codes(self, times):
+        """
+        Return the period codes of the given times (-1 for times that are not in the panel).
+        """
+        return pd.Index(self.times).get_indexer(times)
+
+    def _sorted_keys(self):
+        """
+        Entity-major (id, period) keys of the rows, sorted, and the row order that sorts them.
+        """
+        if self.id_column is None:
+            raise ValueError("An (id, period) index requires an id column")
+        if self._keys is None:
+            keys = self.id_codes * len(self.times) + self.time_codes
+            order = np.argsort(keys, kind='stable')
+            self._keys = (keys[order], order)
+        return self._keys
+
+    def locate(self, id_codes, time_codes):
+        """
+        Return the row positions of (entity, period) pairs given by their codes.
+
+        Args:
+            id_codes (np.ndarray): Entity codes (positions in ids).
+            time_codes (np.ndarray): Period codes (positions in times), which may be out of range.
+
+        Returns:
+            np.ndarray: Row positions into data, -1 where the entity has no row in the period.
+        """
+        sorted_keys, order = self._sorted_keys()
+        id_codes, time_codes = np.asarray(id_codes, dtype=np.int64), np.asarray(time_codes, dtype=np.int64)
+        targets = id_codes * len(self.times) + time_codes
+        positions = np.minimum(np.searchsorted(sorted_keys, targets), max(len(sorted_keys) - 1, 0))
+        found = (id_codes >= 0) & (time_codes >= 0) & (time_codes < len(self.times))
+        found[found] = sorted_keys[positions[found]] == targets[found]
+        index = np.full(len(targets), -1, dtype=np.int64)
+        index[found] = order[positions[found]]
+        return index
+
+    def lag_index(self, k=1):
+        """
+        Return the row position of the same entity k periods earlier (k < 0 for later periods).
+
+        Periods are counted in the panel's sorted time index, so a lag of 1 is the previous period in the data.
+
+        Args:
+            k (int): The number of periods. Defaults to 1.
+
+        Returns:
+            np.ndarray: Row positions into data, -1 where the entity has no row k periods earlier.
+        """
+        if self.id_column is None:
+            raise ValueError("A lag index requires an id column")
+        if k not in self._lag_index:
+            self._lag_index[k] = self.locate(self.id_codes, self.time_codes - k)
+        return self._lag_index[k]
+
+    def lag(self, column, k=1):
+        """
+        Return a column lagged by k periods within each entity.
+
+        Args:
+            column (str): The column to lag.
+            k (int): The number of periods. Defaults to 1.
+
+        Returns:
+            pd.Series: The lagged values, aligned with data.
+        """
+        index = self.lag_index(k)
+        lagged = pd.Series(self.data[column].to_numpy()[np.maximum(index, 0)], index=self.data.index, name=column)
+        return lagged.where(index >= 0)
+
+    def lead(self, column, k=1):
+        """
+        Return a column led by k periods within each entity.
+        """
+        return self.lag(column, -k)
+
+
+def as_panel(df, time_column, id_column=None):
+    """
+    Return df as a PanelFrame, reusing it if it already is one with the same id column (or id_column is None);
+    a PanelFrame with another id column is rebuilt from its data.
+
+    Args:
+        df (pd.DataFrame or PanelFrame): The data.
+        time_column (str): The name of the column representing time periods.
+        id_column (str, optional): The name of the column representing unique entity IDs.
+
+    Returns:
+        PanelFrame: The panel.
+    """
+    if isinstance(df, PanelFrame):
+        if df.time_column != time_column:
+            raise ValueError(f"PanelFrame is indexed by {df.time_column}, not {time_column}")
+        if id_column is not None and df.id_column != id_column:
+            return PanelFrame(df.data, time_column, id_column)
+        return df
+    return PanelFrame(df, time_column, id_column)
@@ -0,0 +1,169 @@
+import pandas as pd
+import numpy as np
+
+from .datatools import as_panel
+from .inference import newey_west, rule_of_thumb_lags
+
+def fama_macbeth(df, time_column, return_column, regressors, intercept=True, lags=None):
+    """
+    Run Fama-MacBeth regressions: a cross-sectional regression in every period and time-series averages of the coefficients.
+
+    Each period's least-squares problem is set up as normal equations on the period-sorted data (within-period
+    demeaned when there is an intercept), and all periods are solved in one batched call. Rows with a missing
+    return or regressor are dropped in their period.
+
+    Args:
+        df (pd.DataFrame or PanelFrame): The data frame containing the data.
+        time_column (str): The name of the column representing time periods.
+        return_column (str): The name of the column representing the dependent variable.
+        regressors (list of str): The names of the columns representing the regressors.
+        intercept (bool): Whether to include an intercept ('const'). Defaults to True.
+        lags (int or str, optional): The number of Newey-West lags, or 'auto' (see inference.newey_west). Defaults to floor(4 (T / 100)^(2/9)).
+
+    Returns:
+        pd.DataFrame: The mean coefficients with their Newey-West standard errors and t-statistics, followed by rows
+            with the average R2 and number of observations (N).
+        pd.DataFrame: The coefficients, R2 and N of every period.
+    """
+    regressors = list(regressors)
+    panel = as_panel(df, time_column)
+    y = panel.data[return_column].to_numpy(dtype=np.float64)
+    X = panel.data[regressors].to_numpy(dtype=np.float64)
+    complete = ~np.isnan(y) & ~np.isnan(X).any(axis=1)
+    y, X, periods = y[complete], X[complete], panel.time_codes[complete]
+
+    n_periods, k = panel.n_periods, len(regressors)
+    counts = np.bincount(periods, minlength=n_periods)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    if intercept:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y_mean = np.bincount(periods, y, n_periods) / counts
+            X_mean = np.column_stack([np.bincount(periods, X[:, j], n_periods) for j in range(k)]) / counts[:, None]
+        y, X = y - y_mean[periods], X - X_mean[periods]
+
+    # Normal equations of every period from the period-sorted rows
+    XtX = np.zeros((n_periods, k, k))
+    Xty = np.zeros((n_periods, k))
+    yty = np.zeros(n_periods)
+    for t in np.flatnonzero(counts):
+        rows = slice(offsets[t], offsets[t + 1])
+        XtX[t] = X[rows].T @ X[rows]
+        Xty[t] = X[rows].T @ y[rows]
+        yty[t] = y[rows] @ y[rows]
+
+    solvable = counts > k + intercept
+    solvable[solvable] = np.linalg.matrix_rank(XtX[solvable]) == k
+    beta = np.full((n_periods, k), np.nan)
+    if solvable.any():
+        beta[solvable] = np.linalg.solve(XtX[solvable], Xty[solvable][..., None])[..., 0]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Explained over total sum of squares (centered when there is an intercept)
+        r2 = (beta * Xty).sum(axis=1) / yty
+    coefficients = pd.DataFrame(beta, index=pd.Index(panel.times, name=time_column), columns=regressors)
+    if intercept:
+        coefficients.insert(0, 'const', y_mean - (X_mean * beta).sum(axis=1))
+    coefficients['R2'] = r2
+    coefficients['N'] = counts
+    coefficients = coefficients[solvable]
+
+    params = coefficients.columns[:-2]
+    inference = newey_west(coefficients[params], lags)
+    summary = pd.DataFrame({'Coef': inference['Mean'], 'SE': inference['SE'], 't': inference['t']}, index=params)
+    summary.loc['R2'] = [coefficients['R2'].mean(), np.nan, np.nan]
+    summary.loc['N'] = [coefficients['N'].mean(), np.nan, np.nan]
+    return summary, coefficients
+
+def time_series_regressions(returns, factors, time_column=None, lags=None):
+    """
+    Regress many test assets on common factors at once and test whether their alphas are jointly zero.
+
+    All assets share the factor matrix, so the regressions are solved together: each asset's normal equations
+    X'diag(m)X and X'diag(m)y are built for all assets at once with the mask m of its observed periods, which allows
+    unbalanced histories. Assets with no more periods than regressors, or with collinear factors over their periods,
+    get NaN coefficients and are left out of the GRS test. Standard errors are Newey-West (HAC); the GRS test uses
+    the remaining assets in the periods in which all of them are observed, and is NaN unless there are more such
+    periods than assets plus factors.
+
+    Args:
+        returns (pd.DataFrame): Excess returns of the test assets, one column per asset (e.g. the portfolios of
+            calculate_portfolio_returns), indexed by period unless time_column is given.
+        factors (pd.DataFrame): Factor returns (e.g. from wrdsdata.get_ff_monthly), one column per factor, indexed by period
+            unless time_column is given.
+        time_column (str, optional): The name of the column representing time periods in both data frames.
+        lags (int, optional): The number of Newey-West lags; 0 gives White standard errors. Defaults to floor(4 (T / 100)^(2/9)).
+
+    Returns:
+        pd.DataFrame: For each asset the alpha and factor loadings, their HAC t-statistics (suffix _t), the R2 and
+            the number of periods (T).
+        pd.Series: The GRS statistic, its p-value and the numbers of periods (T), assets (N) and factors (L) of the test.
+    """
+    if time_column is not None:
+        returns = returns.set_index(time_column)
+        factors = factors.set_index(time_column)
+    factors = factors.dropna()
+    returns = returns.reindex(factors.index)
+    returns = returns.loc[returns.notna().any(axis=1)]
+    factors = factors.loc[returns.index]
+
+    names = ['alpha'] + list(factors.columns)
+    X = np.column_stack([np.ones(len(factors)), factors.to_numpy(dtype=np.float64)])
+    Y = returns.to_numpy(dtype=np.float64)
+    mask = ~np.isnan(Y)
+    Y0 = np.where(mask, Y, 0.0)
+    n_periods, n_assets, k = len(X), Y.shape[1], X.shape[1]
+    if lags is None:
+        lags = int(rule_of_thumb_lags(n_periods))
+
+    # Masked normal equations of all assets, solved in one batched call
+    XtX = (mask.T.astype(np.float64) @ (X[:, :, None] * X[:, None, :]).reshape(n_periods, k * k)).reshape(n_assets, k, k)
+    XtY = X.T @ Y0
+    observed = mask.sum(axis=0)
+    solvable = observed > k
+    solvable[solvable] = np.linalg.matrix_rank(XtX[solvable]) == k
+    B = np.full((n_assets, k), np.nan)
+    if solvable.any():
+        B[solvable] = np.linalg.solve(XtX[solvable], XtY.T[solvable][..., None])[..., 0]
+    mask &= solvable
+    residuals = np.where(mask, Y0 - X @ np.nan_to_num(B).T, 0.0)
+
+    # Bartlett-weighted sum of the lagged outer products of the scores x_t e_t of each asset
+    scores = X[:, :, None] * residuals[:, None, :]
+    S = np.einsum('tin,tjn->nij', scores, scores, optimize=True)
+    for lag in range(1, min(lags, n_periods - 1) + 1):
+        gamma = np.einsum('tin,tjn->nij', scores[lag:], scores[:-lag], optimize=True)
+        S += (1 - lag / (lags + 1)) * (gamma + gamma.transpose(0, 2, 1))
+    se = np.full((n_assets, k), np.nan)
+    if solvable.any():
+        inverse = np.linalg.inv(XtX[solvable])
+        se[solvable] = np.sqrt(np.einsum('nii->ni', inverse @ S[solvable] @ inverse))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = Y0.sum(axis=0) / observed
+        r2 = np.where(solvable, 1 - (residuals ** 2).sum(axis=0) / (np.where(mask, Y0 - mean, 0.0) ** 2).sum(axis=0), np.nan)
+    table = pd.DataFrame(index=returns.columns)
+    for j, name in enumerate(names):
+        table[name] = B[:, j]
+    for j, name in enumerate(names):
+        table[f'{name}_t'] = B[:, j] / se[:, j]
+    table['R2'] = r2
+    table['T'] = observed
+
+    # GRS test on the balanced panel of the assets with a regression
+    from scipy.stats import f
+
+    balanced = mask[:, solvable].all(axis=1)
+    T, N, L = int(balanced.sum()), int(solvable.sum()), k - 1
+    grs, p_value = np.nan, np.nan
+    if N and T > N + L:
+        Xb, Yb = X[balanced], Y[balanced][:, solvable]
+        coef = np.linalg.lstsq(Xb, Yb, rcond=None)[0]
+        errors = Yb - Xb @ coef
+        sigma = errors.T @ errors / T
+        factor_mean = Xb[:, 1:].mean(axis=0)
+        demeaned = Xb[:, 1:] - factor_mean
+        omega = demeaned.T @ demeaned / T
+        alpha = coef[0]
+        grs = (T - N - L) / N * (alpha @ np.linalg.solve(sigma, alpha)) / (1 + factor_mean @ np.linalg.solve(omega, factor_mean))
+        p_value = f.sf(grs, N, T - N - L)
+    return table, pd.Series({'GRS': grs, 'p-value': p_value, 'T': T, 'N': N, 'L': L})
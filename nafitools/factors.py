@@ -0,0 +1,243 @@
+import pickle
+
+import pandas as pd
+import numpy as np
+
+from .datatools import as_panel
+from .portfolio import BivariatePortfolioAnalyzer, _group_means, _total_returns
+
+def _lookup(keys, values, query, fill):
+    """
+    Values of the query keys in a sorted key array, fill where a key is not found.
+    """
+    if len(keys) == 0:
+        return np.full(len(query), fill, dtype=np.asarray(values).dtype)
+    position = np.clip(np.searchsorted(keys, query), 0, len(keys) - 1)
+    return np.where(keys[position] == query, values[position], fill)
+
+class FactorBuilder:
+    def __init__(self, df, time_column, id_column, factors, return_column='ret', size_column='me', exchange_column='exchcd',
+                 nyse_codes=(1,), rebalance=None, rebalance_month=6, size_percentiles=(50,), characteristic_percentiles=(30, 70),
+                 delisting_column=None, size_factor='SMB'):
+        """
+        Fama-French style factors from size-characteristic sorts, built one month at a time.
+
+        At each formation date, stocks with a positive size are sorted independently into size and characteristic
+        portfolios (2 x 3 by default) with NYSE breakpoints (see BivariatePortfolioAnalyzer.assign_portfolios). The
+        portfolios are held from the next month on, and each month's cell returns are weighted by the stocks' size at
+        the end of the previous month. A characteristic factor is the average high minus the average low cell across
+        size groups (e.g. HML = 1/2 (SH + BH) - 1/2 (SL + BL)), and the size factor the average small minus the
+        average big cell across the characteristic groups of the annually rebalanced sorts.
+
+        Only the current portfolios and the last month's sizes are kept besides the factor history, so a new month
+        extends the series without recomputing past months (see update, save and load).
+
+        Args:
+            df (pd.DataFrame, optional): Monthly stock data used to seed the history (e.g. CRSP merged with the
+                characteristics), one row per stock and month. None starts an empty history.
+            time_column (str): The name of the column representing time periods.
+            id_column (str): The name of the column representing unique entity IDs (e.g. permno).
+            factors (dict): Factor names mapped to the characteristic they sort on, e.g. {'HML': 'bm', 'UMD': 'mom'}. The
+                characteristic of a formation month must be known at its end (e.g. the book-to-market of the last fiscal
+                year in June, or the return from t-11 to t-1 for momentum); the factor is long the high portfolios, so
+                pass a negated characteristic to be long the low ones.
+            return_column (str): The name of the column representing the month's return. Defaults to 'ret'.
+            size_column (str): The name of the column representing market equity at the end of the month. Defaults to 'me'.
+            exchange_column (str, optional): The name of the column representing the exchange code. If None, all stocks
+                are used for the breakpoints. Defaults to 'exchcd'.
+            nyse_codes (tuple): The exchange codes of the stocks used for the breakpoints. Defaults to (1,).
+            rebalance (dict, optional): Factor names mapped to 'annual' or 'monthly'. Factors not listed are rebalanced
+                annually, e.g. {'UMD': 'monthly'}.
+            rebalance_month (int): The formation month of annual rebalancing. Defaults to 6.
+            size_percentiles (tuple): The percentiles of the size breakpoints. Defaults to the median (50,).
+            characteristic_percentiles (tuple): The percentiles of the characteristic breakpoints. Defaults to (30, 70).
+            delisting_column (str, optional): The name of the column representing delisting returns, compounded with the
+                month's return as in UnivariatePortfolioAnalyzer.holding_period_returns.
+            size_factor (str, optional): The name of the size factor, None to skip it. Defaults to 'SMB'.
+        """
+        rebalance = rebalance or {}
+        if any(value not in ['monthly', 'annual'] for value in rebalance.values()):
+            raise ValueError("Invalid rebalance. Choose from 'monthly' or 'annual'.")
+
+        self.time_column = time_column
+        self.id_column = id_column
+        self.factors = dict(factors)
+        self.return_column = return_column
+        self.size_column = size_column
+        self.exchange_column = exchange_column
+        self.nyse_codes = tuple(nyse_codes)
+        self.rebalance = {name: rebalance.get(name, 'annual') for name in self.factors}
+        self.rebalance_month = rebalance_month
+        self.size_percentiles = list(size_percentiles)
+        self.characteristic_percentiles = list(characteristic_percentiles)
+        self.delisting_column = delisting_column
+        self.size_factor = size_factor
+
+        self.shape = (len(self.size_percentiles) + 1, len(self.characteristic_percentiles) + 1)
+        self.last_time = None
+        self._holdings = {}
+        self._sizes = None
+        self._times, self._factor_rows, self._cell_rows = [], [], []
+
+        if df is not None:
+            self.update(df)
+
+    @property
+    def columns(self):
+        """
+        The names of the factors in the order of the history.
+        """
+        return ([self.size_factor] if self.size_factor else []) + list(self.factors)
+
+    @property
+    def history(self):
+        """
+        The factor returns of every month after the first, NaN before a factor's first formation.
+        """
+        return pd.DataFrame(np.array(self._factor_rows).reshape(len(self._times), len(self.columns)),
+                            index=pd.Index(self._times, name=self.time_column), columns=self.columns)
+
+    @property
+    def portfolio_returns(self):
+        """
+        The value-weighted returns of the cells of every sort, with the columns (factor, size portfolio, characteristic portfolio).
+        """
+        columns = pd.MultiIndex.from_product([list(self.factors), range(1, self.shape[0] + 1), range(1, self.shape[1] + 1)],
+                                             names=['factor', 'size', 'characteristic'])
+        return pd.DataFrame(np.array(self._cell_rows).reshape(len(self._times), len(columns)),
+                            index=pd.Index(self._times, name=self.time_column), columns=columns)
+
+    def _form(self, month, name):
+        """
+        Sorted IDs and 0-based cells (size-major) of the month's stocks in the portfolios of one factor.
+        """
+        characteristic = self.factors[name]
+        month = month[month[self.size_column] > 0]
+        mask = month[self.exchange_column].isin(self.nyse_codes).to_numpy() if self.exchange_column else None
+        analyzer = BivariatePortfolioAnalyzer(month, self.time_column, self.id_column)
+        portfolios = analyzer.assign_portfolios(
+            {self.size_column: self.shape[0], characteristic: self.shape[1]},
+            custom_percentiles={self.size_column: self.size_percentiles, characteristic: self.characteristic_percentiles},
+            breakpoint_mask=mask,
+        )
+        cells = ((portfolios[f'portfolio_{self.size_column}'].to_numpy(dtype=np.int64) - 1) * self.shape[1]
+                 + portfolios[f'portfolio_{characteristic}'].to_numpy(dtype=np.int64) - 1)
+        ids = portfolios[self.id_column].to_numpy()
+        order = np.argsort(ids, kind='stable')
+        return ids[order], cells[order]
+
+    def _step(self, time, month):
+        """
+        Record the month's returns of the held portfolios, then form the portfolios of the month.
+        """
+        ids = month[self.id_column].to_numpy()
+        returns = _total_returns(month, self.return_column, self.delisting_column)
+
+        if self._sizes is not None:
+            n_cells = self.shape[0] * self.shape[1]
+            weights = _lookup(*self._sizes, ids, np.nan)
+            cell_returns = []
+            for name in self.factors:
+                means = np.full(n_cells, np.nan)
+                if name in self._holdings:
+                    cells = _lookup(*self._holdings[name], ids, -1)
+                    held = (cells >= 0) & ~np.isnan(returns) & (weights > 0)
+                    means = _group_means(cells[held], n_cells, returns[held], weights[held])
+                cell_returns.append(means.reshape(self.shape))
+            cell_returns = np.array(cell_returns)
+
+            # High minus low characteristic, and small minus big size, averaged over the other dimension
+            factors = cell_returns[:, :, -1].mean(axis=1) - cell_returns[:, :, 0].mean(axis=1)
+            if self.size_factor:
+                annual = [k for k, name in enumerate(self.factors) if self.rebalance[name] == 'annual']
+                size = cell_returns[annual, 0, :].mean(axis=1) - cell_returns[annual, -1, :].mean(axis=1)
+                factors = np.concatenate([[size.mean() if len(annual) else np.nan], factors])
+
+            self._times.append(time)
+            self._factor_rows.append(factors)
+            self._cell_rows.append(cell_returns.ravel())
+
+        for name in self.factors:
+            if self.rebalance[name] == 'monthly' or pd.Timestamp(time).month == self.rebalance_month:
+                self._holdings[name] = self._form(month, name)
+
+        sizes = month[self.size_column].to_numpy(dtype=np.float64)
+        order = np.argsort(ids, kind='stable')
+        self._sizes = (ids[order], sizes[order])
+        self.last_time = time
+
+    def update(self, df):
+        """
+        Add new months.
+
+        Args:
+            df (pd.DataFrame): The stock data of the new months, with the columns of the seed data. All months must come
+                after the stored ones and follow them without gaps, as returns are weighted by the previous month's size;
+                a ValueError is raised otherwise.
+
+        Returns:
+            pd.DataFrame: The factor returns of the new months.
+        """
+        panel = as_panel(df, self.time_column, self.id_column)
+        if self.last_time is not None and panel.n_periods and panel.times[0] <= self.last_time:
+            raise ValueError("New periods must come after the stored periods")
+        times = ([self.last_time] if self.last_time is not None else []) + list(panel.times)
+        if (np.diff(pd.DatetimeIndex(times).to_period('M').asi8) != 1).any():
+            raise ValueError("Months must be consecutive and follow the last stored month")
+
+        start = len(self._times)
+        for k, time in enumerate(panel.times):
+            self._step(time, panel.period(k))
+        return self.history.iloc[start:]
+
+    def save(self, path):
+        """
+        Save the builder (settings, current portfolios, last sizes and history) to a pickle file.
+
+        Args:
+            path (str): The path of the file.
+        """
+        with open(path, 'wb') as file:
+            pickle.dump(self, file)
+
+    @staticmethod
+    def load(path):
+        """
+        Load a builder saved with save.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            FactorBuilder: The builder, ready for update.
+        """
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+    def validate(self, ff, time_column='date'):
+        """
+        Compare the factors with the published Fama-French factors, month by month.
+
+        Args:
+            ff (pd.DataFrame): The Fama-French factors, e.g. from wrdsdata.get_ff_monthly (ff.factors_monthly). Each factor
+                is matched to the column with its lower-case name (smb, hml, umd).
+            time_column (str): The name of the column representing time periods in ff. Defaults to 'date'.
+
+        Returns:
+            pd.DataFrame: For each matched factor, the correlation (Corr), the means of the built and published factors
+                (Mean, Mean_FF), the tracking error, i.e. the standard deviation of their difference (TE), and the number
+                of common months (T).
+        """
+        history = self.history
+        history.index = pd.DatetimeIndex(history.index).to_period('M')
+        ff = ff.set_index(pd.DatetimeIndex(ff[time_column]).to_period('M'))
+
+        rows = {}
+        for name in history.columns:
+            if name.lower() not in ff.columns:
+                continue
+            both = pd.concat([history[name], ff[name.lower()].astype(np.float64)], axis=1, join='inner').dropna()
+            built, published = both.iloc[:, 0], both.iloc[:, 1]
+            rows[name] = {'Corr': built.corr(published), 'Mean': built.mean(), 'Mean_FF': published.mean(),
+                          'TE': (built - published).std(), 'T': len(both)}
+        return pd.DataFrame.from_dict(rows, orient='index', columns=['Corr', 'Mean', 'Mean_FF', 'TE', 'T'])
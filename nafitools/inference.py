@@ -0,0 +1,75 @@
+import pandas as pd
+import numpy as np
+
+def rule_of_thumb_lags(n):
+    """
+    Newey-West lag length floor(4 (n / 100)^(2/9)) for n observations.
+    """
+    return np.floor(4 * (np.asarray(n, dtype=np.float64) / 100) ** (2 / 9)).astype(np.int64)
+
+def _autocovariances(scores, max_lag):
+    """
+    Sums of u_t u_{t-l} over t for l = 0, ..., max_lag, for all columns at once (zeros mark missing values).
+    """
+    n = len(scores)
+    gamma = np.zeros((max_lag + 1, scores.shape[1]))
+    for lag in range(min(max_lag, n - 1) + 1):
+        gamma[lag] = (scores[lag:] * scores[:n - lag]).sum(axis=0)
+    return gamma
+
+def newey_west(series, lags=None, weights=None):
+    """
+    Time-series means of many series with their Newey-West (HAC) standard errors and t-statistics.
+
+    The autocovariances of all series are computed together on a (periods x series) matrix in which missing values
+    contribute nothing, so series may have different missing periods. The variance of each mean uses the Bartlett
+    kernel with the series' own lag length.
+
+    Args:
+        series (pd.DataFrame or np.ndarray): A periods x series matrix (a pd.Series is treated as one series).
+        lags (int, str or None): The number of lags. None uses floor(4 (T / 100)^(2/9)) for each series' number of
+            observations T, and 'auto' the data-dependent choice of Newey and West (1994). Defaults to None.
+        weights (array-like, optional): Weights of the observations (same shape as series) for weighted means.
+
+    Returns:
+        pd.DataFrame: The Mean, SE, t-statistic (t), number of lags (Lags) and observations (T) of each series.
+    """
+    if isinstance(series, pd.Series):
+        series = series.to_frame()
+    names = series.columns if isinstance(series, pd.DataFrame) else pd.RangeIndex(np.shape(series)[1])
+    values = np.asarray(series, dtype=np.float64)
+    observed = ~np.isnan(values)
+    w = np.where(observed, 1.0 if weights is None else np.asarray(weights, dtype=np.float64), 0.0)
+    n = observed.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total = w.sum(axis=0)
+        mean = np.where(observed, w * values, 0.0).sum(axis=0) / total
+        # Scores whose summed autocovariances give the variance of the (weighted) mean
+        scores = np.where(observed, w * (values - mean) / total, 0.0)
+
+    if lags is None:
+        lag_lengths = rule_of_thumb_lags(n)
+    elif lags == 'auto':
+        bandwidth = rule_of_thumb_lags(n)
+        gamma = _autocovariances(scores, int(bandwidth.max(initial=0)))
+        j = np.arange(len(gamma))[:, None]
+        inside = (j >= 1) & (j <= bandwidth)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s0 = gamma[0] + 2 * np.where(inside, gamma, 0.0).sum(axis=0)
+            s1 = 2 * np.where(inside, j * gamma, 0.0).sum(axis=0)
+            rate = 1.1447 * ((s1 / s0) ** 2) ** (1 / 3)
+        lag_lengths = np.nan_to_num(np.floor(rate * n ** (1 / 3)), nan=0.0).astype(np.int64)
+        lag_lengths = np.clip(lag_lengths, 0, np.maximum(n - 1, 0))
+    else:
+        lag_lengths = np.full(values.shape[1], int(lags), dtype=np.int64)
+
+    gamma = _autocovariances(scores, int(lag_lengths.max(initial=0)))
+    j = np.arange(len(gamma))[:, None]
+    kernel = np.where(j == 0, 1.0, 2 * np.clip(1 - j / (lag_lengths + 1), 0.0, None))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        se = np.sqrt((kernel * gamma).sum(axis=0))
+        se = np.where(n > 1, se, np.nan)
+        tstat = mean / se
+
+    return pd.DataFrame({'Mean': mean, 'SE': se, 't': tstat, 'Lags': lag_lengths, 'T': n}, index=names)
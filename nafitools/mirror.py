@@ -0,0 +1,239 @@
+import os
+import argparse
+
+import pandas as pd
+
+from .wrdsdata import wrdsdata, _format_date
+
+
+# Mirrored tables with their date column and entity id column (None for the factor tables). Tables without a date
+# column (the CRSP names tables joined by the filtered getters) are synced whole
+MIRROR_TABLES = {
+    'crsp.msf': ('date', 'permno'),
+    'crsp.dsf': ('date', 'permno'),
+    'crsp.msenames': (None, 'permno'),
+    'crsp.dsenames': (None, 'permno'),
+    'comp.funda': ('datadate', 'gvkey'),
+    'comp.fundq': ('datadate', 'gvkey'),
+    'ff.factors_daily': ('date', None),
+    'ff.factors_monthly': ('date', None),
+    'contrib_global_factor.global_factor': ('date', 'gvkey'),
+}
+
+
+def _column_type(sql_type, engine):
+    """
+    Map a column type of the source database (e.g. 'double precision', 'character varying') to a mirror column type.
+    """
+    sql_type = sql_type.lower()
+    duckdb = engine == 'duckdb'
+    if 'char' in sql_type or 'text' in sql_type:
+        return 'VARCHAR' if duckdb else 'TEXT'
+    if 'timestamp' in sql_type:
+        return 'TIMESTAMP' if duckdb else 'TEXT'
+    if sql_type == 'date':
+        # SQLite stores the ISO strings written by _insert; the declared type keeps them recognizable as dates
+        return 'DATE'
+    if 'bool' in sql_type:
+        return 'BOOLEAN' if duckdb else 'INTEGER'
+    if 'int' in sql_type and 'interval' not in sql_type:
+        return 'BIGINT' if duckdb else 'INTEGER'
+    if any(name in sql_type for name in ['numeric', 'decimal', 'double', 'real', 'float']):
+        return 'DOUBLE' if duckdb else 'REAL'
+    return 'VARCHAR' if duckdb else 'TEXT'
+
+
+class LocalMirror:
+    def __init__(self, path, engine='duckdb'):
+        """
+        Local DuckDB or SQLite mirror of WRDS tables that can be used as the connection of wrdsdata.
+
+        Tables keep their WRDS schema-qualified names (e.g. crsp.dsf) and are indexed on (date, id), so the
+        wrdsdata getters run unchanged against local storage (except get_nyse_breakpoints on SQLite, which lacks
+        percentile_cont):
+
+            mirror = LocalMirror('~/wrds_mirror')
+            mirror.sync(wrdsdata(), sdate='1960-01-01')
+            data = wrdsdata(db=mirror)
+
+        Args:
+            path (str): Directory of the mirror. DuckDB uses one file, SQLite one file per schema.
+            engine (str): 'duckdb' or 'sqlite'. Defaults to 'duckdb'.
+        """
+        if engine not in ['duckdb', 'sqlite']:
+            raise ValueError("Engine must be either 'duckdb' or 'sqlite'")
+
+        self.path = os.path.expanduser(path)
+        self.engine = engine
+        os.makedirs(self.path, exist_ok=True)
+
+        schemas = sorted({table.split('.')[0] for table in MIRROR_TABLES})
+        if engine == 'duckdb':
+            import duckdb
+            self.connection = duckdb.connect(os.path.join(self.path, 'wrds.duckdb'))
+            for schema in schemas:
+                self.connection.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        else:
+            import sqlite3
+            self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+            for schema in schemas:
+                self.connection.execute(f"ATTACH DATABASE '{os.path.join(self.path, schema + '.sqlite')}' AS {schema}")
+
+    @property
+    def dialect(self):
+        """
+        The SQL dialect of the mirror, used by the wrdsdata getters that aggregate on the server.
+        """
+        return self.engine
+
+    def raw_sql(self, sql, date_cols=None):
+        """
+        Run a query on the mirror.
+
+        Args:
+            sql (str): The SQL query.
+            date_cols (list of str, optional): Columns to parse as dates. The mirrored date columns are always parsed.
+
+        Returns:
+            pd.DataFrame: The query result.
+        """
+        if self.engine == 'duckdb':
+            df = self.connection.execute(sql).df()
+        else:
+            df = pd.read_sql_query(sql, self.connection)
+        date_columns = {date_column for date_column, _ in MIRROR_TABLES.values() if date_column} | set(date_cols or [])
+        for column in date_columns & set(df.columns):
+            df[column] = pd.to_datetime(df[column])
+        return df
+
+    def close(self):
+        self.connection.close()
+
+    def tables(self):
+        """
+        Return the mirrored tables that exist locally.
+        """
+        if self.engine == 'duckdb':
+            names = self.connection.execute("SELECT table_schema || '.' || table_name FROM information_schema.tables").fetchall()
+            existing = {name for (name,) in names}
+        else:
+            existing = set()
+            for schema in {table.split('.')[0] for table in MIRROR_TABLES}:
+                names = self.connection.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'").fetchall()
+                existing |= {f'{schema}.{name}' for (name,) in names}
+        return [table for table in MIRROR_TABLES if table in existing]
+
+    def _create(self, table, types):
+        date_column, id_column = MIRROR_TABLES[table]
+        definition = ', '.join(f'"{column}" {column_type}' for column, column_type in types.items())
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definition})")
+
+        index_columns = [column for column in [date_column, id_column] if column]
+        schema, name = table.split('.')
+        if self.engine == 'duckdb':
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{name} ON {table} ({', '.join(index_columns)})")
+        else:
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_{name} ON {name} ({', '.join(index_columns)})")
+
+    def _insert(self, table, df, types):
+        # Coerce every chunk to the table's types, as sparse chunks come back as object or all-missing columns
+        df = df.copy()
+        for column, column_type in types.items():
+            if column not in df.columns:
+                continue
+            if column_type in ['BIGINT', 'INTEGER', 'DOUBLE', 'REAL', 'BOOLEAN']:
+                df[column] = pd.to_numeric(df[column], errors='coerce')
+            elif column_type in ['DATE', 'TIMESTAMP'] or column == MIRROR_TABLES[table][0]:
+                df[column] = pd.to_datetime(df[column])
+            elif column_type in ['VARCHAR', 'TEXT']:
+                df[column] = df[column].astype(object).where(df[column].notna(), None)
+        if self.engine == 'duckdb':
+            self.connection.register('_chunk', df)
+            self.connection.execute(f"INSERT INTO {table} BY NAME SELECT * FROM _chunk")
+            self.connection.unregister('_chunk')
+        else:
+            for column in df.columns:
+                if pd.api.types.is_datetime64_any_dtype(df[column]):
+                    df[column] = df[column].dt.strftime('%Y-%m-%d')
+            df = df.astype(object).where(df.notna(), None)
+            columns = ', '.join(f'"{column}"' for column in df.columns)
+            placeholders = ', '.join('?' * len(df.columns))
+            self.connection.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", df.itertuples(index=False, name=None))
+            self.connection.commit()
+
+    def sync(self, source, tables=None, sdate='1925-01-01', edate=None, partition='Y'):
+        """
+        Refresh the mirror from WRDS for a date range.
+
+        Rows of the date range are replaced one partition at a time, so memory is bounded by one partition. Tables
+        without a date column (the CRSP names tables) are replaced whole.
+
+        Args:
+            source (wrdsdata): The loader used to read from WRDS.
+            tables (list of str, optional): Tables to refresh. If None, all MIRROR_TABLES are refreshed.
+            sdate (str): Start date. Defaults to '1925-01-01'.
+            edate (str, optional): End date. Defaults to today.
+            partition (str): Pandas frequency of the refresh partitions. Defaults to 'Y'.
+
+        Returns:
+            pd.DataFrame: The number of rows written per table.
+        """
+        if tables is None:
+            tables = list(MIRROR_TABLES)
+        if edate is None:
+            edate = pd.Timestamp.today()
+        sdate, edate = _format_date(sdate), _format_date(edate)
+
+        rows = {}
+        for table in tables:
+            date_column, _ = MIRROR_TABLES[table]
+            # Column types come from the source schema, not from the first (possibly empty or sparse) chunk
+            schema = source.describe_table(table)
+            types = {name: _column_type(sql_type, self.engine) for name, sql_type in zip(schema['name'], schema['type'])}
+            exists = table in self.tables()
+            if not exists:
+                self._create(table, types)
+            if date_column is None:
+                if exists:
+                    self.connection.execute(f"DELETE FROM {table}")
+                df = source.get_table(table)
+                self._insert(table, df, types)
+                rows[table] = len(df)
+                print(f"Synced {table}: {rows[table]} rows")
+                continue
+            if exists:
+                self.connection.execute(f"DELETE FROM {table} WHERE {date_column} BETWEEN '{sdate}' AND '{edate}'")
+                if self.engine == 'sqlite':
+                    self.connection.commit()
+            rows[table] = 0
+            for df in source.iter_table(table, date_column, sdate, edate, partition=partition):
+                self._insert(table, df, types)
+                rows[table] += len(df)
+            print(f"Synced {table}: {rows[table]} rows between {sdate} and {edate}")
+
+        return pd.DataFrame({'Rows': rows})
+
+
+def main(argv=None):
+    """
+    Command line entry point: nafitools-mirror PATH [--tables ...] [--sdate ...] [--edate ...] [--engine ...]
+    """
+    parser = argparse.ArgumentParser(description='Refresh a local mirror of WRDS tables.')
+    parser.add_argument('path', help='Directory of the mirror.')
+    parser.add_argument('--tables', nargs='*', default=None, choices=list(MIRROR_TABLES), help='Tables to refresh (default: all).')
+    parser.add_argument('--sdate', default='1925-01-01', help='Start date.')
+    parser.add_argument('--edate', default=None, help='End date (default: today).')
+    parser.add_argument('--engine', default='duckdb', choices=['duckdb', 'sqlite'])
+    parser.add_argument('--max-connections', type=int, default=1, help='Connections used to fetch the months of a year concurrently.')
+    args = parser.parse_args(argv)
+
+    source = wrdsdata(max_connections=args.max_connections, shard='M' if args.max_connections > 1 else None)
+    mirror = LocalMirror(args.path, args.engine)
+    try:
+        mirror.sync(source, args.tables, args.sdate, args.edate)
+    finally:
+        mirror.close()
+
+
+if __name__ == '__main__':
+    main()
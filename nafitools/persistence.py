@@ -1,88 +1,114 @@
 import pandas as pd
 import numpy as np
 
-def cal_cs_persistence(df, time_column, value_columns, entity_column=None, max_tau=5):
+from .datatools import as_panel
+
+def _step(offset):
+    """
+    Length of one period: the given offset, parsed if it is a string, else one month.
+    """
+    if offset is None:
+        return pd.DateOffset(months=1)
+    if isinstance(offset, str):
+        return pd.tseries.frequencies.to_offset(offset)
+    return offset
+
+def _future_index(times, max_tau, offset=None, freq=None):
+    """
+    Position of the period tau steps after each period, or -1 if it is not observed.
+
+    Args:
+        times (array-like): Sorted unique time periods.
+        max_tau (int): The maximum number of periods apart.
+        offset (pd.DateOffset, str or scalar, optional): Length of one step, added tau times. Defaults to one month.
+        freq (str, optional): Pandas period frequency. If given, periods are matched on calendar periods instead of dates.
+
+    Returns:
+        np.ndarray: A (len(times), max_tau) integer array.
+    """
+    if offset is not None and freq is not None:
+        raise ValueError("Specify either offset or freq, not both")
+
+    times = pd.Index(times)
+    future = np.full((len(times), max_tau), -1, dtype=np.int64)
+    if freq is not None:
+        ordinals = pd.Index(pd.DatetimeIndex(times).to_period(freq).asi8)
+        if not ordinals.is_unique:
+            raise ValueError(f"Several periods of the data fall into the same '{freq}' period")
+        for tau in range(1, max_tau + 1):
+            future[:, tau - 1] = ordinals.get_indexer(ordinals + tau)
+        return future
+
+    offset = _step(offset)
+    for tau in range(1, max_tau + 1):
+        future[:, tau - 1] = times.get_indexer(times + offset * tau)
+    return future
+
+def _pair_corr(groups, x, y, n_groups):
+    """
+    Pearson correlations of paired observations by group, summed sequentially so results do not depend on batching.
+
+    Args:
+        groups (np.ndarray): Group code of each complete pair.
+        x, y (np.ndarray): The paired values.
+        n_groups (int): The number of groups.
+
+    Returns:
+        np.ndarray: The correlation of each group, NaN where it is undefined.
+    """
+    n = np.bincount(groups, minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dx = x - (np.bincount(groups, x, n_groups) / n)[groups]
+        dy = y - (np.bincount(groups, y, n_groups) / n)[groups]
+        numerator = np.bincount(groups, dx * dy, n_groups)
+        denominator = np.sqrt(np.bincount(groups, dx * dx, n_groups) * np.bincount(groups, dy * dy, n_groups))
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+def cal_cs_persistence(df, time_column, value_columns, entity_column=None, max_tau=5, offset=None, freq=None):
     """
     Calculate the cross-sectional Pearson correlations for multiple variables measured tau periods apart for multiple tau values.
+
+    Each variable is pivoted into a (periods x entities) matrix, and the correlations for all tau are taken between
+    rows of the matrix tau steps apart, using the entities observed in both periods.
     
     Args:
-        df (pd.DataFrame): The data frame containing the data.
+        df (pd.DataFrame or PanelFrame): The data frame containing the data. A PanelFrame's sorting and period slices are reused.
         time_column (str): The name of the column representing time periods.
         value_columns (list of str): The names of the columns representing the values of the variables.
-        entity_column (str or None): The name of the column representing the entities. If None, calculate persistence without entity grouping.
+        entity_column (str or None): The name of the column representing the entities. If None, rows are paired by their position within each period.
         max_tau (int): The maximum number of periods apart to measure persistence.
+        offset (pd.DateOffset, str or scalar, optional): Length of one period; the period tau steps after t is t + tau * offset.
+            Defaults to pd.DateOffset(months=1). Use a number for integer time columns (e.g. years).
+        freq (str, optional): Pandas period frequency (e.g. 'M', 'Q', 'Y'). If given, periods tau steps apart are matched
+            on calendar periods, so month-end and month-start dates are treated alike.
     
     Returns:
         dict of pd.DataFrame: A dictionary containing the persistence correlations for each variable.
     """
-    persistence_results = {}
+    panel = as_panel(df, time_column, entity_column)
+    future = _future_index(panel.times, max_tau, offset, freq)
 
+    if entity_column:
+        id_codes, n_entities = panel.id_codes, panel.n_entities
+    else:
+        # Without entities, rows are paired by their position within the period
+        id_codes = np.arange(len(panel)) - panel.offsets[panel.time_codes]
+        n_entities = int(panel.counts.max()) if len(panel) else 0
+
+    persistence_results = {}
     for value_column in value_columns:
-        # Ensure the dataframe is sorted by the time column (and entity column if provided)
-        if entity_column:
-            df = df.sort_values(by=[time_column, entity_column]).reset_index(drop=True)
-        else:
-            df = df.sort_values(by=[time_column]).reset_index(drop=True)
-        
-        # Create a dictionary to store the results
-        results = {f't+{tau}': [] for tau in range(1, max_tau + 1)}
-        results['Year'] = []
-
-        # Get unique time periods
-        unique_times = df[time_column].unique()
-
-        # Loop over each time period
-        for t in unique_times:
-            period_df = df[df[time_column] == t]
-            
-            if len(period_df) == 0:
-                continue
-
-            correlations = []
-            
-            for tau in range(1, max_tau + 1):
-                future_time = t + pd.DateOffset(months=tau)
-                
-                if future_time not in unique_times:
-                    correlations.append(np.nan)
-                    continue
-                
-                shifted_df = df[df[time_column] == future_time]
-                
-                if entity_column:
-                    # Merge on entities to ensure we only consider those with valid values for both t and t+tau
-                    merged_df = pd.merge(period_df, shifted_df, on=entity_column, suffixes=('', f'_shifted_{tau}'))
-                else:
-                    # If no entity column, just ensure both periods have data
-                    merged_df = pd.concat([period_df.reset_index(), shifted_df.reset_index()], axis=1, keys=['t', 't+tau'])
-
-                if len(merged_df) == 0:
-                    correlations.append(np.nan)
-                    continue
-                
-                # Calculate means
-                X_t = merged_df[value_column] if entity_column else merged_df[('t', value_column)]
-                X_t_tau = merged_df[f'{value_column}_shifted_{tau}'] if entity_column else merged_df[('t+tau', value_column)]
-                mean_X_t = X_t.mean()
-                mean_X_t_tau = X_t_tau.mean()
-
-                # Calculate numerator and denominator separately
-                numerator = ((X_t - mean_X_t) * (X_t_tau - mean_X_t_tau)).sum()
-                denominator = np.sqrt(((X_t - mean_X_t) ** 2).sum() * ((X_t_tau - mean_X_t_tau) ** 2).sum())
-                
-                if denominator == 0:
-                    correlations.append(np.nan)
-                else:
-                    pearson_corr = numerator / denominator
-                    correlations.append(pearson_corr)
-            
-            results['Year'].append(t)
-            for tau, corr in zip(range(1, max_tau + 1), correlations):
-                results[f't+{tau}'].append(corr)
-        
-        results_df = pd.DataFrame(results)
-        results_df.set_index('Year', inplace=True)
-        persistence_results[value_column] = results_df
+        matrix = np.full((panel.n_periods, n_entities), np.nan)
+        matrix[panel.time_codes, id_codes] = panel.data[value_column].to_numpy(dtype=np.float64)
+
+        results = pd.DataFrame(np.nan, index=pd.Index(panel.times, name='Year'),
+                               columns=[f't+{tau}' for tau in range(1, max_tau + 1)])
+        for tau in range(1, max_tau + 1):
+            source = np.flatnonzero(future[:, tau - 1] >= 0)
+            x, y = matrix[source], matrix[future[source, tau - 1]]
+            valid = ~np.isnan(x) & ~np.isnan(y)
+            rows = np.nonzero(valid)[0]
+            results.iloc[source, tau - 1] = _pair_corr(rows, x[valid], y[valid], len(source))
+        persistence_results[value_column] = results
 
     return persistence_results
 
@@ -107,4 +133,93 @@ def calculate_average_persistence(persistence_results, max_tau):
 
     avg_persistence_df = pd.DataFrame(avg_persistence)
     avg_persistence_df.set_index('Variable', inplace=True)
-    return avg_persistence_df
\ No newline at end of file
+    return avg_persistence_df
+
+
+class PersistenceUpdater:
+    def __init__(self, df, time_column, value_columns, entity_column=None, max_tau=5, offset=None, freq=None):
+        """
+        Persistence history that is extended one period at a time.
+
+        Besides the stored per-period correlations, only the cross-sections of the periods whose t + max_tau * offset
+        (or max_tau calendar periods with freq) has not passed yet are kept. A new period fills the t+tau correlations of the periods tau steps before it, with the same pairing and
+        summation order as cal_cs_persistence, so the history is identical to a full recompute.
+
+        Args:
+            df (pd.DataFrame or PanelFrame): The data used to seed the history.
+            time_column, value_columns, entity_column, max_tau, offset, freq: See cal_cs_persistence.
+        """
+        self.time_column = time_column
+        self.value_columns = list(value_columns)
+        self.entity_column = entity_column
+        self.max_tau = max_tau
+        self.offset = offset
+        self.freq = freq
+
+        panel = as_panel(df, time_column, entity_column)
+        self.results = cal_cs_persistence(panel, time_column, self.value_columns, entity_column, max_tau, offset, freq)
+        self._window = [self._cross_section(panel, k) for k in range(panel.n_periods)
+                        if self._is_open(panel.times[k], panel.times[-1])]
+
+    def _is_open(self, time, latest):
+        """
+        Whether a period can still be paired with a period after latest, i.e. its last t+tau target lies after latest.
+        """
+        if self.freq is not None:
+            return pd.Period(time, self.freq).ordinal + self.max_tau > pd.Period(latest, self.freq).ordinal
+        return time + _step(self.offset) * self.max_tau > latest
+
+    def _cross_section(self, panel, k):
+        """
+        Time, sorted entities and values of the k-th period of a panel.
+        """
+        rows = slice(panel.offsets[k], panel.offsets[k + 1])
+        if self.entity_column:
+            ids = panel.ids[panel.id_codes[rows]].to_numpy()
+        else:
+            ids = np.arange(rows.stop - rows.start)
+        values = np.column_stack([panel.data[column].to_numpy(dtype=np.float64)[rows] for column in self.value_columns])
+        return panel.times[k], ids, values
+
+    def update(self, df):
+        """
+        Add new periods.
+
+        Args:
+            df (pd.DataFrame or PanelFrame): The data of the new periods. All periods must come after the stored ones.
+
+        Returns:
+            dict of pd.DataFrame: The updated persistence correlations for each variable.
+        """
+        panel = as_panel(df, self.time_column, self.entity_column)
+        columns = [f't+{tau}' for tau in range(1, self.max_tau + 1)]
+
+        for k in range(panel.n_periods):
+            time, ids, values = self._cross_section(panel, k)
+            if self._window and time <= self._window[-1][0]:
+                raise ValueError("New periods must come after the stored periods")
+
+            for value_column in self.value_columns:
+                row = pd.DataFrame(np.nan, index=pd.Index([time], name='Year'), columns=columns)
+                self.results[value_column] = pd.concat([self.results[value_column], row])
+
+            future = _future_index([cross_section[0] for cross_section in self._window] + [time], self.max_tau, self.offset, self.freq)
+            for w, tau in zip(*np.nonzero(future[:-1] == len(self._window))):
+                past_time, past_ids, past_values = self._window[w]
+                _, i, j = np.intersect1d(past_ids, ids, assume_unique=True, return_indices=True)
+                for c, value_column in enumerate(self.value_columns):
+                    x, y = past_values[i, c], values[j, c]
+                    valid = ~np.isnan(x) & ~np.isnan(y)
+                    corr = _pair_corr(np.zeros(valid.sum(), dtype=np.int64), x[valid], y[valid], 1)[0]
+                    self.results[value_column].loc[past_time, f't+{tau + 1}'] = corr
+
+            self._window = [cross_section for cross_section in self._window if self._is_open(cross_section[0], time)]
+            self._window.append((time, ids, values))
+
+        return self.results
+
+    def averages(self):
+        """
+        Time-series averages of the history (see calculate_average_persistence).
+        """
+        return calculate_average_persistence(self.results, self.max_tau)
@@ -1,16 +1,154 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
 
+from .datatools import PanelFrame, as_panel
+from .quantile_sketch import QuantileSketch
+from .inference import newey_west
+
+def _prepare_bp(breakpoints, method='drop'):
+    """
+    Sort each row of a breakpoint array and remove duplicate edges, padding rows with +inf to a common width.
+
+    Args:
+        breakpoints (np.ndarray): A periods x breakpoints array, NaN for missing breakpoints.
+        method (str): 'drop' to drop duplicate edges, 'modify' to move each duplicate to the next representable float.
+
+    Returns:
+        np.ndarray: The strictly increasing breakpoints of each period.
+    """
+    edges = np.sort(breakpoints, axis=1)
+    if edges.shape[1] > 1:
+        if method == 'drop':
+            duplicate = np.zeros(edges.shape, dtype=bool)
+            duplicate[:, 1:] = edges[:, 1:] == edges[:, :-1]
+            edges[duplicate] = np.nan
+            edges = np.sort(edges, axis=1)
+        else:
+            for k in range(1, edges.shape[1]):
+                edges[:, k] = np.where(edges[:, k] <= edges[:, k - 1], np.nextafter(edges[:, k - 1], np.inf), edges[:, k])
+    return np.where(np.isnan(edges), np.inf, edges)
+
+def _bucket(edges, groups, values):
+    """
+    0-based portfolio of each value: the number of its group's breakpoints strictly below it, i.e. a
+    searchsorted(side='left') of every value in its own row of breakpoints, for the intervals (b_{k-1}, b_k].
+    """
+    codes = np.zeros(len(values), dtype=np.int64)
+    for k in range(edges.shape[1]):
+        codes += edges[groups, k] < values
+    return codes
+
+def _group_breakpoints(groups, values, n_groups, quantiles):
+    """
+    Linear-interpolation quantiles of values by group, computed as pandas' groupby quantile does it.
+
+    Returns:
+        tuple of np.ndarray: The n_groups x len(quantiles) breakpoints (NaN for empty groups) and the group sizes.
+    """
+    # Sort by value, then (stably) by group: only the order of the values within each group matters
+    order = np.argsort(values)
+    order = order[np.argsort(groups[order], kind='stable')]
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    position = (counts[:, None] - 1) * np.asarray(quantiles, dtype=np.float64)[None, :]
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, counts[:, None] - 1)
+    empty = counts == 0
+    value = sorted_values[np.where(empty[:, None], 0, starts[:, None] + lower)] if len(values) else np.zeros(position.shape)
+    next_value = sorted_values[np.where(empty[:, None], 0, starts[:, None] + upper)] if len(values) else np.zeros(position.shape)
+    breakpoints = value + (next_value - value) * (position - lower)
+    breakpoints[empty] = np.nan
+    return breakpoints, counts
+
+def _total_returns(df, return_column, delisting_column=None):
+    """
+    Returns as float64, compounded with the delisting returns where these are given: (1 + r)(1 + r_d) - 1, or r_d
+    alone when the return is missing.
+    """
+    returns = df[return_column].to_numpy(dtype=np.float64)
+    if delisting_column is None:
+        return returns
+    delisting = df[delisting_column].to_numpy(dtype=np.float64)
+    return np.where(np.isnan(delisting), returns, (1 + np.nan_to_num(returns)) * (1 + delisting) - 1)
+
+def _group_means(groups, n_groups, values, weights=None):
+    """
+    Equal- or weight-weighted means of values by group from grouped sums, ignoring missing values and weights.
+    """
+    valid = ~np.isnan(values)
+    if weights is not None:
+        valid &= ~np.isnan(weights)
+    w = np.ones(valid.sum()) if weights is None else weights[valid]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.bincount(groups[valid], w * values[valid], n_groups) / np.bincount(groups[valid], w, n_groups)
+
+def _attach(spec):
+    """
+    Attach to a shared memory block described by (name, shape, dtype) and return it with an array view.
+    """
+    from multiprocessing import shared_memory
+
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def _sweep_worker(specs, k, n_periods, quantiles):
+    """
+    Sort on the k-th characteristic of a sweep and return its high-minus-low spread and sorted stocks per period.
+    """
+    blocks, arrays = zip(*(_attach(spec) if spec is not None else (None, None) for spec in specs))
+    try:
+        periods, characteristics, returns, weights = arrays
+        x = characteristics[k]
+        observed = ~np.isnan(x)
+        groups, x = periods[observed], x[observed]
+
+        breakpoints, counts = _group_breakpoints(groups, x, n_periods, quantiles)
+        codes = _bucket(_prepare_bp(breakpoints, 'drop'), groups, x)
+        n_portfolios = len(quantiles) + 1
+        means = _group_means(groups * n_portfolios + codes, n_periods * n_portfolios, returns[observed],
+                             weights[observed] if weights is not None else None).reshape(n_periods, n_portfolios)
+        sorted_stocks = np.bincount(groups[~np.isnan(returns[observed])], minlength=n_periods)
+        return means[:, -1] - means[:, 0], sorted_stocks
+    finally:
+        for block in blocks:
+            if block is not None:
+                block.close()
+
+def _percentiles(num_portfolios, custom_percentiles=None):
+    """
+    Breakpoint percentiles and the breakpoint column names used by cal_bp.
+    """
+    if custom_percentiles:
+        assert all(0 < p < 100 for p in custom_percentiles), "Percentiles must be between 0 and 100"
+        percentiles = custom_percentiles
+    else:
+        percentiles = [k * 100 / num_portfolios for k in range(1, num_portfolios)]
+    return percentiles, [f'B{k+1} ({round(percentiles[k], 3)})' for k in range(len(percentiles))]
+
+def _portfolio_number(portfolio):
+    """
+    Number of a portfolio code (1, 2, ...) or label ('P1', 'P2', ...), used to order portfolios numerically.
+    """
+    return int(str(portfolio).lstrip('P'))
+
 class UnivariatePortfolioAnalyzer:
     def __init__(self, df, time_column, id_column):
         """
         Initialize the UnivariatePortfolioAnalyzer with the data frame, time column, and ID column.
         
         Args:
-            df (pd.DataFrame): The data frame containing the data.
+            df (pd.DataFrame or PanelFrame): The data frame containing the data. A PanelFrame's period slices are reused.
             time_column (str): The name of the column representing time periods.
             id_column (str): The name of the column representing unique entity IDs.
         """
+        self.panel = df if isinstance(df, PanelFrame) else None
+        if self.panel is not None:
+            df = self.panel.data
         self.df = df
         self.time_column = time_column
         self.id_column = id_column
@@ -27,15 +165,10 @@ class UnivariatePortfolioAnalyzer:
         Returns:
             pd.DataFrame: A data frame containing the breakpoints for each time period.
         """
-        if custom_percentiles:
-            assert all(0 < p < 100 for p in custom_percentiles), "Percentiles must be between 0 and 100"
-            percentiles = custom_percentiles
-        else:
-            percentiles = [k * 100 / num_portfolios for k in range(1, num_portfolios)]
-        
+        percentiles, columns = _percentiles(num_portfolios, custom_percentiles)
         quantiles = [p / 100 for p in percentiles]
         breakpoints = self.df.groupby(self.time_column)[value_column].quantile(quantiles).unstack()
-        breakpoints.columns = [f'B{k+1} ({round(percentiles[k], 3)})' for k in range(len(percentiles))]
+        breakpoints.columns = columns
         return breakpoints
 
     def cal_multi_bp(self, characteristics, num_portfolios=5, custom_percentiles=None):
@@ -61,6 +194,9 @@ class UnivariatePortfolioAnalyzer:
     def modify_bp(breakpoints):
         """
         Modify breakpoints to ensure there are no duplicate edges and they are monotonically increasing.
+
+        Duplicate edges are moved up to the next representable float, so the result is deterministic and values
+        equal to a duplicated edge stay in the lowest of the tied portfolios.
         
         Args:
             breakpoints (pd.Series): A series of breakpoints for a single time period.
@@ -68,26 +204,28 @@ class UnivariatePortfolioAnalyzer:
         Returns:
             pd.Series: Modified breakpoints with no duplicates and are monotonically increasing.
         """
-        unique_breakpoints = breakpoints.drop_duplicates()
-        while len(unique_breakpoints) < len(breakpoints):
-            breakpoints += np.random.uniform(0, 1e-10, size=breakpoints.shape)
-            unique_breakpoints = breakpoints.drop_duplicates()
-        # Ensure breakpoints are monotonically increasing
-        return np.sort(breakpoints)
+        return _prepare_bp(np.asarray(breakpoints, dtype=np.float64)[None, :], 'modify')[0]
 
-    def assign_portfolios(self, breakpoints, value_column, keep_columns=None, method='drop'):
+    def assign_portfolios(self, breakpoints, value_column, keep_columns=None, method='drop', labels=False):
         """
         Assign portfolios based on calculated breakpoints.
 
+        Each row is aligned to its period's breakpoint vector and assigned to the portfolio (b_{k-1}, b_k] for all
+        periods at once. Rows of periods without breakpoints get no portfolio.
+
         Args:
             breakpoints (pd.DataFrame): The data frame containing the breakpoints for each time period.
             value_column (str): The name of the column representing the values to assign to portfolios.
             keep_columns (list of str, optional): List of column names to keep in the resulting DataFrame. If None, only time_column, value_column, and portfolio are kept.
-            method (str): Method to handle duplicate breakpoints. 'drop' to drop duplicates, 'modify' to add small random values.
+            method (str): Method to handle duplicate breakpoints. 'drop' to drop duplicates (fewer portfolios in that period),
+                'modify' to separate them by the smallest representable amount (empty portfolios in that period).
+            labels (bool): Whether to label portfolios 'P1', 'P2', ... instead of the integer codes 1, 2, ... Defaults to False.
         
         Returns:
             pd.DataFrame: The data frame with the specified columns and an additional column for portfolio assignment.
         """
+        if method not in ['drop', 'modify']:
+            raise ValueError("Invalid method. Choose from 'drop' or 'modify'.")
         if keep_columns is None:
             keep_columns = []
 
@@ -99,35 +237,83 @@ class UnivariatePortfolioAnalyzer:
         # Check for and handle duplicate index labels
         if df.index.duplicated().any():
             df = df.reset_index(drop=True)
-        
-        df['portfolio'] = np.nan
-
-        for time_period in breakpoints.index:
-            period_data = df[df[self.time_column] == time_period]
-            period_breakpoints = breakpoints.loc[time_period].dropna().values
-            
-            if method == 'drop':
-                period_breakpoints = np.unique(period_breakpoints)
-            elif method == 'modify':
-                period_breakpoints = self.modify_bp(period_breakpoints)
-            
-            # Ensure breakpoints are monotonically increasing
-            period_breakpoints = np.sort(period_breakpoints)
-
-            if not np.all(np.diff(period_breakpoints) > 0):
-                print(f"Warning: Non-monotonic breakpoints detected for period {time_period}.")
-                continue
-            
-            portfolios = pd.cut(
-                period_data[value_column],
-                bins=[-np.inf] + period_breakpoints.tolist() + [np.inf],
-                labels=[f'P{k+1}' for k in range(len(period_breakpoints) + 1)],
-                include_lowest=True
-            )
-            df.loc[period_data.index, 'portfolio'] = portfolios
+
+        edges = _prepare_bp(breakpoints.to_numpy(dtype=np.float64), method)
+        period = breakpoints.index.get_indexer(df[self.time_column])
+        matched = period >= 0
+        codes = _bucket(edges, period[matched], df[value_column].to_numpy(dtype=np.float64)[matched])
+
+        if labels:
+            portfolio = np.full(len(df), np.nan, dtype=object)
+            portfolio[matched] = np.array([f'P{k + 1}' for k in range(edges.shape[1] + 1)], dtype=object)[codes]
+        else:
+            portfolio = pd.array(np.full(len(df), pd.NA), dtype='Int64')
+            portfolio[matched] = codes + 1
+        df['portfolio'] = portfolio
 
         return df[[self.id_column, self.time_column, value_column] + keep_columns + ['portfolio']]
 
+    def rank_portfolios(self, value_columns, num_portfolios, ties='average', keep_columns=None, labels=False):
+        """
+        Assign portfolios from per-period ranks, without breakpoints.
+
+        Each characteristic is ranked within each period once (for all periods and characteristics together), and the
+        rank r of n observations goes to portfolio ceil(r * num_portfolios / n). Tied values are handled by the tie
+        policy instead of by perturbing breakpoints.
+
+        Args:
+            value_columns (str or list of str): The characteristic(s) to sort on.
+            num_portfolios (int): The number of portfolios to be formed each time period.
+            ties (str): 'average' puts tied values in the portfolio of their average rank, 'first' breaks ties by
+                order of appearance (equal portfolio sizes), 'dense' ranks distinct values (n is then the number of
+                distinct values). Defaults to 'average'.
+            keep_columns (list of str, optional): List of column names to keep in the resulting DataFrame.
+            labels (bool): Whether to label portfolios 'P1', 'P2', ... instead of the integer codes 1, 2, ... Defaults to False.
+
+        Returns:
+            pd.DataFrame: The data frame with the specified columns and the portfolio assignment. For a single column
+                rows with missing values are dropped and the assignment is in 'portfolio'; for a list of columns it is
+                in 'portfolio_{column}' for each column.
+        """
+        if ties not in ['average', 'first', 'dense']:
+            raise ValueError("Invalid ties. Choose from 'average', 'first', or 'dense'.")
+        if keep_columns is None:
+            keep_columns = []
+
+        single = isinstance(value_columns, str)
+        columns = [value_columns] if single else list(value_columns)
+        df = self.df[[self.id_column, self.time_column] + columns + keep_columns].copy()
+        if single:
+            df = df.dropna(subset=columns)
+
+        periods = df[self.time_column]
+        ranks = df.groupby(periods)[columns].rank(method=ties)
+        if ties == 'dense':
+            n = ranks.groupby(periods).transform('max')
+        else:
+            n = df.groupby(periods)[columns].transform('count')
+
+        # Average ranks are multiples of 1/2, so the portfolio is computed exactly in integers as ceil(2r * G / 2n)
+        twice_rank = np.rint(2 * ranks.to_numpy(dtype=np.float64))
+        twice_n = 2 * n.to_numpy(dtype=np.float64)
+        observed = ~np.isnan(twice_rank)
+        codes = np.zeros(twice_rank.shape, dtype=np.int64)
+        codes[observed] = -((-twice_rank[observed].astype(np.int64) * num_portfolios) // twice_n[observed].astype(np.int64))
+
+        output = [self.id_column, self.time_column] + columns + keep_columns
+        for k, column in enumerate(columns):
+            name = 'portfolio' if single else f'portfolio_{column}'
+            if labels:
+                portfolio = np.full(len(df), np.nan, dtype=object)
+                portfolio[observed[:, k]] = np.array([f'P{g}' for g in range(num_portfolios + 1)], dtype=object)[codes[observed[:, k], k]]
+            else:
+                portfolio = pd.array(np.full(len(df), pd.NA), dtype='Int64')
+                portfolio[observed[:, k]] = codes[observed[:, k], k]
+            df[name] = portfolio
+            output.append(name)
+
+        return df[output]
+
     def number_of_stocks_per_portfolio(self, portfolio_column):
         """
         Calculate the number of stocks in each portfolio per time period.
@@ -140,6 +326,52 @@ class UnivariatePortfolioAnalyzer:
         """
         return self.df.groupby([self.time_column, portfolio_column]).size().unstack(fill_value=0)
 
+    def portfolio_means(self, portfolio_column, value_columns, weight_column=None):
+        """
+        Calculate equal-weighted (and value-weighted) average values of each portfolio in each period for many columns at once.
+
+        The averages are ratios of grouped sums of weight x value and of weights over the rows where both are observed.
+        The data frame of the analyzer is not modified.
+
+        Args:
+            portfolio_column (str): The name of the column representing portfolio assignments (codes or labels).
+            value_columns (str or list of str): The name(s) of the columns representing the values to average.
+            weight_column (str, optional): The name of the column representing the weights. If None, only equal-weighted
+                averages are calculated.
+
+        Returns:
+            pd.DataFrame: The averages with the periods as rows and the columns (weighting, variable, portfolio), where
+                weighting is 'EW' or 'VW' and portfolios are in numerical order.
+        """
+        value_columns = [value_columns] if isinstance(value_columns, str) else list(value_columns)
+        assigned = self.df[portfolio_column].notna().to_numpy()
+        data = self.df[assigned]
+
+        periods, times = pd.factorize(data[self.time_column], sort=True)
+        portfolios = sorted(pd.unique(data[portfolio_column]), key=_portfolio_number)
+        codes = pd.Index(portfolios).get_indexer(data[portfolio_column])
+        n_periods, n_portfolios = len(times), len(portfolios)
+        groups = periods.astype(np.int64) * n_portfolios + codes
+
+        weightings = {'EW': None}
+        if weight_column is not None:
+            weightings['VW'] = data[weight_column].to_numpy(dtype=np.float64)
+
+        means = [_group_means(groups, n_periods * n_portfolios, data[column].to_numpy(dtype=np.float64), weights).reshape(n_periods, n_portfolios)
+                 for weights in weightings.values() for column in value_columns]
+        columns = pd.MultiIndex.from_product([list(weightings), value_columns, portfolios], names=['weighting', 'variable', portfolio_column])
+        return pd.DataFrame(np.hstack(means), index=pd.Index(times, name=self.time_column), columns=columns)
+
+    def _portfolio_table(self, portfolio_column, value_column, weight_column=None):
+        """
+        Average values of one column with the portfolios as columns (P1, P2, ...) and the high-minus-low difference.
+        """
+        means = self.portfolio_means(portfolio_column, value_column, weight_column)
+        table = means['VW' if weight_column is not None else 'EW'][value_column]
+        table.columns = [f'P{k+1}' for k in range(len(table.columns))]
+        table['diff'] = table.iloc[:, -1] - table.iloc[:, 0]
+        return table
+
     def cal_port_value(self, portfolio_column, value_column, weight_column=None):
         """
         Calculate average values for each portfolio and the difference between the highest and lowest portfolios.
@@ -152,22 +384,21 @@ class UnivariatePortfolioAnalyzer:
         Returns:
             pd.DataFrame: A data frame with the average values for each portfolio and the difference between the highest and lowest portfolios for each time period.
         """
-        if weight_column is None:
-            self.df['weight'] = 1
-        else:
-            self.df['weight'] = self.df[weight_column]
-
-        self.df['weighted_value'] = self.df[value_column] * self.df['weight']
-        avg_values = self.df.groupby([self.time_column, portfolio_column]).apply(lambda x: x['weighted_value'].sum() / x['weight'].sum()).reset_index(name=f'avg_{value_column}')
-
-        # Calculate the difference between the highest and lowest portfolios for each time period
-        high_portfolio = f'P{self.df[portfolio_column].nunique()}'
-        low_portfolio = 'P1'
-        
-        diff_values = avg_values.pivot(index=self.time_column, columns=portfolio_column, values=f'avg_{value_column}')
-        diff_values['diff'] = diff_values[high_portfolio] - diff_values[low_portfolio]
-        
-        return avg_values, diff_values[['diff']].reset_index()
+        means = self.portfolio_means(portfolio_column, value_column, weight_column)
+        pivot = means['VW' if weight_column is not None else 'EW'][value_column]
+
+        # Keep the (period, portfolio) pairs that have rows, as a groupby over them would
+        counts = self.number_of_stocks_per_portfolio(portfolio_column).reindex(index=pivot.index, columns=pivot.columns, fill_value=0)
+        present = counts.to_numpy() > 0
+        rows, columns = np.nonzero(present)
+        avg_values = pd.DataFrame({
+            self.time_column: pivot.index[rows],
+            portfolio_column: pivot.columns[columns],
+            f'avg_{value_column}': pivot.to_numpy()[present],
+        })
+
+        diff_values = pd.DataFrame({'diff': pivot.iloc[:, -1] - pivot.iloc[:, 0]})
+        return avg_values, diff_values.reset_index()
     
     def calculate_average_portfolio_values(self, portfolio_column, value_column, weight_column=None):
         """
@@ -181,26 +412,7 @@ class UnivariatePortfolioAnalyzer:
         Returns:
             pd.DataFrame: A data frame with the average values for each portfolio and the difference between the highest and lowest portfolios for each time period.
         """
-        if weight_column is None:
-            self.df['weight'] = 1
-        else:
-            self.df['weight'] = self.df[weight_column]
-
-        self.df['weighted_value'] = self.df[value_column] * self.df['weight']
-        avg_values = self.df.groupby([self.time_column, portfolio_column]).apply(lambda x: x['weighted_value'].sum() / x['weight'].sum()).reset_index(name=f'avg_{value_column}')
-
-        # Pivot the average values to get portfolios as columns
-        pivot_avg_values = avg_values.pivot(index=self.time_column, columns=portfolio_column, values=f'avg_{value_column}')
-        
-        # Calculate the difference between the highest and lowest portfolios for each time period
-        high_portfolio = pivot_avg_values.columns[-1]
-        low_portfolio = pivot_avg_values.columns[0]
-        pivot_avg_values['diff'] = pivot_avg_values[high_portfolio] - pivot_avg_values[low_portfolio]
-        
-        # Rename columns to match the required format
-        pivot_avg_values.columns = [f'P{k+1}' for k in range(len(pivot_avg_values.columns) - 1)] + ['diff']
-        
-        return pivot_avg_values.reset_index()
+        return self._portfolio_table(portfolio_column, value_column, weight_column).reset_index()
 
     def calculate_portfolio_returns(self, portfolio_column, return_column, weight_column=None):
         """
@@ -214,39 +426,471 @@ class UnivariatePortfolioAnalyzer:
         Returns:
             pd.DataFrame: A data frame with the average returns for each portfolio and the difference between the highest and lowest portfolios for each time period.
         """
-        if weight_column is None:
-            self.df['weight'] = 1
-        else:
-            self.df['weight'] = self.df[weight_column]
+        return self._portfolio_table(portfolio_column, return_column, weight_column).reset_index()
 
-        self.df['weighted_return'] = self.df[return_column] * self.df['weight']
-        avg_returns = self.df.groupby([self.time_column, portfolio_column]).apply(lambda x: x['weighted_return'].sum() / x['weight'].sum()).reset_index(name=f'avg_{return_column}')
+    def holding_period_returns(self, portfolios, return_column, weight_column=None, holding_period=1, rebalance='monthly',
+                               rebalance_month=6, overlapping=False, delisting_column=None, portfolio_column='portfolio'):
+        """
+        Calculate the returns of portfolios formed at t and held over t+1, ..., t+holding_period.
 
-        # Pivot the average returns to get portfolios as columns
-        pivot_avg_returns = avg_returns.pivot(index=self.time_column, columns=portfolio_column, values=f'avg_{return_column}')
-        
-        # Calculate the difference between the highest and lowest portfolios for each time period
-        high_portfolio = pivot_avg_returns.columns[-1]
-        low_portfolio = pivot_avg_returns.columns[0]
-        pivot_avg_returns['diff'] = pivot_avg_returns[high_portfolio] - pivot_avg_returns[low_portfolio]
-        
-        # Rename columns to match the required format
-        pivot_avg_returns.columns = [f'P{k+1}' for k in range(len(pivot_avg_returns.columns) - 1)] + ['diff']
-        
-        return pivot_avg_returns.reset_index()
+        Future returns and lagged weights are looked up in the analyzer's panel through its (id, period) index. A stock
+        held in period t is weighted by its weight in t-1, so value weights drift with prices over the holding period.
+        Periods are counted in calendar months, so a portfolio formed in month t is held in months t+1, ..., t+holding_period
+        even if some of them are missing from the data (those months have no return).
 
-    def summarize_results(self, avg_values):
+        Args:
+            portfolios (pd.DataFrame): The output of assign_portfolios (or rank_portfolios) at the formation dates.
+            return_column (str): The name of the column of the analyzer's data representing the returns.
+            weight_column (str, optional): The name of the column of the analyzer's data representing the weights (e.g.
+                market cap). If None, equal weights are used.
+            holding_period (int): The number of periods a portfolio is held. Defaults to 1.
+            rebalance (str): 'monthly' to form portfolios every period, 'annual' to form them once a year in rebalance_month
+                (e.g. June with a holding period of 12). Defaults to 'monthly'.
+            rebalance_month (int): The formation month of annual rebalancing. Defaults to 6.
+            overlapping (bool): Whether to average the portfolios formed in each of the last holding_period periods with equal
+                weights, as in Jegadeesh and Titman (1993). If False, each period holds the portfolios of the latest formation.
+                Defaults to False.
+            delisting_column (str, optional): The name of the column representing delisting returns. They are compounded with
+                the period's return, or used alone when the return is missing.
+            portfolio_column (str): The name of the column of portfolios representing portfolio assignments. Defaults to 'portfolio'.
+
+        Returns:
+            pd.DataFrame: A data frame with the average returns for each portfolio and the difference between the highest and lowest portfolios for each holding period.
+        """
+        if rebalance not in ['monthly', 'annual']:
+            raise ValueError("Invalid rebalance. Choose from 'monthly' or 'annual'.")
+
+        panel = self.panel if self.panel is not None and self.panel.id_column == self.id_column else as_panel(self.df, self.time_column, self.id_column)
+        returns = _total_returns(panel.data, return_column, delisting_column)
+        weights = panel.data[weight_column].to_numpy(dtype=np.float64) if weight_column is not None else None
+
+        formed = portfolios[portfolios[portfolio_column].notna()]
+        if rebalance == 'annual':
+            formed = formed[pd.DatetimeIndex(formed[self.time_column]).month == rebalance_month]
+        labels = sorted(pd.unique(formed[portfolio_column]), key=_portfolio_number)
+        codes = pd.Index(labels).get_indexer(formed[portfolio_column])
+        formation = panel.period_codes(formed[self.time_column])
+        ids = pd.Index(panel.ids).get_indexer(formed[self.id_column])
+        known = (formation >= 0) & (ids >= 0)
+        codes, formation, ids = codes[known], formation[known], ids[known]
+
+        n_periods, n_portfolios = panel.n_periods, len(labels)
+        months = pd.DatetimeIndex(panel.times).to_period('M').asi8
+        if len(np.unique(months)) < n_periods:
+            raise ValueError("holding_period_returns requires at most one period per calendar month")
+
+        def month_codes(codes, offset):
+            # Period codes of the months offset months after the given periods, -1 where the month is missing
+            target = months[codes] + offset
+            position = np.minimum(np.searchsorted(months, target), max(n_periods - 1, 0))
+            return np.where(months[position] == target, position, -1) if n_periods else position
+
+        formation_dates = np.unique(formation)
+        # Latest formation before each period, for non-overlapping holdings
+        latest = formation_dates[np.maximum(np.searchsorted(formation_dates, np.arange(n_periods), side='left') - 1, 0)] if len(formation_dates) else np.zeros(n_periods, dtype=np.int64)
+
+        groups, values, row_weights = [], [], []
+        for lag in range(1, holding_period + 1):
+            held = month_codes(formation, lag)
+            rows = panel.locate(ids, held)
+            keep = (rows >= 0) & (overlapping | (latest[np.minimum(held, n_periods - 1)] == formation))
+            if weights is not None:
+                lagged_rows = panel.locate(ids, month_codes(formation, lag - 1))
+                keep &= lagged_rows >= 0
+                row_weights.append(weights[lagged_rows[keep]])
+            groups.append((held[keep] * holding_period + lag - 1) * n_portfolios + codes[keep])
+            values.append(returns[rows[keep]])
+
+        means = _group_means(np.concatenate(groups), n_periods * holding_period * n_portfolios, np.concatenate(values),
+                             np.concatenate(row_weights) if weights is not None else None)
+        means = means.reshape(n_periods, holding_period, n_portfolios)
+
+        # Equal-weighted average over the cohorts held in each period (a single cohort without overlapping)
+        observed = ~np.isnan(means)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            table = np.where(observed, means, 0.0).sum(axis=1) / observed.sum(axis=1)
+
+        table = pd.DataFrame(table, index=pd.Index(panel.times, name=self.time_column), columns=[f'P{k+1}' for k in range(n_portfolios)])
+        table = table[observed.any(axis=(1, 2))]
+        table['diff'] = table.iloc[:, -1] - table.iloc[:, 0]
+        return table.reset_index()
+
+    def sweep(self, characteristics, return_column, weight_column=None, num_portfolios=10, max_workers=None, lags=None):
+        """
+        Run univariate sorts for many characteristics in parallel and summarize their high-minus-low spreads.
+
+        The period codes, characteristics, returns and weights are placed in shared memory once, and each worker process
+        only receives the position of its characteristic. Breakpoints and portfolios are those of cal_bp and
+        assign_portfolios, and the spreads those of calculate_portfolio_returns. Sorts use the return in the same row,
+        so pass a lead return column (e.g. JKP's ret_exc_lead1m) to sort on characteristics known before the return.
+
+        Args:
+            characteristics (list of str): The characteristics to sort on. An empty list gives an empty result.
+            return_column (str): The name of the column representing the returns to average.
+            weight_column (str, optional): The name of the column representing the weights. If None, equal weights are used.
+            num_portfolios (int): The number of portfolios to be formed each time period. Defaults to 10.
+            max_workers (int, optional): The number of worker processes. Defaults to the number of CPUs; 1 runs in this process.
+            lags (int or str, optional): The number of Newey-West lags, or 'auto' (see inference.newey_west).
+
+        Returns:
+            pd.DataFrame: One row per characteristic with the time-series mean of the spread (Spread), its Newey-West t-statistic
+                (Spread_t), the number of periods with a spread (T) and the average number of sorted stocks per period (N).
+        """
+        from multiprocessing import shared_memory
+
+        characteristics = list(characteristics)
+        if not characteristics:
+            return pd.DataFrame({'Characteristic': pd.Series(dtype=object), 'Spread': pd.Series(dtype=np.float64),
+                                 'Spread_t': pd.Series(dtype=np.float64), 'T': pd.Series(dtype=np.int64),
+                                 'N': pd.Series(dtype=np.float64)})
+
+        periods, times = pd.factorize(self.df[self.time_column], sort=True)
+        arrays = [
+            periods.astype(np.int64),
+            np.ascontiguousarray(self.df[characteristics].to_numpy(dtype=np.float64).T),
+            self.df[return_column].to_numpy(dtype=np.float64),
+            self.df[weight_column].to_numpy(dtype=np.float64) if weight_column is not None else None,
+        ]
+        percentiles, _ = _percentiles(num_portfolios)
+        quantiles = np.array(percentiles) / 100
+
+        blocks, specs = [], []
+        try:
+            for array in arrays:
+                if array is None:
+                    specs.append(None)
+                    continue
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                blocks.append(block)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                specs.append((block.name, array.shape, array.dtype.str))
+            del arrays
+
+            tasks = range(len(characteristics))
+            if max_workers == 1:
+                results = [_sweep_worker(specs, k, len(times), quantiles) for k in tasks]
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+                    results = list(executor.map(_sweep_worker, [specs] * len(tasks), tasks, [len(times)] * len(tasks), [quantiles] * len(tasks)))
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+        # Newey-West inference on the spreads of all characteristics at once
+        spreads = np.column_stack([spread for spread, _ in results]).reshape(len(times), len(results))
+        sorted_stocks = np.column_stack([stocks for _, stocks in results]).reshape(len(times), len(results))
+        inference = newey_west(spreads, lags)
+        sorting = (sorted_stocks > 0).sum(axis=0)
+        with np.errstate(invalid='ignore'):
+            n = np.where(sorting > 0, sorted_stocks.sum(axis=0) / sorting, 0.0)
+        return pd.DataFrame({'Characteristic': list(characteristics), 'Spread': inference['Mean'].to_numpy(),
+                             'Spread_t': inference['t'].to_numpy(), 'T': inference['T'].to_numpy(), 'N': n})
+
+    def summarize_results(self, avg_values, lags=None):
         """
         Summarize the results by calculating the time-series means of the period average values of the outcome variable for each portfolio and the difference portfolio.
 
         Args:
             avg_values (pd.DataFrame): Data frame containing the average values for each portfolio and the difference.
+            lags (int or str, optional): The number of Newey-West lags, or 'auto' (see inference.newey_west).
+
+        Returns:
+            pd.DataFrame: A data frame with the time-series means ('Mean') of the period average values of the outcome variable for each portfolio and the difference portfolio, and their Newey-West t-statistics ('t-stat').
+        """
+        values = avg_values.drop(columns=[self.time_column], errors='ignore')
+        inference = newey_west(values, lags)
+        summary = pd.DataFrame([inference['Mean'], inference['t']], columns=values.columns)
+        summary[self.time_column] = ['Mean', 't-stat']
+        return summary[[column for column in avg_values.columns if column in summary.columns]].reset_index(drop=True)
+
+
+class StreamingBreakpoints:
+    def __init__(self, time_column, characteristics, num_portfolios=5, custom_percentiles=None, k=1024):
+        """
+        Breakpoints of panels that do not fit in memory, built from streamed chunks.
+
+        A QuantileSketch is kept per period and characteristic, so chunks can arrive in any order and sketches of
+        separate streams can be merged. The approximate breakpoints come with a bound on their rank error; exact()
+        makes a second pass over the data that only keeps the values between the sketch's bounds around each breakpoint.
+
+            engine = StreamingBreakpoints('date', ['me', 'bm'], num_portfolios=10)
+            for chunk in data.iter_jkp(sdate, edate):
+                engine.update(chunk)
+            approximate = engine.breakpoints()
+            exact = engine.exact(data.iter_jkp(sdate, edate))
+
+        Args:
+            time_column (str): The name of the column representing time periods.
+            characteristics (list of str): The characteristics to calculate breakpoints for.
+            num_portfolios (int): The number of portfolios to be formed each time period. Defaults to 5.
+            custom_percentiles (list of float, optional): Custom percentiles to calculate breakpoints (see cal_bp).
+            k (int): Size of the sketch compactors. The default of 1024 bounds the rank error of a period with 50,000
+                observations by about 0.3% (see QuantileSketch and error_bounds); use exact() for breakpoints that match
+                cal_bp. Defaults to 1024.
+        """
+        self.time_column = time_column
+        self.characteristics = list(characteristics)
+        self.percentiles, self.columns = _percentiles(num_portfolios, custom_percentiles)
+        self.quantiles = np.array(self.percentiles, dtype=np.float64) / 100
+        self.k = k
+        self.sketches = {}
+
+    def _groups(self, chunk):
+        for time_period, rows in chunk.groupby(self.time_column).indices.items():
+            yield time_period, rows
+
+    def update(self, chunk):
+        """
+        Add a chunk of data to the sketches.
+
+        Args:
+            chunk (pd.DataFrame): Rows of any periods with the time column and the characteristics.
+
+        Returns:
+            StreamingBreakpoints: The engine itself.
+        """
+        values = chunk[self.characteristics].to_numpy(dtype=np.float64)
+        for time_period, rows in self._groups(chunk):
+            sketches = self.sketches.setdefault(time_period, [QuantileSketch(self.k) for _ in self.characteristics])
+            for c, sketch in enumerate(sketches):
+                sketch.update(values[rows, c])
+        return self
+
+    def merge(self, other):
+        """
+        Merge the sketches of another engine with the same characteristics and percentiles.
+
+        Returns:
+            StreamingBreakpoints: The engine itself.
+        """
+        for time_period, sketches in other.sketches.items():
+            if time_period not in self.sketches:
+                self.sketches[time_period] = [QuantileSketch(self.k) for _ in self.characteristics]
+            for sketch, other_sketch in zip(self.sketches[time_period], sketches):
+                sketch.merge(other_sketch)
+        return self
+
+    def _frame(self, rows, columns):
+        index = pd.Index(sorted(self.sketches), name=self.time_column)
+        return pd.DataFrame(np.array(rows, dtype=np.float64).reshape(len(index), len(columns)), index=index, columns=columns)
+
+    def breakpoints(self):
+        """
+        Approximate breakpoints from the sketches.
+
+        Returns:
+            dict of pd.DataFrame: The breakpoints of each characteristic in the format of cal_bp.
+        """
+        return {characteristic: self._frame([self.sketches[t][c].quantile(self.quantiles) for t in sorted(self.sketches)], self.columns)
+                for c, characteristic in enumerate(self.characteristics)}
+
+    def error_bounds(self):
+        """
+        Bounds on the rank error of the approximate breakpoints, as a fraction of each period's number of observations.
+
+        Returns:
+            pd.DataFrame: The error bound for each period (rows) and characteristic (columns).
+        """
+        return self._frame([[sketch.epsilon for sketch in self.sketches[t]] for t in sorted(self.sketches)], self.characteristics)
+
+    def exact(self, chunks):
+        """
+        Exact breakpoints from a second pass over the data.
+
+        Only the values between the sketch's bounds around each breakpoint are kept, together with the number of
+        values below them, and the breakpoints are then interpolated as by cal_bp.
+
+        Args:
+            chunks (iterable of pd.DataFrame): The same data as streamed to update, in any chunking and order.
+
+        Returns:
+            dict of pd.DataFrame: The breakpoints of each characteristic in the format of cal_bp.
+        """
+        m = len(self.quantiles)
+        state = {}
+        for time_period, sketches in self.sketches.items():
+            for c, sketch in enumerate(sketches):
+                position = (sketch.n - 1) * self.quantiles
+                lower, upper = sketch.bracket(np.floor(position))
+                state[time_period, c] = (lower, upper, np.zeros(m, dtype=np.int64), [[] for _ in range(m)])
+
+        for chunk in chunks:
+            values = chunk[self.characteristics].to_numpy(dtype=np.float64)
+            for time_period, rows in self._groups(chunk):
+                for c in range(len(self.characteristics)):
+                    x = values[rows, c]
+                    x = np.sort(x[~np.isnan(x)])
+                    lower, upper, below, kept = state[time_period, c]
+                    start = np.searchsorted(x, lower, side='left')
+                    stop = np.searchsorted(x, upper, side='right')
+                    below += start
+                    for j in range(m):
+                        kept[j].append(x[start[j]:stop[j]])
+
+        results = {characteristic: [] for characteristic in self.characteristics}
+        for time_period in sorted(self.sketches):
+            for c, characteristic in enumerate(self.characteristics):
+                n = self.sketches[time_period][c].n
+                lower, upper, below, kept = state[time_period, c]
+                row = np.full(m, np.nan)
+                if n:
+                    position = (n - 1) * self.quantiles
+                    rank = np.floor(position).astype(np.int64)
+                    for j in range(m):
+                        x = np.sort(np.concatenate(kept[j]))
+                        value = x[rank[j] - below[j]]
+                        next_value = x[min(rank[j] + 1, n - 1) - below[j]]
+                        row[j] = value + (next_value - value) * (position[j] - rank[j])
+                results[characteristic].append(row)
+
+        return {characteristic: self._frame(rows, self.columns) for characteristic, rows in results.items()}
+
+
+class BivariatePortfolioAnalyzer:
+    def __init__(self, df, time_column, id_column):
+        """
+        Initialize the BivariatePortfolioAnalyzer for double (and n-way) sorts.
+
+        Args:
+            df (pd.DataFrame or PanelFrame): The data frame containing the data.
+            time_column (str): The name of the column representing time periods.
+            id_column (str): The name of the column representing unique entity IDs.
+        """
+        self.panel = df if isinstance(df, PanelFrame) else None
+        if self.panel is not None:
+            df = self.panel.data
+        self.df = df
+        self.time_column = time_column
+        self.id_column = id_column
+        self.sorts = {}
+
+    def assign_portfolios(self, sorts, dependent=False, custom_percentiles=None, breakpoint_mask=None, keep_columns=None):
+        """
+        Assign every row to a cell of an n-way sort.
+
+        All dimensions are coded in one pass over integer group codes: the breakpoints of each dimension are computed
+        per period (independent sort) or per period and cell of the previous dimensions (dependent sort), and the row's
+        portfolio is found in its group's breakpoints.
+
+        Args:
+            sorts (dict): Characteristic columns mapped to their number of portfolios, in sorting order, e.g. {'me': 2, 'bm': 3}.
+                For a dependent sort, each characteristic is sorted within the portfolios of the ones before it.
+            dependent (bool): Whether to sort conditionally (dependent) instead of independently. Defaults to False.
+            custom_percentiles (dict, optional): Custom percentiles of some characteristics, e.g. {'bm': [30, 70]}.
+            breakpoint_mask (str or array-like of bool, optional): Column name or boolean mask of the rows used to compute
+                the breakpoints, e.g. NYSE stocks; missing values count as False. Breakpoints only use rows with all
+                characteristics observed; all such rows are assigned.
+            keep_columns (list of str, optional): List of column names to keep in the resulting DataFrame.
 
         Returns:
-            pd.DataFrame: A data frame with the time-series means of the period average values of the outcome variable for each portfolio and the difference portfolio.
+            pd.DataFrame: The data frame with the specified columns and the integer portfolio code of each characteristic
+                in 'portfolio_{column}'. Rows with a missing characteristic, or whose breakpoint group is empty, are dropped.
+        """
+        if keep_columns is None:
+            keep_columns = []
+        custom_percentiles = custom_percentiles or {}
+        columns = list(sorts)
+        keep_columns = [column for column in keep_columns if column not in columns]
+
+        df = self.df[[self.id_column, self.time_column] + columns + keep_columns]
+        # Missing mask values exclude the row from the breakpoints (NaN would convert to True)
+        if isinstance(breakpoint_mask, str):
+            mask = self.df[breakpoint_mask].eq(True).to_numpy()
+        elif breakpoint_mask is not None:
+            mask = pd.Series(breakpoint_mask).eq(True).to_numpy()
+        else:
+            mask = np.ones(len(df), dtype=bool)
+
+        complete = df[columns].notna().all(axis=1).to_numpy()
+        df, mask = df[complete].copy(), mask[complete]
+
+        if self.panel is not None:
+            periods, n_periods = self.panel.time_codes[complete], self.panel.n_periods
+        else:
+            periods, times = pd.factorize(df[self.time_column], sort=True)
+            periods, n_periods = periods.astype(np.int64), len(times)
+
+        groups, n_groups = periods, n_periods
+        valid = np.ones(len(df), dtype=bool)
+        self.sorts = {}
+        for column in columns:
+            percentiles, _ = _percentiles(sorts[column], custom_percentiles.get(column))
+            values = df[column].to_numpy(dtype=np.float64)
+            breakpoint_groups, n_breakpoint_groups = (groups, n_groups) if dependent else (periods, n_periods)
+
+            breakpoints, counts = _group_breakpoints(breakpoint_groups[mask], values[mask], n_breakpoint_groups, np.array(percentiles) / 100)
+            codes = _bucket(_prepare_bp(breakpoints, 'drop'), breakpoint_groups, values)
+            valid &= counts[breakpoint_groups] > 0
+
+            n_portfolios = self.sorts[column] = len(percentiles) + 1
+            groups, n_groups = groups * n_portfolios + codes, n_groups * n_portfolios
+            df[f'portfolio_{column}'] = codes + 1
+
+        return df[valid]
+
+    def portfolio_returns(self, portfolios, return_column, weight_column=None):
         """
-        summary = avg_values.mean().to_frame(name='mean').T
-        summary[self.time_column] = 'Mean'
-        return summary
+        Calculate the (equal- or value-weighted) average return of every cell of the sort in each period.
+
+        Args:
+            portfolios (pd.DataFrame): The output of assign_portfolios, with the return (and weight) column kept.
+            return_column (str): The name of the column representing the returns to average.
+            weight_column (str, optional): The name of the column representing the weights. If None, equal weights are used.
 
-    def
\ No newline at end of file
+        Returns:
+            pd.DataFrame: The average returns with the periods as rows and the cells as columns (one column level per characteristic).
+        """
+        periods, times = pd.factorize(portfolios[self.time_column], sort=True)
+        cells, n_cells = np.zeros(len(portfolios), dtype=np.int64), 1
+        for column, n_portfolios in self.sorts.items():
+            cells = cells * n_portfolios + portfolios[f'portfolio_{column}'].to_numpy(dtype=np.int64) - 1
+            n_cells *= n_portfolios
+
+        weights = portfolios[weight_column].to_numpy(dtype=np.float64) if weight_column else None
+        means = _group_means(periods * n_cells + cells, len(times) * n_cells, portfolios[return_column].to_numpy(dtype=np.float64), weights)
+
+        grid = pd.MultiIndex.from_product([range(1, n + 1) for n in self.sorts.values()], names=list(self.sorts))
+        return pd.DataFrame(means.reshape(len(times), n_cells), index=pd.Index(times, name=self.time_column), columns=grid)
+
+    def spread_returns(self, returns, column):
+        """
+        Calculate the high-minus-low spread along one characteristic for every cell of the others.
+
+        Args:
+            returns (pd.DataFrame): The output of portfolio_returns.
+            column (str): The characteristic along which the spread is taken.
+
+        Returns:
+            pd.DataFrame: The spreads for each period, with their average across the other cells in 'avg'.
+        """
+        high = returns.xs(self.sorts[column], level=column, axis=1)
+        low = returns.xs(1, level=column, axis=1)
+        spreads = high - low
+        spreads['avg'] = spreads.mean(axis=1)
+        return spreads
+
+    def summarize_results(self, returns):
+        """
+        Summarize the time-series means of the cell returns.
+
+        For a double sort, the result is the grid of mean returns with the rows and columns of the two characteristics,
+        a 'diff' column with the mean high-minus-low spread along the second characteristic, a 'diff' row with the one
+        along the first, and their difference in the corner.
+
+        Args:
+            returns (pd.DataFrame): The output of portfolio_returns.
+
+        Returns:
+            pd.DataFrame: The summary table (for an n-way sort, the means of all cells in one row).
+        """
+        if len(self.sorts) != 2:
+            return returns.mean().to_frame(name='mean').T
+
+        first, second = self.sorts
+        spreads = self.spread_returns(returns, second).drop(columns='avg')
+        table = returns.mean().unstack(second)
+        table['diff'] = spreads.mean()
+        table.loc['diff'] = self.spread_returns(returns, first).drop(columns='avg').mean()
+        table.loc['diff', 'diff'] = (spreads[self.sorts[first]] - spreads[1]).mean()
+        return table
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+
+from .datatools import iter_periods, PanelFrame
 
 
 
@@ -118,6 +119,32 @@ def winsorize(data, column=False, lower=0.01, upper=0.99, copy=True):
     
     return data
 
+# Winsorize a stream of chunks
+def winsorize_chunks(chunks, time_column, columns, lower=0.01, upper=0.99):
+    """
+    Winsorizes each time period's cross-section of a stream of data frames, one period block at a time.
+    
+    Parameters:
+    chunks (iterable of pd.DataFrame): Data frames sorted by the time column (e.g. from wrdsdata.iter_crsp_daily).
+    time_column (str): The column name representing the time periods.
+    columns (str or list of str): The column(s) to be winsorized.
+    lower (float): The lower quantile threshold. Defaults to 0.01.
+    upper (float): The upper quantile threshold. Defaults to 0.99.
+    
+    Yields:
+        pd.DataFrame: The winsorized data, containing complete time periods.
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    
+    for block in iter_periods(chunks, time_column):
+        block = block.copy()
+        grouped = block.groupby(time_column)[columns]
+        lower_bounds = grouped.quantile(lower).reindex(block[time_column]).values
+        upper_bounds = grouped.quantile(upper).reindex(block[time_column]).values
+        block[columns] = block[columns].clip(lower_bounds, upper_bounds, axis=None)
+        yield block
+
 # missing data 
 ## I recommend to see 
 
@@ -145,6 +172,7 @@ def report_nan_counts_per_col(data, visualize=False):
         print(f"Column: {col}, NaN count: {count}")
     
     if visualize:
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(12, 8))
         plt.bar(nan_report.index, nan_report['NaN Count'], color='tab:blue', alpha=0.6)
         plt.xlabel('Columns')
@@ -210,6 +238,7 @@ def report_nan_counts_per_row(data, visualize=False):
         print(f"Row: {idx}, NaN count: {row['NaN Count']}, NaN percentage: {row['NaN Percentage']:.2f}%")
     
     if visualize:
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(12, 8))
         plt.bar(nan_report.index, nan_report['NaN Count'], color='tab:blue', alpha=0.6)
         plt.xlabel('Rows')
@@ -254,7 +283,7 @@ def filter_firm_by_size(data, date_column='date', size_column='size', threshold=
     Filters out companies from the DataFrame where the 'size' value is in the bottom 5% for each date.
     
     Parameters:
-    data (pd.DataFrame): The data to be processed.
+    data (pd.DataFrame or PanelFrame): The data to be processed. A PanelFrame indexed by date_column reuses its period slices.
     date_column (str): The column name representing the dates. Defaults to 'date'.
     size_column (str): The column name representing the size. Defaults to 'size'.
     threshold (float): The proportion threshold for filtering. Defaults to 0.05 (bottom 5%).
@@ -263,13 +292,22 @@ def filter_firm_by_size(data, date_column='date', size_column='size', threshold=
     Returns:
         pd.DataFrame: The filtered DataFrame.
     """
-    data[date_column] = pd.to_datetime(data[date_column])
+    if isinstance(data, PanelFrame):
+        panel = data
+        data = panel.data
+        # Calculate the threshold value for the bottom 5% for each date from the period slices
+        threshold_values = pd.Series([group[size_column].quantile(threshold) for _, group in panel.groups()], index=panel.times)
+        size_thresholds = pd.Series(np.repeat(threshold_values.values, panel.counts), index=data.index)
+    else:
+        data[date_column] = pd.to_datetime(data[date_column])
     
-    # Calculate the threshold value for the bottom 5% for each date
-    size_thresholds = data.groupby(date_column)[size_column].transform(lambda x: x.quantile(threshold))
+        # Calculate the threshold value for the bottom 5% for each date
+        size_thresholds = data.groupby(date_column)[size_column].transform(lambda x: x.quantile(threshold))
+        threshold_values = None
     
     if show_thresholds:
-        threshold_values = data.groupby(date_column)[size_column].quantile(threshold)
+        if threshold_values is None:
+            threshold_values = data.groupby(date_column)[size_column].quantile(threshold)
         print("Threshold values for each date:")
         print(threshold_values)
     
@@ -311,6 +349,7 @@ def report_nan_counts_per_id_and_year(data, id_column, date_column, visualize=Fa
         print(f"ID: {row[id_column]}, Year: {row['Year']}, NaN count: {row['NaN Count']}, NaN percentage: {row['NaN Percentage']:.2f}%")
     
     if visualize:
+        import matplotlib.pyplot as plt
         # Summarize the NaN counts for better visualization
         summary = nan_report.groupby('Year')['NaN Count'].sum().reset_index()
         plt.figure(figsize=(12, 8))
@@ -1,26 +1,119 @@
 import pandas as pd
-from scipy.stats import skew, kurtosis, pearsonr, spearmanr, rankdata
+import numpy as np
+
+from .datatools import iter_periods, PanelFrame, as_panel
+from .inference import newey_west
+
+def _lerp(a, b, t):
+    """
+    Linear interpolation between a and b, computed as numpy's quantile does it.
+    """
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def _group_quantile(sorted_values, starts, counts, q):
+    """
+    Linear-interpolation quantile of each group of a group-wise sorted array.
+    """
+    position = q * (counts - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    return _lerp(sorted_values[starts + lower], sorted_values[starts + upper], position - lower)
+
+
+def _cs_stats_columns(panel, value_columns, percentiles):
+    """
+    Calculate the cross-sectional statistics of several value columns for every period of a panel.
+
+    Each column is processed for all periods at once: moments from grouped sums and percentiles from
+    the values sorted within periods.
+
+    Returns:
+        dict of pd.DataFrame: The statistics for each value column.
+    """
+    n_periods = panel.n_periods
+    results = {}
+
+    for value_column in value_columns:
+        values = panel.data[value_column].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        codes = panel.time_codes[valid]
+        values = values[valid]
+
+        counts = np.bincount(codes, minlength=n_periods)
+        nan_counts = np.bincount(panel.time_codes[~valid], minlength=n_periods)
+        has_data = counts > 0
+        n = np.where(has_data, counts, 1)
+
+        # Moments from grouped sums of deviations from the period mean
+        mean = np.bincount(codes, values, n_periods) / n
+        deviation = values - mean[codes]
+        m2 = np.bincount(codes, deviation ** 2, n_periods) / n
+        m3 = np.bincount(codes, deviation ** 3, n_periods) / n
+        m4 = np.bincount(codes, deviation ** 4, n_periods) / n
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sd = np.where(counts > 1, np.sqrt(m2 * n / (n - 1)), np.nan)
+            # Biased skewness and excess kurtosis, undefined for constant cross-sections (as in scipy.stats)
+            constant = m2 <= (np.finfo(np.float64).resolution * mean) ** 2
+            skewness = np.where(constant, np.nan, m3 / m2 ** 1.5)
+            kurt = np.where(constant, np.nan, m4 / m2 ** 2 - 3.0)
+
+        # Sort the values within each period once for the order statistics
+        order = np.lexsort((values, codes))
+        sorted_values = values[order]
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        starts, n, last = starts[has_data], counts[has_data], starts[has_data] + counts[has_data] - 1
+
+        stats = {
+            'Time': panel.times[has_data],
+            'Mean': mean[has_data],
+            'SD': sd[has_data],
+            'Skew': skewness[has_data],
+            'Kurt': kurt[has_data],
+            'Min': sorted_values[starts],
+            'Median': (sorted_values[starts + (n - 1) // 2] + sorted_values[starts + n // 2]) / 2,
+            'Max': sorted_values[last],
+            'P5': _group_quantile(sorted_values, starts, n, 0.05),
+            'P25': _group_quantile(sorted_values, starts, n, 0.25),
+            'P75': _group_quantile(sorted_values, starts, n, 0.75),
+            'P95': _group_quantile(sorted_values, starts, n, 0.95),
+            'N': n,
+            'NaN_count': nan_counts[has_data]  # Report the number of NaN values
+        }
+
+        for percentile in percentiles:
+            stats[f'P{int(percentile*100)}'] = _group_quantile(sorted_values, starts, n, percentile)
+
+        results[value_column] = pd.DataFrame(stats)
+
+    return results
+
 
 def cal_cs_stats(df, time_column, value_column, additional_percentiles=False):
     """
     Calculate cross-sectional statistics for each time period, handling NaN values and reporting them.
     
     Args:
-        df (pd.DataFrame): The data frame containing the data.
+        df (pd.DataFrame, PanelFrame or iterable of pd.DataFrame): The data frame containing the data, a PanelFrame
+            whose sorting is reused, or chunks of it sorted by the time column (e.g. from wrdsdata.iter_crsp_daily),
+            which are processed one period block at a time.
         time_column (str): The name of the column representing time periods.
-        value_column (str): The name of the column representing the values of X.
+        value_column (str or list of str): The name of the column representing the values of X, or several columns.
         additional_percentiles (bool or list of float): Additional percentiles to calculate (optional).
     
     Returns:
-        pd.DataFrame: A data frame containing the calculated statistics for each time period.
+        pd.DataFrame: A data frame containing the calculated statistics for each time period. NaN values are
+            excluded from the statistics and their number is reported in the NaN_count column.
+            For a list of value columns, a dictionary of such data frames keyed by column.
     """
-    # Drop NaN values in the value column and report them
-    nan_report = df[df[value_column].isna()]
-    if not nan_report.empty:
-        print(f"NaN values found in column {value_column} for the following rows:")
-        print(nan_report)
-    df_clean = df.dropna(subset=[value_column])
-    
+    if not isinstance(df, (pd.DataFrame, PanelFrame)):
+        blocks = [cal_cs_stats(block, time_column, value_column, additional_percentiles) for block in iter_periods(df, time_column)]
+        if isinstance(value_column, str):
+            return pd.concat(blocks, ignore_index=True)
+        return {column: pd.concat([block[column] for block in blocks], ignore_index=True) for column in value_column}
+
     # Define additional percentiles if required
     if additional_percentiles is True:
         additional_percentiles_list = [0.01, 0.02, 0.03, 0.04, 0.96, 0.97, 0.98, 0.99]
@@ -28,52 +121,31 @@ def cal_cs_stats(df, time_column, value_column, additional_percentiles=False):
         additional_percentiles_list = additional_percentiles
     else:
         additional_percentiles_list = []
-    
-    # Function to calculate the required statistics for a given period
-    def calc_period_stats(group):
-        stats = {
-            'Time': group[time_column].iloc[0],  # Time column
-            'Mean': group[value_column].mean(),
-            'SD': group[value_column].std(),
-            'Skew': skew(group[value_column], nan_policy='omit'),
-            'Kurt': kurtosis(group[value_column], nan_policy='omit'),
-            'Min': group[value_column].min(),
-            'Median': group[value_column].median(),
-            'Max': group[value_column].max(),
-            'P5': group[value_column].quantile(0.05),
-            'P25': group[value_column].quantile(0.25),
-            'P75': group[value_column].quantile(0.75),
-            'P95': group[value_column].quantile(0.95),
-            'N': group[value_column].count(),
-            'NaN_count': group[value_column].isna().sum()  # Report the number of NaN values
-        }
-        
-        for percentile in additional_percentiles_list:
-            stats[f'P{int(percentile*100)}'] = group[value_column].quantile(percentile)
-        
-        return pd.Series(stats)
-    
-    # Group the data by the time column and apply the function
-    stats_df = df_clean.groupby(time_column, group_keys=False).apply(calc_period_stats).reset_index(drop=True)
-    
-    return stats_df
 
-def cal_ts_stats(stats_df):
+    panel = as_panel(df, time_column)
+    value_columns = [value_column] if isinstance(value_column, str) else list(value_column)
+    results = _cs_stats_columns(panel, value_columns, additional_percentiles_list)
+
+    return results[value_column] if isinstance(value_column, str) else results
+
+def cal_ts_stats(stats_df, lags=None):
     """
-    Calculate the time-series averages of the cross-sectional statistics.
+    Calculate the time-series averages of the cross-sectional statistics and their t-statistics.
     
     Args:
         stats_df (pd.DataFrame): A data frame containing cross-sectional statistics for each time period.
+        lags (int or str, optional): The number of Newey-West lags, or 'auto' (see inference.newey_west).
     
     Returns:
-        pd.Series: A series containing the time-series averages of the cross-sectional statistics.
+        pd.DataFrame: A data frame with the time-series averages of the cross-sectional statistics ('Mean') and their
+            Newey-West t-statistics ('t-stat').
     """
     # Exclude the time column for averaging
     stats_to_average = stats_df.drop(columns=['Time'])
     
-    # Calculate the time-series averages
-    time_series_averages = stats_to_average.mean()
+    # Time-series averages and t-statistics of all statistics at once
+    inference = newey_west(stats_to_average, lags)
     
-    df = pd.DataFrame(time_series_averages).T
+    df = pd.DataFrame([inference['Mean'], inference['t']], index=['Mean', 't-stat'], columns=stats_to_average.columns)
 
     return df
\ No newline at end of file
@@ -0,0 +1,158 @@
+import pandas as pd
+import numpy as np
+
+from .datatools import as_panel
+from .portfolio import _portfolio_number
+
+def _row_normalize(matrix):
+    """
+    Scale each row of a sparse matrix to sum to one (empty rows stay empty).
+    """
+    from scipy import sparse
+
+    sums = np.asarray(matrix.sum(axis=1)).ravel()
+    with np.errstate(divide='ignore'):
+        scale = np.where(sums != 0, 1 / sums, 0.0)
+    return sparse.diags(scale) @ matrix
+
+class TurnoverAnalyzer:
+    def __init__(self, portfolios, time_column, id_column, portfolio_column='portfolio', weight_column=None, return_column=None):
+        """
+        Initialize the TurnoverAnalyzer with portfolio assignments.
+
+        Every portfolio is stored as a sparse (period x entity) matrix of its weights at formation. Turnover compares
+        the weights at each formation with the weights of the previous formation after they drifted with the returns
+        of the holding period.
+
+        Args:
+            portfolios (pd.DataFrame): Portfolio assignments at the formation dates (e.g. the output of assign_portfolios).
+            time_column (str): The name of the column representing time periods.
+            id_column (str): The name of the column representing unique entity IDs.
+            portfolio_column (str): The name of the column representing portfolio assignments. Defaults to 'portfolio'.
+            weight_column (str, optional): The name of the column representing the weights at formation (e.g. lagged
+                market cap). If None, equal weights are used.
+            return_column (str, optional): The name of the column representing the return over the holding period after
+                formation (e.g. a lead return). It is used for the drift of the weights and for the spread returns.
+                Missing returns count as zero. If None, weights do not drift.
+        """
+        from scipy import sparse
+
+        self.time_column = time_column
+        self.id_column = id_column
+        self.portfolio_column = portfolio_column
+
+        portfolios = portfolios[portfolios[portfolio_column].notna()]
+        self.panel = as_panel(portfolios, time_column, id_column)
+        data = self.panel.data
+        self.times, self.ids = self.panel.times, self.panel.ids
+        shape = (self.panel.n_periods, self.panel.n_entities)
+
+        labels = data[portfolio_column].to_numpy()
+        weights = data[weight_column].to_numpy(dtype=np.float64) if weight_column is not None else np.ones(len(data))
+        weights = np.nan_to_num(weights)
+        returns = np.nan_to_num(data[return_column].to_numpy(dtype=np.float64)) if return_column is not None else np.zeros(len(data))
+        self.returns = sparse.csr_matrix((returns, (self.panel.time_codes, self.panel.id_codes)), shape=shape)
+
+        self.weights, self.drifted = {}, {}
+        for portfolio in pd.unique(labels):
+            rows = labels == portfolio
+            index = (self.panel.time_codes[rows], self.panel.id_codes[rows])
+            weight = _row_normalize(sparse.csr_matrix((weights[rows], index), shape=shape))
+            self.weights[portfolio] = weight
+            # Weights at the end of the holding period, before the next rebalancing
+            growth = sparse.csr_matrix((1 + returns[rows], index), shape=shape)
+            self.drifted[portfolio] = _row_normalize(weight.multiply(growth).tocsr())
+
+    def weight_changes(self, portfolio):
+        """
+        Drift-adjusted weight changes at each rebalancing.
+
+        Args:
+            portfolio: The portfolio code or label.
+
+        Returns:
+            scipy.sparse.csr_matrix: A (period x entity) matrix of w_t - w~_{t-1}, where w~_{t-1} are the weights of the
+                previous formation after the holding period's returns. The first period has no changes.
+        """
+        from scipy import sparse
+
+        weight, drifted = self.weights[portfolio], self.drifted[portfolio]
+        previous = sparse.vstack([sparse.csr_matrix((1, weight.shape[1])), drifted[:-1]]).tocsr()
+        rebalanced = np.ones(weight.shape[0])
+        rebalanced[:1] = 0
+        changes = (sparse.diags(rebalanced) @ (weight - previous)).tocsr()
+        changes.eliminate_zeros()
+        return changes
+
+    def turnover(self):
+        """
+        Calculate the one-way turnover of each portfolio at each rebalancing, half the sum of absolute weight changes.
+
+        Returns:
+            pd.DataFrame: The turnover with the periods as rows and the portfolios as columns (NaN in the first period).
+        """
+        turnover = {}
+        for portfolio in self.weights:
+            turnover[portfolio] = 0.5 * np.asarray(abs(self.weight_changes(portfolio)).sum(axis=1)).ravel()
+        turnover = pd.DataFrame(turnover, index=pd.Index(self.times, name=self.time_column))
+        turnover = turnover[sorted(turnover.columns, key=_portfolio_number)]
+        turnover.iloc[0] = np.nan
+        return turnover
+
+    def trading_costs(self, portfolio, cost=0.001):
+        """
+        Calculate the cost of rebalancing a portfolio in each period.
+
+        Args:
+            portfolio: The portfolio code or label.
+            cost (float, str or callable): The cost per unit of traded weight. A float is a linear cost for every stock;
+                a column name or a function of the assignments data frame gives stock-specific costs, e.g. a size-dependent
+                model such as lambda df: np.where(df['me'] < 100, 0.005, 0.001). Stocks sold out of the portfolio are
+                charged their cost of the previous period.
+
+        Returns:
+            np.ndarray: The cost in each period.
+        """
+        changes = self.weight_changes(portfolio).tocoo()
+        if np.isscalar(cost):
+            rates = np.full(len(changes.data), float(cost))
+        else:
+            values = self.panel.data[cost] if isinstance(cost, str) else cost(self.panel.data)
+            values = np.asarray(values, dtype=np.float64)
+            rows = self.panel.locate(changes.col, changes.row)
+            previous = self.panel.locate(changes.col, changes.row - 1)
+            rows = np.where(rows >= 0, rows, previous)
+            rates = values[np.maximum(rows, 0)]
+        return np.bincount(changes.row, np.abs(changes.data) * rates, len(self.times))
+
+    def net_spread_returns(self, high=None, low=None, cost=0.001):
+        """
+        Calculate the gross and net-of-cost returns of the high-minus-low spread portfolio.
+
+        The return of the portfolios formed at t (return_column of the formation rows) is charged the cost of
+        rebalancing both legs at t.
+
+        Args:
+            high, low (optional): The long and short portfolios. Default to the highest and lowest portfolio.
+            cost (float, str or callable): The cost model (see trading_costs). Defaults to 10 basis points.
+
+        Returns:
+            pd.DataFrame: The gross return, cost, net return and one-way turnover of both legs for each formation period.
+        """
+        portfolios = sorted(self.weights, key=_portfolio_number)
+        high = portfolios[-1] if high is None else high
+        low = portfolios[0] if low is None else low
+
+        def leg_return(portfolio):
+            return np.asarray(self.weights[portfolio].multiply(self.returns).sum(axis=1)).ravel()
+
+        turnover = self.turnover()
+        costs = self.trading_costs(high, cost) + self.trading_costs(low, cost)
+        gross = leg_return(high) - leg_return(low)
+        return pd.DataFrame({
+            'gross': gross,
+            'cost': costs,
+            'net': gross - costs,
+            'turnover_high': turnover[high].to_numpy(),
+            'turnover_low': turnover[low].to_numpy(),
+        }, index=pd.Index(self.times, name=self.time_column))
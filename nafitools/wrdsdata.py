@@ -1,6 +1,15 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd 
 import numpy as np
-import wrds
+
+from .datatools import concat_frames
 
 
  # Connect to WRDS
@@ -37,99 +46,828 @@ We splite the data sample along two dimension: Stock exchnge and Sector.
 
 # Using JKP data.
     
+def _wrds_connection():
+    """
+    Open a WRDS connection, importing wrds only when a connection is needed.
+    """
+    import wrds
+    return wrds.Connection()
+
+
+# Errors that mean the connection itself failed (e.g. a dropped SSL session), matched by class or class name so that
+# the drivers (sqlalchemy, psycopg2, sqlite3, duckdb) need not be imported
+CONNECTION_ERRORS = ('OperationalError', 'InterfaceError', ConnectionError)
+
+
+def _is_error_of(error, errors):
+    """
+    Whether an exception is an instance of one of the given classes, or has one of the given class names in its hierarchy.
+    """
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return any(isinstance(error, kind) if isinstance(kind, type) else kind in names for kind in errors)
+
+
+def _format_date(date):
+    """
+    Normalize a date-like value to an ISO 'YYYY-MM-DD' string for SQL.
+    """
+    return pd.Timestamp(date).strftime('%Y-%m-%d')
+
+
+def _month_runs(months):
+    """
+    Group a sorted sequence of monthly periods into runs of consecutive months.
+
+    Args:
+        months (list of pd.Period): Sorted monthly periods.
+
+    Returns:
+        list of tuple: (first_month, last_month) for each run.
+    """
+    runs = []
+    for month in months:
+        if runs and month == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], month)
+        else:
+            runs.append((month, month))
+    return runs
+
+
+# Integer identifier and code columns stored as nullable Int32 by compact_dtypes
+CODE_COLUMNS = ['permno', 'permco', 'shrcd', 'exchcd', 'hexcd', 'siccd', 'hsiccd', 'fyear', 'fyr', 'fqtr',
+                'crsp_shrcd', 'crsp_exchcd', 'comp_exchg', 'sic']
+
+# String identifier columns stored as categoricals by compact_dtypes
+CATEGORY_COLUMNS = ['gvkey', 'excntry', 'iid', 'id', 'cusip', 'ncusip', 'ticker', 'curcd']
+
+# Returns and prices, kept in float64 by compact_dtypes(float32=True) as compounding and market equity need the precision
+FLOAT64_COLUMNS = ['ret', 'retx', 'dlret', 'dlretx', 'prc', 'altprc', 'bidlo', 'askhi', 'bid', 'ask', 'openprc', 'shrout',
+                   'vwretd', 'vwretx', 'ewretd', 'ewretx', 'sprtrn', 'ret_exc', 'ret_exc_lead1m', 'ret_local', 'prc_local',
+                   'prc_high', 'prc_low', 'me', 'mktrf', 'smb', 'hml', 'rmw', 'cma', 'umd', 'rf']
+
+
+def compact_dtypes(df, code_columns=None, category_columns=None, float32=False, date_column=None, month_column='month'):
+    """
+    Convert a query result to compact dtypes.
+
+    Declared integer identifier and code columns (e.g. permno, exchange and share codes) become nullable Int32 and
+    string identifiers (e.g. gvkey, excntry) categoricals. With a date column, an Int32 month code (months since
+    January 1970, the ordinal of pd.Period(date, 'M')) is added, and float64 characteristics can be downcast to float32.
+    Except for the categories, the dtypes depend only on the column names, so chunks of a streamed or sharded query
+    concatenate without falling back to float64 or object; use datatools.concat_frames to merge their categories.
+    The number of bytes saved is stored in df.attrs['bytes_saved'].
+
+    Args:
+        df (pd.DataFrame): The data frame to convert.
+        code_columns (list of str, optional): Columns to store as Int32. Defaults to CODE_COLUMNS.
+        category_columns (list of str, optional): Columns to store as categoricals. Defaults to CATEGORY_COLUMNS.
+        float32 (bool or list of str): True to downcast the float64 columns other than returns and prices
+            (FLOAT64_COLUMNS) to float32, or the characteristics to downcast. Defaults to False.
+        date_column (str, optional): The date column from which the month code is derived. If None, no code is added.
+        month_column (str): The name of the month code column. Defaults to 'month'.
+
+    Returns:
+        pd.DataFrame: The converted data frame.
+    """
+    if code_columns is None:
+        code_columns = CODE_COLUMNS
+    if category_columns is None:
+        category_columns = CATEGORY_COLUMNS
+    if float32 is True:
+        downcast = [column for column in df.columns if column not in FLOAT64_COLUMNS]
+    else:
+        downcast = list(float32 or [])
+    before = df.memory_usage(deep=True).sum()
+    df = df.copy()
+
+    for column in df.columns:
+        values = df[column]
+        if column in code_columns:
+            df[column] = pd.to_numeric(values).astype('Int32')
+        elif column in category_columns:
+            df[column] = values.astype('category')
+        elif column in downcast and values.dtype == np.float64:
+            df[column] = values.astype(np.float32)
+
+    if date_column is not None and date_column in df.columns:
+        months = pd.to_datetime(df[date_column]).dt.to_period('M')
+        df[month_column] = pd.arrays.IntegerArray(months.array.asi8.astype(np.int32), months.isna().to_numpy())
+
+    df.attrs['bytes_saved'] = int(before - df.memory_usage(deep=True).sum())
+    return df
+
+
+def _concat(frames):
+    """
+    Concatenate query results, skipping empty ones unless all of them are empty.
+    """
+    non_empty = [frame for frame in frames if len(frame)]
+    if not non_empty:
+        return frames[0] if frames else pd.DataFrame()
+    return concat_frames(non_empty)
+
+
+class SQLConnection:
+    def __init__(self, connection, dialect=None):
+        """
+        Wrap a DB-API or SQLAlchemy connection (e.g. sqlite3, duckdb, psycopg2) so that it can stand in for wrds.Connection.
+
+        Args:
+            connection (object): The database connection.
+            dialect (str, optional): 'sqlite', 'duckdb' or 'postgres', used by the server-side getters. Defaults to
+                the connection's module (sqlite3 or duckdb), else 'postgres'.
+        """
+        self.connection = connection
+        if dialect is None:
+            module = type(connection).__module__.split('.')[0]
+            dialect = {'sqlite3': 'sqlite', 'duckdb': 'duckdb', '_duckdb': 'duckdb'}.get(module, 'postgres')
+        self.dialect = dialect
+
+    def raw_sql(self, sql, date_cols=None):
+        return pd.read_sql_query(sql, self.connection, parse_dates=date_cols)
+
+    def close(self):
+        self.connection.close()
+
+
+class ConnectionPool:
+    def __init__(self, factory, size, connections=()):
+        """
+        A bounded pool of database connections that are opened on demand.
+
+        Args:
+            factory (callable): Creates a new connection with a raw_sql(query) method.
+            size (int): Maximum number of open connections.
+            connections (iterable, optional): Already open connections to put into the pool.
+        """
+        self.factory = factory
+        self.size = size
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        for connection in connections:
+            self._idle.put(connection)
+            self._created += 1
+
+    def acquire(self):
+        """
+        Take an idle connection, opening a new one while the pool is below its size, else wait for one.
+        """
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                create = self.factory is not None and self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    return self.factory()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            # Wake up now and then, as a discarded connection frees a slot without releasing one
+            try:
+                return self._idle.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def release(self, connection):
+        self._idle.put(connection)
+
+    def discard(self, connection, close=True):
+        """
+        Drop a broken connection instead of returning it, so that the next acquire opens a new one.
+
+        Args:
+            connection (object): The connection taken with acquire.
+            close (bool): Whether to close the connection. Defaults to True.
+        """
+        if close:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        with self._lock:
+            self._created -= 1
+
+
+class ParquetCache:
+    def __init__(self, cache_dir, max_bytes=None, expire_days=None):
+        """
+        On-disk cache of WRDS query results, stored as one Parquet file per month.
+
+        Files are laid out as cache_dir/<table>/<key hash>/<YYYY-MM>.parquet, where the key
+        hash covers the query filters. Reading and writing Parquet requires pyarrow (or fastparquet).
+
+        Args:
+            cache_dir (str): Root directory of the cache.
+            max_bytes (int, optional): Size limit of the cache. Least recently used months are evicted beyond it.
+            expire_days (float, optional): Months cached longer ago than this are fetched again.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.expire_days = expire_days
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _key_dir(self, table, key):
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, table, digest)
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, 'key.json'), 'w') as f:
+                json.dump(key, f, sort_keys=True, default=str)
+        return path
+
+    def _path(self, table, key, month):
+        return os.path.join(self._key_dir(table, key), f'{month.strftime("%Y-%m")}.parquet')
+
+    def _is_fresh(self, path):
+        if not os.path.exists(path):
+            return False
+        if self.expire_days is None:
+            return True
+        age = pd.Timestamp.now().timestamp() - os.path.getmtime(path)
+        return age <= self.expire_days * 86400
+
+    def missing(self, table, key, months):
+        """
+        Return the months that are not cached (or have expired) for a table and key.
+
+        Args:
+            table (str): The WRDS table, e.g. 'crsp.dsf'.
+            key (dict): The query filters identifying the cached result.
+            months (iterable of pd.Period): The requested monthly periods.
+
+        Returns:
+            list of pd.Period: The months that have to be fetched.
+        """
+        return [month for month in months if not self._is_fresh(self._path(table, key, month))]
+
+    def write(self, table, key, df, date_column, months):
+        """
+        Split a query result by month and store each month as a Parquet file.
+
+        Months without rows are stored as empty files so they are not fetched again.
+        Months that have not ended yet are not stored.
+
+        Args:
+            table (str): The WRDS table.
+            key (dict): The query filters identifying the cached result.
+            df (pd.DataFrame): The query result covering the given months.
+            date_column (str): The name of the date column used for partitioning.
+            months (iterable of pd.Period): The months covered by the query.
+        """
+        today = pd.Timestamp.today().normalize()
+        periods = pd.to_datetime(df[date_column]).dt.to_period('M')
+        for month in months:
+            if month.end_time >= today:
+                continue
+            df[(periods == month).values].reset_index(drop=True).to_parquet(self._path(table, key, month), index=False)
+
+    def read(self, table, key, months):
+        """
+        Read the cached months for a table and key into one data frame.
+
+        Args:
+            table (str): The WRDS table.
+            key (dict): The query filters identifying the cached result.
+            months (iterable of pd.Period): The months to read.
+
+        Returns:
+            pd.DataFrame: The concatenated cached data.
+        """
+        frames = []
+        for month in months:
+            path = self._path(table, key, month)
+            if os.path.exists(path):
+                frames.append(pd.read_parquet(path))
+                # Touch the file so that size-limit eviction is least recently used
+                os.utime(path, (pd.Timestamp.now().timestamp(), os.path.getmtime(path)))
+        return _concat(frames)
+
+    def invalidate(self, table=None, key=None, months=None):
+        """
+        Remove cached data.
+
+        Args:
+            table (str, optional): Restrict to one table. If None, the whole cache is cleared.
+            key (dict, optional): Restrict to one set of query filters of the table.
+            months (iterable of pd.Period, optional): Restrict to these months.
+        """
+        for path in self._files(table, key):
+            if months is None or os.path.basename(path)[:7] in {pd.Period(m, 'M').strftime('%Y-%m') for m in months}:
+                os.remove(path)
+
+    def _files(self, table=None, key=None):
+        if table is None:
+            root = self.cache_dir
+        elif key is None:
+            root = os.path.join(self.cache_dir, table)
+        else:
+            root = self._key_dir(table, key)
+        files = []
+        for dirpath, _, filenames in os.walk(root):
+            files += [os.path.join(dirpath, name) for name in filenames if name.endswith('.parquet')]
+        return files
+
+    def size(self):
+        """
+        Return the total size of the cached Parquet files in bytes.
+        """
+        return sum(os.path.getsize(path) for path in self._files())
+
+    def enforce_size_limit(self):
+        """
+        Evict the least recently used months until the cache fits into max_bytes.
+        """
+        if self.max_bytes is None:
+            return
+        files = sorted(self._files(), key=os.path.getatime)
+        total = sum(os.path.getsize(path) for path in files)
+        for path in files:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+
 class wrdsdata:
-    def __init__(self):
-        self.db = wrds.Connection()
-        
-    def get_jkp(self, country, sdate, edate, obs_main=1, common=1, primary_sec=1, exch_main=1, order_by_1='date', order_by_2='gvkey'):
+    def __init__(self, db=None, cache_dir=None, cache_max_bytes=None, cache_expire_days=None,
+                 connection_factory=None, max_connections=1, shard=None, retries=2, retry_wait=1.0, retry_errors=CONNECTION_ERRORS):
+        """
+        Initialize the WRDS data loader.
+
+        Args:
+            db (object, optional): A connection with a raw_sql(query) method (e.g. SQLConnection or LocalMirror). If None,
+                one is opened with connection_factory on the first query. The connection is never closed by the loader.
+            cache_dir (str, optional): Directory of the monthly Parquet cache. If None, queries are not cached.
+            cache_max_bytes (int, optional): Size limit of the cache in bytes.
+            cache_expire_days (float, optional): Age after which cached months are fetched again.
+            connection_factory (callable, optional): Opens a new connection. Defaults to wrds.Connection without db;
+                with db, no other connection is opened unless a factory is given.
+            max_connections (int): Number of connections used to run date shards concurrently. Defaults to 1.
+            shard (str, optional): Pandas frequency used to split date ranges into shards, e.g. 'Y'. If None, ranges are not split.
+            retries (int): Number of times a query that failed with a connection error is retried on a new connection.
+                Defaults to 2.
+            retry_wait (float): Seconds to wait before the first retry, doubled on every further retry. Defaults to 1.0.
+            retry_errors (tuple): Exception classes, or class names, of the connection errors that are retried. Other
+                errors (e.g. an unknown column) are raised at once. Defaults to CONNECTION_ERRORS (OperationalError,
+                InterfaceError and ConnectionError).
+        """
+        if connection_factory is None and db is None:
+            connection_factory = _wrds_connection
+        self.connection_factory = connection_factory
+        self._db = db
+        self._supplied = db
+        self.cache = ParquetCache(cache_dir, cache_max_bytes, cache_expire_days) if cache_dir else None
+        self.max_connections = max_connections
+        self.shard = shard
+        self.retries = retries
+        self.retry_wait = retry_wait
+        self.retry_errors = tuple(retry_errors)
+        self.pool = ConnectionPool(self.connection_factory, max_connections, [db] if db is not None else [])
+
+    @property
+    def db(self):
+        """
+        The primary connection, opened on first use.
+        """
+        if self._db is None:
+            self._db = self.pool.acquire()
+            self.pool.release(self._db)
+        return self._db
+
+    @staticmethod
+    def _select(table, date_column, sdate, edate, where=None, order_by=None, columns=None, sql=None):
+        if sql is not None:
+            return sql.format(sdate=sdate, edate=edate)
+        conditions = [f"{date_column} BETWEEN '{sdate}' AND '{edate}'"] + list(where or [])
+        if columns:
+            # The date and sort columns are needed for partitioning and ordering
+            columns = list(dict.fromkeys([date_column] + list(order_by or []) + list(columns)))
+        query = f"""SELECT {', '.join(columns) if columns else '*'}
+                    FROM {table}
+                    WHERE {' AND '.join(conditions)}
+                    """
+        if order_by:
+            query += f"ORDER BY {', '.join(order_by)}"
+        return query
+
+    def _fetch(self, table, date_column, sdate, edate, where=None, order_by=None, columns=None, compact=False, float32=False, sql=None):
+        """
+        Run a date-range query on a table, reading already cached months from the cache.
+
+        Args:
+            table (str): The WRDS table.
+            date_column (str): The name of the date column of the table.
+            sdate (str): Start date.
+            edate (str): End date.
+            where (list of str, optional): Additional SQL conditions.
+            order_by (list of str, optional): Columns to sort the result by.
+            columns (list of str, optional): Columns to select. If None, all columns are selected.
+            compact (bool): Whether to convert the result with compact_dtypes. Defaults to False.
+            float32 (bool or list of str): The float32 argument of compact_dtypes. Defaults to False.
+            sql (str, optional): A query template with {sdate} and {edate} placeholders that replaces the generated
+                SELECT. Its result must be partitionable by date_column. table then only names the cache entry.
+
+        Returns:
+            pd.DataFrame: The query result.
+        """
+        df = self._query(table, date_column, sdate, edate, where, order_by, columns, sql)
+        return compact_dtypes(df, float32=float32, date_column=date_column) if compact else df
+
+    def _run_query(self, query):
+        """
+        Run one query on a pooled connection, retrying connection errors on a new connection.
+        """
+        for attempt in range(self.retries + 1):
+            connection = self.pool.acquire()
+            try:
+                result = connection.raw_sql(query)
+            except Exception as error:
+                supplied = connection is self._supplied
+                # Errors of the query itself would fail again, and a supplied connection cannot be replaced without a factory
+                if not _is_error_of(error, self.retry_errors) or (supplied and self.connection_factory is None):
+                    self.pool.release(connection)
+                    raise
+                # The connection may be dead (e.g. a dropped SSL session), so the retry runs on a new one; the caller's
+                # connection is left open for the caller to close
+                self.pool.discard(connection, close=not supplied)
+                if connection is self._db:
+                    self._db = None
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.retry_wait * 2 ** attempt)
+            else:
+                self.pool.release(connection)
+                return result
+
+    def _run(self, queries):
+        """
+        Run queries concurrently on up to max_connections connections.
+
+        Returns:
+            list of pd.DataFrame: The query results, in the order of the queries.
+        """
+        if self.max_connections <= 1 or len(queries) <= 1:
+            return [self._run_query(query) for query in queries]
+        with ThreadPoolExecutor(max_workers=min(self.max_connections, len(queries))) as executor:
+            return list(executor.map(self._run_query, queries))
+
+    def _shards(self, months):
+        """
+        Split consecutive monthly periods into runs of whole months within the same shard period.
+        """
+        if self.shard is None:
+            return [(months[0], months[-1])]
+        runs = []
+        for month in months:
+            if runs and month.asfreq(self.shard) == runs[-1][0].asfreq(self.shard):
+                runs[-1] = (runs[-1][0], month)
+            else:
+                runs.append((month, month))
+        return runs
+
+    def _query(self, table, date_column, sdate, edate, where=None, order_by=None, columns=None, sql=None):
+        sdate, edate = _format_date(sdate), _format_date(edate)
+        if self.cache is None:
+            if self.shard is None:
+                return self._run_query(self._select(table, date_column, sdate, edate, where, order_by, columns, sql))
+            ranges = [(max(period.start_time, pd.Timestamp(sdate)), min(period.end_time, pd.Timestamp(edate)))
+                      for period in pd.period_range(sdate, edate, freq=self.shard)]
+            frames = self._run([self._select(table, date_column, _format_date(start), _format_date(end), where, order_by, columns, sql)
+                                for start, end in ranges])
+            df = _concat(frames)
+            if order_by and order_by[0] != date_column and len(df):
+                df = df.sort_values(list(order_by), kind='stable').reset_index(drop=True)
+            return df
+
+        key = {'where': list(where or []), 'columns': list(columns or [])}
+        if sql is not None:
+            key['sql'] = sql
+        months = pd.period_range(sdate, edate, freq='M')
+        runs = [shard for first, last in _month_runs(self.cache.missing(table, key, months))
+                for shard in self._shards(pd.period_range(first, last, freq='M'))]
+        results = self._run([self._select(table, date_column, _format_date(first.start_time), _format_date(last.end_time), where, order_by, columns, sql)
+                             for first, last in runs])
+        uncached = []
+        for (first, last), df in zip(runs, results):
+            run = pd.period_range(first, last, freq='M')
+            self.cache.write(table, key, df, date_column, run)
+            # Months that cannot be cached (e.g. the current month) are kept from the query result
+            still_missing = self.cache.missing(table, key, run)
+            if still_missing:
+                periods = pd.to_datetime(df[date_column]).dt.to_period('M')
+                uncached.append(df[periods.isin(still_missing).values])
+
+        cached = self.cache.read(table, key, months)
+        self.cache.enforce_size_limit()
+        df = _concat([cached] + uncached)
+        if df.empty:
+            return df
+        dates = pd.to_datetime(df[date_column])
+        df = df[((dates >= sdate) & (dates <= edate)).values]
+        if order_by:
+            df = df.sort_values(list(order_by), kind='stable')
+        return df.reset_index(drop=True)
+
+    def _stream(self, query, chunksize):
+        """
+        Stream a query result in chunks of rows through a server-side cursor.
+
+        The wrds.Connection's SQLAlchemy connection is used with stream_results so that only one chunk
+        is held in memory. Connections without it (e.g. a DB-API connection) are read with fetchmany.
+        """
+        connection = getattr(self.db, 'connection', self.db)
+        if hasattr(connection, 'execution_options'):
+            connection = connection.execution_options(stream_results=True)
+        elif not hasattr(connection, 'cursor'):
+            # A stand-in that only offers raw_sql cannot stream; split its result instead
+            df = self.db.raw_sql(query)
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize].reset_index(drop=True)
+            return
+        yield from pd.read_sql_query(query, connection, chunksize=chunksize)
+
+    def iter_table(self, table, date_column, sdate, edate, where=None, order_by=None, chunksize=None, partition='M', columns=None, compact=False, float32=False):
+        """
+        Iterate over a date-range query one date partition (or chunksize rows) at a time.
+
+        Args:
+            table (str): The WRDS table.
+            date_column (str): The name of the date column of the table.
+            sdate (str): Start date.
+            edate (str): End date.
+            where (list of str, optional): Additional SQL conditions.
+            order_by (list of str, optional): Columns to sort by. The date column is always sorted first.
+            chunksize (int, optional): Number of rows per chunk. If None, one query is run per date partition.
+            partition (str): Pandas frequency of the date partitions, e.g. 'M' (month) or 'Y' (year). Defaults to 'M'.
+            columns (list of str, optional): Columns to select. If None, all columns are selected.
+            compact (bool): Whether to convert each chunk with compact_dtypes. Defaults to False.
+            float32 (bool or list of str): The float32 argument of compact_dtypes. Defaults to False.
+
+        Yields:
+            pd.DataFrame: The query result, in date order.
+        """
+        sdate, edate = _format_date(sdate), _format_date(edate)
+        order_by = [date_column] + [column for column in (order_by or []) if column != date_column]
+        if chunksize:
+            for df in self._stream(self._select(table, date_column, sdate, edate, where, order_by, columns), chunksize):
+                yield compact_dtypes(df, float32=float32, date_column=date_column) if compact else df
+            return
+
+        for period in pd.period_range(sdate, edate, freq=partition):
+            start = max(period.start_time, pd.Timestamp(sdate))
+            end = min(period.end_time, pd.Timestamp(edate))
+            df = self._fetch(table, date_column, start, end, where, order_by, columns, compact, float32)
+            if len(df):
+                yield df
+
+    def get_table(self, table, columns=None):
+        """
+        Get a whole table without date filter, e.g. a CRSP names table. The result is not cached.
+
+        Args:
+            table (str): The schema-qualified table, e.g. 'crsp.msenames'.
+            columns (list of str, optional): Columns to select. If None, all columns are selected.
+
+        Returns:
+            pd.DataFrame: The table.
+        """
+        return self._run_query(f"SELECT {', '.join(columns) if columns else '*'} FROM {table}")
+
+    def _dialect(self):
+        """
+        The SQL dialect of the primary connection: 'sqlite', 'duckdb' or 'postgres' (WRDS).
+        """
+        return getattr(self.db, 'dialect', 'postgres')
+
+    def describe_table(self, table):
+        """
+        Get the column names and SQL types of a table from the database's information schema.
+
+        Args:
+            table (str): The schema-qualified table, e.g. 'crsp.msf'.
+
+        Returns:
+            pd.DataFrame: The name and type of each column, in table order.
+        """
+        schema, name = table.split('.')
+        return self._run_query(f"""SELECT column_name AS name, data_type AS type
+                    FROM information_schema.columns
+                    WHERE table_schema = '{schema}' AND table_name = '{name}'
+                    ORDER BY ordinal_position
+                    """)
+
+    def get_jkp(self, country, sdate, edate, obs_main=1, common=1, primary_sec=1, exch_main=1, order_by_1='date', order_by_2='gvkey', columns=None, compact=False, float32=False):
         """
         Get the data from JKP database.
         
-        
+        columns (list of str) restricts the selected characteristics; compact and float32 convert the
+        result with compact_dtypes (see _fetch).
         """
-        # SQL query to get the data
-        query = f"""SELECT *
-                    FROM contrib_global_factor.global_factor
-                    WHERE excntry = '{country}'
-                    AND obs_main = {obs_main}
-                    AND common = {common}
-                    AND primary_sec = {primary_sec}
-                    AND exch_main = {exch_main}
-                    AND date BETWEEN '{sdate}' AND '{edate}'
-                    ORDER BY {order_by_1}, {order_by_2}
-                    """
+        where = [f"excntry = '{country}'",
+                 f"obs_main = {obs_main}",
+                 f"common = {common}",
+                 f"primary_sec = {primary_sec}",
+                 f"exch_main = {exch_main}"]
         
-        return self.db.raw_sql(query)
+        return self._fetch('contrib_global_factor.global_factor', 'date', sdate, edate, where, [order_by_1, order_by_2], columns, compact, float32)
     
-    def get_crsp_monthly(self, sdate, edate,):
+    def get_crsp_monthly(self, sdate, edate, columns=None, compact=False, float32=False):
         """
+        Get the CRSP monthly stock file. See _fetch for columns, compact and float32.
         """
         
-        query = f"""SELECT *
-                    FROM crsp.msf
-                    WHERE date BETWEEN '{sdate}' AND '{edate}'
-                    """
-                    
-        return self.db.raw_sql(query)
+        return self._fetch('crsp.msf', 'date', sdate, edate, columns=columns, compact=compact, float32=float32)
     
-    def get_crsp_daily(self, sdate, edate):
+    def get_crsp_daily(self, sdate, edate, columns=None, compact=False, float32=False):
         """
+        Get the CRSP daily stock file. See _fetch for columns, compact and float32.
         """
         
-        query = f"""SELECT *
-                    FROM crsp.dsf
-                    WHERE date BETWEEN '{sdate}' AND '{edate}'
-                    """
-                    
-        return self.db.raw_sql(query)
+        return self._fetch('crsp.dsf', 'date', sdate, edate, columns=columns, compact=compact, float32=float32)
     
-    def get_compustat_annual(self, sdate, edate):
+    def get_compustat_annual(self, sdate, edate, columns=None, compact=False, float32=False):
         """
+        Get the Compustat annual fundamentals. See _fetch for columns, compact and float32.
         """
         
         # sale, revt, cogs, xsga, xad, xrd, xlr, spi, xopr, ebitda, dp, ebit, xint, pi, tax, xido, ib, ni, dvc, dvt, 
         # capx, prstkc, purtshr, sstk, dltis, dltr, dlcch, fincf
             
-        query = f"""SELECT *
-                    FROM comp.funda
-                    WHERE datadate BETWEEN '{sdate}' AND '{edate}'
-                    """
-                    
-        return self.db.raw_sql(query)
+        return self._fetch('comp.funda', 'datadate', sdate, edate, columns=columns, compact=compact, float32=float32)
     
-    def get_compustat_quarterly(self, sdate, edate):
+    def get_compustat_quarterly(self, sdate, edate, columns=None, compact=False, float32=False):
         """
+        Get the Compustat quarterly fundamentals. See _fetch for columns, compact and float32.
         """
         
         # ibq, saleq
     
-        query = f"""SELECT *
-                    FROM comp.fundq
-                    WHERE datadate BETWEEN '{sdate}' AND '{edate}'
-                    """
-                    
-        return self.db.raw_sql(query)
+        return self._fetch('comp.fundq', 'datadate', sdate, edate, columns=columns, compact=compact, float32=float32)
 
-    def get_ff_daily(self, sdate, edate):
+    def get_ff_daily(self, sdate, edate, columns=None, compact=False, float32=False):
         """
+        Get the daily Fama-French factors. See _fetch for columns, compact and float32.
         """
         
-        query = f"""SELECT *
-                    FROM ff.factors_daily
-                    WHERE date BETWEEN '{sdate}' AND '{edate}'
-                    """
-                    
-        return self.db.raw_sql(query)
+        return self._fetch('ff.factors_daily', 'date', sdate, edate, columns=columns, compact=compact, float32=float32)
     
-    def get_ff_monthly(self, sdate, edate):
+    def get_ff_monthly(self, sdate, edate, columns=None, compact=False, float32=False):
         """
+        Get the monthly Fama-French factors. See _fetch for columns, compact and float32.
         """
         
-        query = f"""SELECT *
-                    FROM ff.factors_monthly
-                    WHERE date BETWEEN '{sdate}' AND '{edate}'
+        return self._fetch('ff.factors_monthly', 'date', sdate, edate, columns=columns, compact=compact, float32=float32)
+
+    @staticmethod
+    def _names_filter(names_table, shrcd=None, exchcd=None):
+        """
+        Build the join on a CRSP names table and the share-code and exchange conditions (see the notes above).
+
+        Returns:
+            tuple of str: The JOIN clause (empty without filters) and the AND conditions.
+        """
+        conditions = []
+        if shrcd:
+            conditions.append(f"b.shrcd IN ({', '.join(str(code) for code in shrcd)})")
+        if exchcd:
+            conditions.append(f"b.exchcd IN ({', '.join(str(code) for code in exchcd)})")
+        if not conditions:
+            return '', ''
+        join = f"""JOIN {names_table} AS b
+                    ON a.permno = b.permno
+                    AND b.namedt <= a.date
+                    AND a.date <= b.nameendt"""
+        return join, ''.join(f"\n                    AND {condition}" for condition in conditions)
+
+    def get_crsp_monthly_filtered(self, sdate, edate, shrcd=(10, 11), exchcd=(1, 2, 3)):
+        """
+        Get CRSP monthly returns and market equity with the share-code and exchange filters applied on the server.
+
+        Args:
+            sdate (str): Start date.
+            edate (str): End date.
+            shrcd (tuple of int, optional): Share codes to keep. Defaults to ordinary common shares (10, 11).
+            exchcd (tuple of int, optional): Exchange codes to keep. Defaults to NYSE, AMEX and NASDAQ (1, 2, 3).
+
+        Returns:
+            pd.DataFrame: permno, permco, date, shrcd, exchcd, ret, retx, shrout, prc and me (= |prc| * shrout).
+        """
+        join, conditions = self._names_filter('crsp.msenames', shrcd, exchcd)
+        names = 'b.shrcd, b.exchcd' if join else 'NULL AS shrcd, NULL AS exchcd'
+        sql = f"""SELECT a.permno, a.permco, a.date, {names},
+                    a.ret, a.retx, a.shrout, a.prc, ABS(a.prc) * a.shrout AS me
+                    FROM crsp.msf AS a
+                    {join}
+                    WHERE a.date BETWEEN '{{sdate}}' AND '{{edate}}'{conditions}
+                    ORDER BY a.date, a.permno
+                    """
+
+        return self._fetch('crsp.msf_filtered', 'date', sdate, edate, order_by=['date', 'permno'], sql=sql)
+
+    def get_crsp_monthly_from_daily(self, sdate, edate, shrcd=(10, 11), exchcd=(1, 2, 3)):
+        """
+        Compound CRSP daily returns to monthly returns on the server, so that only one row per stock and month is transferred.
+
+        The range is widened to whole months, so the first and last months are compounded over all their days.
+        Missing daily returns are skipped. On SQLite, LN and EXP require SQLite's math functions (3.35 or later).
+
+        Args:
+            sdate (str): Start date.
+            edate (str): End date.
+            shrcd (tuple of int, optional): Share codes to keep. Defaults to ordinary common shares (10, 11).
+            exchcd (tuple of int, optional): Exchange codes to keep. Defaults to NYSE, AMEX and NASDAQ (1, 2, 3).
+
+        Returns:
+            pd.DataFrame: permno, date (last trading day of the month), ret (compounded) and n (number of daily returns).
+        """
+        sdate = pd.Timestamp(sdate).to_period('M').start_time
+        edate = pd.Timestamp(edate).to_period('M').end_time
+        join, conditions = self._names_filter('crsp.dsenames', shrcd, exchcd)
+        month = "strftime('%Y-%m', a.date)" if self._dialect() == 'sqlite' else "date_trunc('month', a.date)"
+        # A return of -100% is floored so that the logarithm stays defined; missing returns are left out of the sum
+        sql = f"""SELECT a.permno, MAX(a.date) AS date,
+                    EXP(SUM(LN(CASE WHEN 1 + a.ret > 1e-12 THEN 1 + a.ret WHEN a.ret IS NOT NULL THEN 1e-12 END))) - 1 AS ret,
+                    COUNT(a.ret) AS n
+                    FROM crsp.dsf AS a
+                    {join}
+                    WHERE a.date BETWEEN '{{sdate}}' AND '{{edate}}'{conditions}
+                    GROUP BY a.permno, {month}
+                    ORDER BY date, a.permno
+                    """
+
+        return self._fetch('crsp.dsf_monthly', 'date', sdate, edate, order_by=['date', 'permno'], sql=sql)
+
+    def get_nyse_breakpoints(self, sdate, edate, num_portfolios=5, custom_percentiles=None, shrcd=(10, 11)):
+        """
+        Calculate per-month NYSE market equity breakpoints on the server.
+
+        The percentiles use percentile_cont, which WRDS (PostgreSQL) and DuckDB provide but SQLite does not.
+
+        Args:
+            sdate (str): Start date.
+            edate (str): End date.
+            num_portfolios (int): The number of size portfolios. Defaults to 5.
+            custom_percentiles (list of float, optional): Custom percentiles between 0 and 100. If None, evenly spaced percentiles are used.
+            shrcd (tuple of int, optional): Share codes of the stocks used. Defaults to ordinary common shares (10, 11).
+
+        Returns:
+            pd.DataFrame: The breakpoints for each month, in the format of UnivariatePortfolioAnalyzer.cal_bp.
+        """
+        if custom_percentiles:
+            assert all(0 < p < 100 for p in custom_percentiles), "Percentiles must be between 0 and 100"
+            percentiles = custom_percentiles
+        else:
+            percentiles = [k * 100 / num_portfolios for k in range(1, num_portfolios)]
+        if self._dialect() == 'sqlite':
+            raise ValueError("get_nyse_breakpoints needs percentile_cont, which SQLite does not support; use WRDS or a DuckDB mirror")
+
+        join, conditions = self._names_filter('crsp.msenames', shrcd, (1,))
+        quantiles = ',\n                    '.join(f"percentile_cont({p / 100}) WITHIN GROUP (ORDER BY ABS(a.prc) * a.shrout) AS b{k + 1}"
+                                                   for k, p in enumerate(percentiles))
+        sql = f"""SELECT a.date,
+                    {quantiles}
+                    FROM crsp.msf AS a
+                    {join}
+                    WHERE a.date BETWEEN '{{sdate}}' AND '{{edate}}'{conditions}
+                    AND a.prc IS NOT NULL
+                    AND a.shrout > 0
+                    GROUP BY a.date
+                    ORDER BY a.date
                     """
-                    
-        return self.db.raw_sql(query)
 
+        breakpoints = self._fetch('crsp.msf_nyse_bp', 'date', sdate, edate, order_by=['date'], sql=sql).set_index('date')
+        breakpoints.columns = [f'B{k+1} ({round(percentiles[k], 3)})' for k in range(len(percentiles))]
+        return breakpoints
+
+    def iter_jkp(self, country, sdate, edate, obs_main=1, common=1, primary_sec=1, exch_main=1, order_by='gvkey', chunksize=None, partition='M', columns=None, compact=False, float32=False):
+        """
+        Iterate over the JKP data one date partition (or chunksize rows) at a time.
+
+        See get_jkp for the filters and iter_table for the remaining arguments.
+        """
+        where = [f"excntry = '{country}'",
+                 f"obs_main = {obs_main}",
+                 f"common = {common}",
+                 f"primary_sec = {primary_sec}",
+                 f"exch_main = {exch_main}"]
+
+        return self.iter_table('contrib_global_factor.global_factor', 'date', sdate, edate, where, [order_by], chunksize, partition, columns, compact, float32)
+
+    def iter_crsp_daily(self, sdate, edate, chunksize=None, partition='M', columns=None, compact=False, float32=False):
+        """
+        Iterate over the CRSP daily stock file one date partition (or chunksize rows) at a time.
+
+        Peak memory is bounded by one partition, so multi-decade ranges can be processed with
+        datatools.iter_periods, summary_statistics.cal_cs_stats or preprocess.winsorize_chunks.
+
+        See iter_table for the remaining arguments.
+        """
 
+        return self.iter_table('crsp.dsf', 'date', sdate, edate, order_by=['permno'], chunksize=chunksize, partition=partition, columns=columns, compact=compact, float32=float32)
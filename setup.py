@@ -12,9 +12,14 @@ setup(
         'statsmodels',
         'tabulate'
     ],
+    extras_require={
+        'cache': ['pyarrow'],
+        'mirror': ['duckdb'],
+    },
     entry_points={
         'console_scripts': [
             # 필요한 경우 커맨드라인 스크립트 정의
+            'nafitools-mirror=nafitools.mirror:main',
         ],
     },
     author='Yeonchan Kang',
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nafitools.correlation import cal_corr, cal_per_corr, cal_ts_avcorr, CorrelationUpdater
+
+
+def _characteristics(n_periods=5, n_rows=60, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_periods * n_rows
+    common = rng.normal(size=n)
+    df = pd.DataFrame({
+        'date': np.repeat(pd.date_range('2000-01-31', periods=n_periods, freq='ME'), n_rows),
+        'a': common + rng.normal(size=n),
+        # Rounded values have ties
+        'b': np.round(common + rng.normal(size=n), 1),
+        'c': rng.normal(size=n),
+        'd': np.round(rng.normal(size=n)),
+    })
+    # Different missing values per variable, and one variable missing in a whole period
+    for column, fraction in [('a', 0.1), ('b', 0.2), ('c', 0.05)]:
+        df.loc[df.sample(frac=fraction, random_state=seed + len(column) + int(fraction * 100)).index, column] = np.nan
+    df.loc[df['date'] == df['date'].iloc[0], 'd'] = np.nan
+    return df
+
+
+def test_per_period_correlations_match_scipy():
+    df = _characteristics()
+    result = cal_per_corr(df, 'date').set_index(['date', 'Var1', 'Var2'])
+
+    variables = ['a', 'b', 'c', 'd']
+    for date, group in df.groupby('date'):
+        for i, var1 in enumerate(variables):
+            for var2 in variables[i + 1:]:
+                expected = cal_corr(group, var1, var2)
+                row = result.loc[(date, var1, var2)]
+                assert row['N'] == group[[var1, var2]].dropna().shape[0]
+                for column in ['Pearson', 'Spearman']:
+                    if np.isnan(expected[column]):
+                        assert np.isnan(row[column])
+                    else:
+                        assert row[column] == pytest.approx(expected[column], abs=1e-12)
+
+
+def test_array_output_matches_long_output():
+    df = _characteristics(seed=1)
+    long = cal_per_corr(df, 'date')
+    arrays = cal_per_corr(df, 'date', output='array')
+
+    assert arrays['Variables'] == ['a', 'b', 'c', 'd']
+    assert arrays['Pearson'].shape == (5, 4, 4)
+    i, j = np.triu_indices(4, 1)
+    np.testing.assert_array_equal(arrays['Spearman'][:, i, j].T.ravel(), long['Spearman'].to_numpy())
+    np.testing.assert_array_equal(arrays['Pearson'], arrays['Pearson'].transpose(0, 2, 1))
+
+
+def test_updater_matches_a_full_recompute():
+    df = _characteristics(n_periods=8, seed=2)
+    dates = df['date'].unique()
+    updater = CorrelationUpdater(df[df['date'] < dates[3]], 'date')
+    new = updater.update(df[df['date'].isin(dates[3:5])])
+    assert set(new['date']) == set(dates[3:5])
+    updater.update(df[df['date'] >= dates[5]])
+
+    full = cal_per_corr(df, 'date')
+    pd.testing.assert_frame_equal(updater.correlations, full, check_exact=True)
+    pd.testing.assert_frame_equal(updater.averages(), cal_ts_avcorr(full), check_exact=True)
+
+    with pytest.raises(ValueError):
+        updater.update(df[df['date'] == dates[-1]])
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nafitools.datatools import PanelFrame, as_panel, concat_frames, iter_periods
+from nafitools.persistence import cal_cs_persistence
+
+
+def _panel(n_periods=12, n_entities=20, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'date': np.repeat(pd.date_range('2000-01-31', periods=n_periods, freq='ME'), n_entities),
+        'id': np.tile(np.arange(n_entities), n_periods),
+        'x': rng.normal(size=n_periods * n_entities),
+    })
+    return df.sample(frac=0.9, random_state=seed).reset_index(drop=True)
+
+
+def test_as_panel_rebuilds_a_panel_with_another_id_column():
+    df = _panel()
+    panel = PanelFrame(df, 'date')
+    assert as_panel(panel, 'date') is panel
+
+    rebuilt = as_panel(panel, 'date', 'id')
+    assert rebuilt.id_column == 'id'
+    expected = cal_cs_persistence(df, 'date', ['x'], 'id', max_tau=2)['x']
+    pd.testing.assert_frame_equal(cal_cs_persistence(panel, 'date', ['x'], 'id', max_tau=2)['x'], expected)
+
+    with pytest.raises(ValueError):
+        as_panel(panel, 'month')
+
+
+def test_lag_matches_groupby_shift():
+    df = _panel()
+    panel = PanelFrame(df, 'date', 'id')
+    data = panel.data
+    # Lags are counted in periods of the panel, as groupby shift is on complete histories
+    complete = df.groupby('id')['date'].transform('size') == df['date'].nunique()
+    lagged = panel.lag('x')
+    expected = data.groupby('id')['x'].shift(1)
+    rows = data['id'].isin(df.loc[complete, 'id']).to_numpy()
+    pd.testing.assert_series_equal(lagged[rows], expected[rows], check_names=False)
+
+
+def test_iter_periods_keeps_periods_whole_and_categories():
+    df = _panel().sort_values(['date', 'id']).reset_index(drop=True)
+    df['name'] = pd.Categorical(df['id'].astype(str))
+    chunks = [df.iloc[start:start + 17].assign(name=lambda frame: frame['name'].astype(str).astype('category'))
+              for start in range(0, len(df), 17)]
+
+    blocks = list(iter_periods(chunks, 'date'))
+    for block in blocks:
+        assert block['name'].dtype == 'category'
+    assert sum(block['date'].nunique() for block in blocks) == df['date'].nunique()
+    combined = concat_frames(blocks)
+    assert combined['name'].astype(str).tolist() == df['name'].astype(str).tolist()
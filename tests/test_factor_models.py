@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import f
+
+from nafitools.factor_models import fama_macbeth, time_series_regressions
+
+
+def _cross_sections(n_periods=24, n_stocks=50, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_periods * n_stocks
+    df = pd.DataFrame({
+        'date': np.repeat(pd.date_range('2000-01-31', periods=n_periods, freq='ME'), n_stocks),
+        'permno': np.tile(np.arange(n_stocks), n_periods),
+        'beta': rng.normal(1, 0.3, size=n),
+        'size': rng.normal(size=n),
+    })
+    df['ret'] = 0.01 + 0.02 * df['beta'] - 0.01 * df['size'] + rng.normal(0, 0.05, size=n)
+    # Missing returns and regressors are dropped row by row
+    df.loc[df.sample(frac=0.05, random_state=seed).index, 'ret'] = np.nan
+    df.loc[df.sample(frac=0.05, random_state=seed + 1).index, 'size'] = np.nan
+    return df
+
+
+def _lstsq_loop(df, regressors, intercept=True):
+    """
+    One least-squares regression per period on its complete rows.
+    """
+    rows = []
+    for time_period, period_data in df.groupby('date'):
+        period_data = period_data.dropna(subset=['ret'] + regressors)
+        X = period_data[regressors].to_numpy()
+        if intercept:
+            X = np.column_stack([np.ones(len(X)), X])
+        y = period_data['ret'].to_numpy()
+        if len(y) <= X.shape[1] or np.linalg.matrix_rank(X) < X.shape[1]:
+            continue
+        coef = np.linalg.lstsq(X, y, rcond=None)[0]
+        residuals = y - X @ coef
+        total = y - y.mean() if intercept else y
+        rows.append([time_period, *coef, 1 - residuals @ residuals / (total @ total), len(y)])
+    return pd.DataFrame(rows, columns=['date'] + ['const'] * intercept + regressors + ['R2', 'N']).set_index('date')
+
+
+def _bartlett_se(series, lags):
+    demeaned = series - series.mean()
+    variance = demeaned @ demeaned / len(series)
+    for lag in range(1, lags + 1):
+        variance += 2 * (1 - lag / (lags + 1)) * (demeaned[lag:] @ demeaned[:-lag]) / len(series)
+    return np.sqrt(variance / len(series))
+
+
+@pytest.mark.parametrize('intercept', [True, False])
+def test_fama_macbeth_matches_a_period_loop(intercept):
+    df = _cross_sections()
+    # A period with too few complete rows and a period with collinear regressors have no regression
+    dates = df['date'].unique()
+    df.loc[(df['date'] == dates[3]) & (df['permno'] > 1), 'ret'] = np.nan
+    df.loc[df['date'] == dates[7], 'size'] = 2 * df.loc[df['date'] == dates[7], 'beta']
+
+    summary, coefficients = fama_macbeth(df, 'date', 'ret', ['beta', 'size'], intercept=intercept, lags=2)
+    expected = _lstsq_loop(df, ['beta', 'size'], intercept=intercept)
+
+    assert dates[3] not in coefficients.index and dates[7] not in coefficients.index
+    pd.testing.assert_frame_equal(coefficients, expected, check_dtype=False, check_freq=False, rtol=1e-8)
+
+    params = ['const', 'beta', 'size'] if intercept else ['beta', 'size']
+    for param in params:
+        assert summary.loc[param, 'Coef'] == pytest.approx(expected[param].mean())
+        assert summary.loc[param, 'SE'] == pytest.approx(_bartlett_se(expected[param].to_numpy(), 2))
+        assert summary.loc[param, 't'] == pytest.approx(summary.loc[param, 'Coef'] / summary.loc[param, 'SE'])
+    assert summary.loc['R2', 'Coef'] == pytest.approx(expected['R2'].mean())
+    assert summary.loc['N', 'Coef'] == pytest.approx(expected['N'].mean())
+
+
+def _test_assets(n_periods=120, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2000-01-31', periods=n_periods, freq='ME')
+    factors = pd.DataFrame(rng.normal(0.005, 0.04, size=(n_periods, 2)), index=index, columns=['mkt', 'smb'])
+    loadings = rng.normal(1, 0.3, size=(2, 5))
+    returns = pd.DataFrame(0.001 + factors.to_numpy() @ loadings + rng.normal(0, 0.02, size=(n_periods, 5)),
+                           index=index, columns=[f'P{k}' for k in range(1, 6)])
+    return returns, factors
+
+
+def _asset_regression(y, X, lags):
+    """
+    Least squares of one asset on its observed periods with Newey-West standard errors.
+    """
+    observed = ~np.isnan(y)
+    y, X = y[observed], X[observed]
+    coef = np.linalg.lstsq(X, y, rcond=None)[0]
+    scores = X * (y - X @ coef)[:, None]
+    S = scores.T @ scores
+    for lag in range(1, lags + 1):
+        gamma = scores[lag:].T @ scores[:-lag]
+        S += (1 - lag / (lags + 1)) * (gamma + gamma.T)
+    inverse = np.linalg.inv(X.T @ X)
+    return coef, coef / np.sqrt(np.diag(inverse @ S @ inverse))
+
+
+def test_time_series_regressions_match_per_asset_regressions():
+    returns, factors = _test_assets()
+    # An asset starting later, an asset without returns and an asset with too few periods
+    returns.iloc[:30, 1] = np.nan
+    returns['empty'] = np.nan
+    returns['short'] = np.nan
+    returns.iloc[[5, 60], -1] = 0.01
+
+    table, grs = time_series_regressions(returns, factors, lags=3)
+    X = np.column_stack([np.ones(len(factors)), factors.to_numpy()])
+    names = ['alpha', 'mkt', 'smb']
+    for asset in returns.columns[:5]:
+        coef, t = _asset_regression(returns[asset].to_numpy(), X, 3)
+        assert table.loc[asset, names].to_numpy() == pytest.approx(coef, rel=1e-8)
+        assert table.loc[asset, [f'{name}_t' for name in names]].to_numpy() == pytest.approx(t, rel=1e-8)
+    assert table.loc['P2', 'T'] == 90
+    assert table.loc[['empty', 'short'], names].isna().all().all()
+    assert table.loc['short', 'T'] == 2
+
+    # GRS on the periods in which all assets with a regression are observed
+    Y, Xb = returns.iloc[30:, :5].to_numpy(), X[30:]
+    T, N, L = len(Y), 5, 2
+    coef = np.linalg.lstsq(Xb, Y, rcond=None)[0]
+    errors = Y - Xb @ coef
+    sigma = errors.T @ errors / T
+    mu = Xb[:, 1:].mean(axis=0)
+    omega = np.cov(Xb[:, 1:].T, bias=True)
+    expected = (T - N - L) / N * (coef[0] @ np.linalg.solve(sigma, coef[0])) / (1 + mu @ np.linalg.solve(omega, mu))
+    assert grs['GRS'] == pytest.approx(expected)
+    assert grs['p-value'] == pytest.approx(f.sf(expected, N, T - N - L))
+    assert (grs['T'], grs['N'], grs['L']) == (T, N, L)
+
+    # Assets without a regression do not change the others
+    balanced, _ = time_series_regressions(returns.iloc[:, :5], factors, lags=3)
+    pd.testing.assert_frame_equal(table.loc[balanced.index], balanced)
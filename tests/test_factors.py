@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nafitools.factors import FactorBuilder
+
+
+def _crsp(n_periods=30, n_stocks=60, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_periods * n_stocks
+    df = pd.DataFrame({
+        'date': np.repeat(pd.date_range('2000-01-31', periods=n_periods, freq='ME'), n_stocks),
+        'permno': np.tile(np.arange(n_stocks), n_periods),
+        'ret': rng.normal(0.01, 0.08, size=n),
+        'me': rng.lognormal(3, 1, size=n),
+        'bm': rng.lognormal(size=n),
+        'mom': rng.normal(size=n),
+        'exchcd': rng.choice([1, 2, 3], size=n),
+        'dlret': np.nan,
+    })
+    # Missing characteristics and returns, delistings, and stocks missing in some months
+    df.loc[df.sample(frac=0.05, random_state=seed).index, 'bm'] = np.nan
+    df.loc[df.sample(frac=0.03, random_state=seed + 1).index, 'ret'] = np.nan
+    df.loc[df.sample(n=30, random_state=seed + 2).index, 'dlret'] = -0.3
+    df = df.drop(df.sample(frac=0.05, random_state=seed + 3).index)
+    return df.reset_index(drop=True)
+
+
+def _direct_cells(df, characteristic, monthly):
+    """
+    Value-weighted 2 x 3 cell returns with NYSE breakpoints, computed month by month from the latest formation.
+    """
+    df = df.assign(total=np.where(df['dlret'].notna(), (1 + df['ret'].fillna(0)) * (1 + df['dlret']) - 1, df['ret']))
+    months = np.sort(df['date'].unique())
+    cells, formed = {}, None
+    for previous, month in zip(months[:-1], months[1:]):
+        if monthly or pd.Timestamp(previous).month == 6:
+            sorted_ = df[(df['date'] == previous) & (df['me'] > 0)].dropna(subset=['me', characteristic])
+            nyse = sorted_[sorted_['exchcd'] == 1]
+            size = np.searchsorted(np.percentile(nyse['me'], [50]), sorted_['me'], side='left')
+            value = np.searchsorted(np.percentile(nyse[characteristic], [30, 70]), sorted_[characteristic], side='left')
+            formed = pd.Series(size * 3 + value, index=sorted_['permno'].to_numpy())
+        if formed is None:
+            cells[month] = np.full(6, np.nan)
+            continue
+        held = df[df['date'] == month].set_index('permno')
+        held['cell'] = formed.reindex(held.index)
+        held['weight'] = df[df['date'] == previous].set_index('permno')['me'].reindex(held.index)
+        held = held.dropna(subset=['cell', 'total', 'weight'])
+        held = held[held['weight'] > 0]
+        sums = (held['total'] * held['weight']).groupby(held['cell']).sum() / held['weight'].groupby(held['cell']).sum()
+        cells[month] = sums.reindex(range(6)).to_numpy()
+    return pd.DataFrame.from_dict(cells, orient='index')
+
+
+def test_factors_match_a_direct_computation():
+    df = _crsp()
+    builder = FactorBuilder(df, 'date', 'permno', {'HML': 'bm', 'UMD': 'mom'}, rebalance={'UMD': 'monthly'},
+                            delisting_column='dlret')
+
+    for name, characteristic, monthly in [('HML', 'bm', False), ('UMD', 'mom', True)]:
+        cells = _direct_cells(df, characteristic, monthly)
+        built = builder.portfolio_returns[name]
+        assert np.allclose(built.to_numpy(), cells.to_numpy(), equal_nan=True, rtol=1e-12)
+        factor = cells[[2, 5]].mean(axis=1) - cells[[0, 3]].mean(axis=1)
+        assert np.allclose(builder.history[name], factor, equal_nan=True, rtol=1e-12)
+        if name == 'HML':
+            size = cells[[0, 1, 2]].mean(axis=1) - cells[[3, 4, 5]].mean(axis=1)
+            assert np.allclose(builder.history['SMB'], size, equal_nan=True, rtol=1e-12)
+    # HML is first formed in June and held from July on
+    assert builder.history['HML'].first_valid_index() == pd.Timestamp('2000-07-31')
+
+
+def test_updates_and_reload_match_a_full_build(tmp_path):
+    df = _crsp()
+    options = dict(factors={'HML': 'bm', 'UMD': 'mom'}, rebalance={'UMD': 'monthly'}, delisting_column='dlret')
+    full = FactorBuilder(df, 'date', 'permno', **options)
+
+    months = np.sort(df['date'].unique())
+    builder = FactorBuilder(df[df['date'] < months[10]], 'date', 'permno', **options)
+    builder.update(df[(df['date'] >= months[10]) & (df['date'] < months[20])])
+    builder.save(tmp_path / 'factors.pkl')
+    loaded = FactorBuilder.load(tmp_path / 'factors.pkl')
+    new = loaded.update(df[df['date'] >= months[20]])
+
+    assert len(new) == len(months) - 20
+    pd.testing.assert_frame_equal(loaded.history, full.history, check_exact=True)
+    pd.testing.assert_frame_equal(loaded.portfolio_returns, full.portfolio_returns, check_exact=True)
+
+
+def test_update_requires_consecutive_months():
+    df = _crsp(n_periods=12)
+    months = np.sort(df['date'].unique())
+    builder = FactorBuilder(df[df['date'] <= months[5]], 'date', 'permno', {'HML': 'bm'})
+
+    with pytest.raises(ValueError):
+        builder.update(df[df['date'] == months[5]])
+    with pytest.raises(ValueError):
+        builder.update(df[df['date'] == months[7]])
+    with pytest.raises(ValueError):
+        builder.update(df[df['date'].isin([months[6], months[8]])])
+    with pytest.raises(ValueError):
+        FactorBuilder(df[df['date'] != months[3]], 'date', 'permno', {'HML': 'bm'})
+
+    # A rejected update leaves the builder unchanged
+    builder.update(df[df['date'] > months[5]])
+    pd.testing.assert_frame_equal(builder.history, FactorBuilder(df, 'date', 'permno', {'HML': 'bm'}).history)
@@ -0,0 +1,101 @@
+import pandas as pd
+import pytest
+
+from nafitools.mirror import LocalMirror
+from nafitools.wrdsdata import wrdsdata
+
+pytest.importorskip('duckdb')
+
+
+@pytest.fixture
+def source(tmp_path):
+    # The first partitions have an all-null factor, as early WRDS data often does
+    mirror = LocalMirror(str(tmp_path / 'source'))
+    mirror.connection.execute("CREATE TABLE ff.factors_monthly (date DATE, smb DOUBLE, umd DECIMAL(8, 4), n INTEGER, note VARCHAR)")
+    mirror.connection.execute("""INSERT INTO ff.factors_monthly VALUES
+                              ('1926-07-31', -0.01, NULL, NULL, NULL),
+                              ('1927-07-31', 0.01, NULL, NULL, NULL),
+                              ('1930-01-31', 0.02, 0.015, 5, 'x')""")
+    yield wrdsdata(db=mirror)
+    mirror.close()
+
+
+@pytest.mark.parametrize('engine', ['duckdb', 'sqlite'])
+def test_types_come_from_the_source_schema(tmp_path, source, engine):
+    mirror = LocalMirror(str(tmp_path / engine), engine)
+    rows = mirror.sync(source, ['ff.factors_monthly'], '1926-01-01', '1931-12-31')
+    assert rows.loc['ff.factors_monthly', 'Rows'] == 3
+
+    df = wrdsdata(db=mirror).get_ff_monthly('1926-01-01', '1931-12-31')
+    assert pd.api.types.is_float_dtype(df['umd'])
+    assert df['umd'].iloc[-1] == pytest.approx(0.015)
+    assert pd.api.types.is_numeric_dtype(df['n'])
+    assert df['note'].iloc[-1] == 'x'
+
+    # A refresh replaces the rows of its date range
+    mirror.sync(source, ['ff.factors_monthly'], '1930-01-01', '1931-12-31')
+    assert len(wrdsdata(db=mirror).get_ff_monthly('1926-01-01', '1931-12-31')) == 3
+    mirror.close()
+
+
+def test_monthly_returns_from_daily(tmp_path):
+    mirror = LocalMirror(str(tmp_path / 'daily'))
+    mirror.connection.execute("CREATE TABLE crsp.dsf (permno INTEGER, date DATE, ret DOUBLE)")
+    mirror.connection.execute("""INSERT INTO crsp.dsf VALUES
+                              (1, '2020-01-02', 0.01), (1, '2020-01-15', NULL), (1, '2020-01-31', 0.02),
+                              (1, '2020-02-03', -1.0), (1, '2020-02-28', 0.5),
+                              (2, '2020-01-31', NULL)""")
+    df = wrdsdata(db=mirror).get_crsp_monthly_from_daily('2020-01-20', '2020-02-10', shrcd=None, exchcd=None)
+    mirror.close()
+
+    df = df.set_index(['permno', df['date'].dt.month])
+    returns = df['ret']
+    # Missing daily returns are skipped and partial months are widened to whole months
+    assert returns[(1, 1)] == pytest.approx(1.01 * 1.02 - 1)
+    assert returns[(1, 2)] == pytest.approx(-1, abs=1e-9)
+    assert pd.isna(returns[(2, 1)])
+    assert df['n'].to_dict() == {(1, 1): 2, (2, 1): 0, (1, 2): 2}
+
+
+@pytest.mark.parametrize('engine', ['duckdb', 'sqlite'])
+def test_filtered_getters_run_on_the_mirror(tmp_path, engine):
+    source = LocalMirror(str(tmp_path / 'crsp'))
+    for names in ['crsp.msenames', 'crsp.dsenames']:
+        # Stock 2 moves from NASDAQ to NYSE in February, stock 3 is not an ordinary common share
+        source.connection.execute(f"CREATE TABLE {names} (permno INTEGER, namedt DATE, nameendt DATE, shrcd INTEGER, exchcd INTEGER)")
+        source.connection.execute(f"""INSERT INTO {names} VALUES
+                                  (1, '1990-01-01', '2099-12-31', 10, 1),
+                                  (2, '1990-01-01', '2020-01-31', 11, 3), (2, '2020-02-01', '2099-12-31', 11, 1),
+                                  (3, '1990-01-01', '2099-12-31', 73, 1)""")
+    source.connection.execute("CREATE TABLE crsp.msf (permno INTEGER, permco INTEGER, date DATE, ret DOUBLE, retx DOUBLE, shrout DOUBLE, prc DOUBLE)")
+    source.connection.execute("""INSERT INTO crsp.msf VALUES
+                              (1, 1, '2020-01-31', 0.01, 0.01, 100, 10), (2, 2, '2020-01-31', 0.02, 0.02, 200, -20),
+                              (3, 3, '2020-01-31', 0.03, 0.03, 300, 30), (1, 1, '2020-02-28', 0.04, 0.04, 100, 11),
+                              (2, 2, '2020-02-28', 0.05, 0.05, 200, 21), (3, 3, '2020-02-28', 0.06, 0.06, 300, 31)""")
+    source.connection.execute("CREATE TABLE crsp.dsf (permno INTEGER, date DATE, ret DOUBLE)")
+    source.connection.execute("""INSERT INTO crsp.dsf VALUES
+                              (1, '2020-01-02', 0.01), (1, '2020-01-31', 0.02), (3, '2020-01-31', 0.5),
+                              (2, '2020-02-03', -1.0), (2, '2020-02-28', 0.5)""")
+
+    mirror = LocalMirror(str(tmp_path / engine), engine)
+    rows = mirror.sync(wrdsdata(db=source), ['crsp.msf', 'crsp.msenames', 'crsp.dsf', 'crsp.dsenames'], '2020-01-01', '2020-03-31')
+    source.close()
+    assert rows.loc['crsp.msenames', 'Rows'] == 4
+    data = wrdsdata(db=mirror)
+
+    filtered = data.get_crsp_monthly_filtered('2020-01-01', '2020-02-29')
+    assert list(zip(filtered['permno'], filtered['date'].dt.month)) == [(1, 1), (2, 1), (1, 2), (2, 2)]
+    assert filtered['exchcd'].tolist() == [1, 3, 1, 1]
+    assert filtered['me'].tolist() == [1000, 4000, 1100, 4200]
+
+    monthly = data.get_crsp_monthly_from_daily('2020-01-01', '2020-02-29')
+    assert monthly['permno'].tolist() == [1, 2]
+    assert monthly['ret'].tolist() == pytest.approx([1.01 * 1.02 - 1, -1], abs=1e-9)
+
+    if engine == 'sqlite':
+        with pytest.raises(ValueError, match='percentile_cont'):
+            data.get_nyse_breakpoints('2020-01-01', '2020-02-29', num_portfolios=2)
+    else:
+        breakpoints = data.get_nyse_breakpoints('2020-01-01', '2020-02-29', num_portfolios=2)
+        assert breakpoints.iloc[:, 0].tolist() == pytest.approx([1000, (1100 + 4200) / 2])
+    mirror.close()
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nafitools.persistence import cal_cs_persistence, calculate_average_persistence, PersistenceUpdater
+
+
+def _panel(dates, n_entities=30, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'date': np.repeat(dates, n_entities),
+        'id': np.tile(np.arange(n_entities), len(dates)),
+        'x': rng.normal(size=len(dates) * n_entities),
+        'y': rng.normal(size=len(dates) * n_entities),
+    })
+    # Unbalanced: some entities are missing in some periods and some values are missing
+    df = df.sample(frac=0.85, random_state=seed).sort_values(['date', 'id'], kind='stable')
+    df.loc[df.sample(frac=0.05, random_state=seed + 1).index, 'x'] = np.nan
+    return df.reset_index(drop=True)
+
+
+@pytest.mark.parametrize('dates, options', [
+    (pd.date_range('2000-01-31', periods=30, freq='ME'), {}),
+    (pd.date_range('2000-01-31', periods=30, freq='ME'), {'offset': pd.DateOffset(months=3)}),
+    (pd.date_range('2000-01-31', periods=30, freq='ME'), {'freq': 'M'}),
+    (pd.date_range('2000-01-01', periods=120, freq='D'), {}),
+])
+def test_updater_matches_a_full_recompute(dates, options):
+    df = _panel(dates)
+    full = cal_cs_persistence(df, 'date', ['x', 'y'], 'id', max_tau=3, **options)
+
+    split = dates[len(dates) // 3]
+    updater = PersistenceUpdater(df[df['date'] < split], 'date', ['x', 'y'], 'id', max_tau=3, **options)
+    rest = df[df['date'] >= split]
+    for start in range(0, len(dates), 7):
+        chunk = rest[rest['date'].isin(dates[start:start + 7])]
+        if len(chunk):
+            updater.update(chunk)
+
+    for column in ['x', 'y']:
+        assert full[column].notna().sum().sum() > 0
+        pd.testing.assert_frame_equal(updater.results[column], full[column], check_freq=False, check_exact=True)
+    pd.testing.assert_frame_equal(updater.averages(), calculate_average_persistence(full, 3), check_exact=True)
+
+
+def test_updater_rejects_past_periods():
+    df = _panel(pd.date_range('2000-01-31', periods=6, freq='ME'))
+    updater = PersistenceUpdater(df, 'date', ['x'], 'id', max_tau=2)
+    with pytest.raises(ValueError):
+        updater.update(df[df['date'] == df['date'].max()])
@@ -0,0 +1,275 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nafitools.portfolio import UnivariatePortfolioAnalyzer, BivariatePortfolioAnalyzer, StreamingBreakpoints
+
+
+def _stocks(n_periods=6, n_stocks=80, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_periods * n_stocks
+    df = pd.DataFrame({
+        'date': np.repeat(pd.date_range('2000-01-31', periods=n_periods, freq='ME'), n_stocks),
+        'permno': np.tile(np.arange(n_stocks), n_periods),
+        'x': rng.normal(size=n),
+        'ret': rng.normal(0.01, 0.05, size=n),
+        'me': rng.lognormal(size=n),
+    })
+    # Many zeros give duplicate breakpoints in the first period, and some characteristics are missing
+    first = df['date'] == df['date'].iloc[0]
+    df.loc[first & (df['permno'] < 50), 'x'] = 0.0
+    df.loc[df.sample(frac=0.05, random_state=seed).index, 'x'] = np.nan
+    return df
+
+
+def _loop_assign(df, breakpoints, value_column):
+    """
+    The period-by-period pd.cut assignment that the vectorized path replaces, with duplicate edges dropped.
+    """
+    df = df.dropna(subset=[value_column]).copy()
+    df['portfolio'] = np.full(len(df), np.nan, dtype=object)
+    for time_period in breakpoints.index:
+        period_data = df[df['date'] == time_period]
+        edges = np.unique(breakpoints.loc[time_period].dropna().values)
+        portfolios = pd.cut(period_data[value_column], bins=[-np.inf] + edges.tolist() + [np.inf],
+                            labels=[f'P{k+1}' for k in range(len(edges) + 1)], include_lowest=True)
+        df.loc[period_data.index, 'portfolio'] = portfolios.astype(object)
+    return df['portfolio']
+
+
+def test_assign_portfolios_matches_the_period_loop():
+    df = _stocks()
+    analyzer = UnivariatePortfolioAnalyzer(df, 'date', 'permno')
+    breakpoints = analyzer.cal_bp('x', 5)
+
+    labelled = analyzer.assign_portfolios(breakpoints, 'x', labels=True)
+    expected = _loop_assign(df, breakpoints, 'x')
+    assert labelled['portfolio'].tolist() == expected.tolist()
+
+    codes = analyzer.assign_portfolios(breakpoints, 'x')
+    assert codes['portfolio'].dtype == 'Int64'
+    assert (('P' + codes['portfolio'].astype(str)) == labelled['portfolio']).all()
+
+
+def test_modify_keeps_ties_in_the_lowest_portfolio():
+    df = _stocks()
+    analyzer = UnivariatePortfolioAnalyzer(df, 'date', 'permno')
+    breakpoints = analyzer.cal_bp('x', 5)
+
+    first = analyzer.assign_portfolios(breakpoints, 'x', method='modify')
+    second = analyzer.assign_portfolios(breakpoints, 'x', method='modify')
+    pd.testing.assert_frame_equal(first, second)
+
+    # The zeros of the first period sit on duplicated edges: all of them go to portfolio 1 and the tied portfolios stay empty
+    period = first[first['date'] == df['date'].iloc[0]]
+    assert (period.loc[period['x'] == 0, 'portfolio'] == 1).all()
+    assert period['portfolio'].max() == 5
+    assert period['portfolio'].nunique() < 5
+
+    # Periods without duplicate edges are assigned as with 'drop'
+    drop = analyzer.assign_portfolios(breakpoints, 'x')
+    later = (first['date'] != df['date'].iloc[0]).to_numpy()
+    assert first['portfolio'][later].tolist() == drop['portfolio'][later].tolist()
+
+
+def test_periods_without_breakpoints_get_no_portfolio():
+    df = _stocks()
+    analyzer = UnivariatePortfolioAnalyzer(df, 'date', 'permno')
+    breakpoints = analyzer.cal_bp('x', 3).iloc[1:]
+    portfolios = analyzer.assign_portfolios(breakpoints, 'x')
+    first = (portfolios['date'] == df['date'].iloc[0]).to_numpy()
+    assert portfolios['portfolio'][first].isna().all()
+    assert portfolios['portfolio'][~first].notna().all()
+
+
+def _large_panel(n_periods=3, n_stocks=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_periods * n_stocks
+    df = pd.DataFrame({
+        'date': np.repeat(pd.date_range('2000-01-31', periods=n_periods, freq='ME'), n_stocks),
+        'me': rng.lognormal(size=n),
+        'bm': np.round(rng.normal(size=n), 2),
+    })
+    df.loc[df.sample(frac=0.02, random_state=seed).index, 'bm'] = np.nan
+    return df.sample(frac=1, random_state=seed + 1).reset_index(drop=True)
+
+
+def _chunks(df, size=7000):
+    return [df.iloc[start:start + size] for start in range(0, len(df), size)]
+
+
+def test_streaming_breakpoints_are_within_their_error_bounds():
+    df = _large_panel()
+    engine = StreamingBreakpoints('date', ['me', 'bm'], num_portfolios=10, k=64)
+    for chunk in _chunks(df):
+        engine.update(chunk)
+
+    approximate, bounds = engine.breakpoints(), engine.error_bounds()
+    for characteristic in ['me', 'bm']:
+        for date, breakpoints in approximate[characteristic].iterrows():
+            values = np.sort(df.loc[df['date'] == date, characteristic].dropna().to_numpy())
+            n = len(values)
+            targets = (n - 1) * np.arange(1, 10) / 10
+            # Any rank of the approximate breakpoint (ties included) is within the bound of the target rank
+            low = np.searchsorted(values, breakpoints.to_numpy(), side='left')
+            high = np.searchsorted(values, breakpoints.to_numpy(), side='right') - 1
+            distance = np.maximum(0, np.maximum(low - targets, targets - high))
+            assert (distance <= bounds.loc[date, characteristic] * n + 1).all()
+
+
+def test_exact_breakpoints_match_cal_bp():
+    df = _large_panel(seed=3)
+    first, second = StreamingBreakpoints('date', ['me', 'bm'], 10, k=64), StreamingBreakpoints('date', ['me', 'bm'], 10, k=64)
+    chunks = _chunks(df)
+    for j, chunk in enumerate(chunks):
+        (first if j % 2 else second).update(chunk)
+    engine = first.merge(second)
+
+    exact = engine.exact(reversed(chunks))
+    analyzer = UnivariatePortfolioAnalyzer(df, 'date', 'permno')
+    for characteristic in ['me', 'bm']:
+        expected = analyzer.cal_bp(characteristic, 10)
+        pd.testing.assert_frame_equal(exact[characteristic], expected, check_names=False, check_freq=False, rtol=1e-12)
+
+
+def _double_sort_data(seed=0):
+    df = _stocks(n_periods=4, n_stocks=120, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    df['exchcd'] = rng.choice([1, 2, 3], size=len(df))
+    df['nyse'] = np.where(df['exchcd'] == 1, 1.0, np.nan)
+    return df
+
+
+def _chained_codes(df, column, n_portfolios, keys, mask):
+    """
+    Portfolio codes from breakpoints of the masked rows of each group, as chained univariate sorts give them.
+    """
+    quantiles = np.arange(1, n_portfolios) / n_portfolios
+    breakpoints = df[mask].groupby(keys)[column].quantile(quantiles).unstack()
+    codes = pd.Series(np.nan, index=df.index)
+    for key, rows in df.groupby(keys).groups.items():
+        if key in breakpoints.index:
+            edges = np.unique(breakpoints.loc[key].to_numpy())
+            codes[rows] = np.searchsorted(edges, df.loc[rows, column].to_numpy(), side='left') + 1
+    return codes
+
+
+@pytest.mark.parametrize('dependent', [False, True])
+def test_double_sort_matches_chained_univariate_sorts(dependent):
+    df = _double_sort_data()
+    analyzer = BivariatePortfolioAnalyzer(df, 'date', 'permno')
+    portfolios = analyzer.assign_portfolios({'me': 2, 'x': 3}, dependent=dependent, breakpoint_mask='nyse', keep_columns=['ret'])
+
+    complete = df.dropna(subset=['me', 'x'])
+    nyse = (complete['exchcd'] == 1).to_numpy()
+    expected = complete.assign(portfolio_me=_chained_codes(complete, 'me', 2, ['date'], nyse))
+    second_keys = ['date', 'portfolio_me'] if dependent else ['date']
+    expected['portfolio_x'] = _chained_codes(expected, 'x', 3, second_keys, nyse)
+    expected = expected.set_index(['date', 'permno'])
+
+    result = portfolios.set_index(['date', 'permno'])
+    assert len(result) == len(expected)
+    for column in ['portfolio_me', 'portfolio_x']:
+        assert (result[column] == expected.loc[result.index, column]).all()
+
+    # A missing mask value counts as False, as does an explicit boolean mask
+    boolean = analyzer.assign_portfolios({'me': 2, 'x': 3}, dependent=dependent, breakpoint_mask=(df['exchcd'] == 1).to_numpy(),
+                                         keep_columns=['ret'])
+    pd.testing.assert_frame_equal(boolean, portfolios)
+
+
+def test_double_sort_returns_and_spreads():
+    df = _double_sort_data(seed=4)
+    analyzer = BivariatePortfolioAnalyzer(df, 'date', 'permno')
+    portfolios = analyzer.assign_portfolios({'me': 2, 'x': 3}, keep_columns=['ret'])
+    returns = analyzer.portfolio_returns(portfolios, 'ret')
+
+    expected = portfolios.groupby(['date', 'portfolio_me', 'portfolio_x'])['ret'].mean().unstack(['portfolio_me', 'portfolio_x'])
+    expected.columns.names = returns.columns.names
+    pd.testing.assert_frame_equal(returns, expected[returns.columns], check_names=False, check_freq=False, rtol=1e-12)
+
+    portfolios = analyzer.assign_portfolios({'me': 2, 'x': 3}, keep_columns=['ret', 'me'])
+    weighted = analyzer.portfolio_returns(portfolios, 'ret', weight_column='me')
+    sums = portfolios.assign(product=portfolios['ret'] * portfolios['me']).groupby(['date', 'portfolio_me', 'portfolio_x'])[['product', 'me']].sum()
+    expected = (sums['product'] / sums['me']).unstack(['portfolio_me', 'portfolio_x'])
+    expected.columns.names = weighted.columns.names
+    pd.testing.assert_frame_equal(weighted, expected[weighted.columns], check_names=False, check_freq=False, rtol=1e-12)
+
+    table = analyzer.summarize_results(returns)
+    assert table.loc[1, 'diff'] == pytest.approx((returns[(1, 3)] - returns[(1, 1)]).mean())
+    assert table.loc['diff', 2] == pytest.approx((returns[(2, 2)] - returns[(1, 2)]).mean())
+
+
+def _merged_holding_returns(df, portfolios, holding_period, weight_column=None, overlapping=False, delisting_column=None):
+    """
+    Holding-period returns by merging each formation with the returns of the following calendar months and the weights
+    of the month before each return.
+    """
+    data = df.assign(month=df['date'].dt.to_period('M'))
+    data['total'] = data['ret']
+    if delisting_column is not None:
+        delisted = data[delisting_column].notna()
+        data.loc[delisted, 'total'] = (1 + data.loc[delisted, 'ret'].fillna(0)) * (1 + data.loc[delisted, delisting_column]) - 1
+    formed = portfolios.dropna(subset=['portfolio']).assign(formed=portfolios['date'].dt.to_period('M'))
+    formations = np.sort(formed['formed'].unique())
+
+    cohorts = []
+    for lag in range(1, holding_period + 1):
+        held = formed.assign(month=formed['formed'] + lag)
+        held = held[['permno', 'formed', 'month', 'portfolio']].merge(data[['permno', 'month', 'total']], on=['permno', 'month'])
+        if weight_column is not None:
+            weights = data[['permno', 'month', weight_column]].rename(columns={'month': 'lagged', weight_column: 'weight'})
+            held = held.assign(lagged=held['month'] - 1).merge(weights, on=['permno', 'lagged'])
+        else:
+            held['weight'] = 1.0
+        if not overlapping:
+            latest = held['month'].map(lambda month: formations[formations < month].max())
+            held = held[held['formed'] == latest]
+        cohorts.append(held.dropna(subset=['total', 'weight']))
+
+    held = pd.concat(cohorts)
+    held['product'] = held['total'] * held['weight']
+    sums = held.groupby(['month', 'formed', 'portfolio'])[['product', 'weight']].sum()
+    means = (sums['product'] / sums['weight']).groupby(['month', 'portfolio']).mean().unstack()
+    means.index = means.index.to_timestamp(how='end').normalize()
+    return means
+
+
+@pytest.mark.parametrize('options', [
+    {'holding_period': 1},
+    {'holding_period': 1, 'weight_column': 'me'},
+    {'holding_period': 3, 'weight_column': 'me', 'overlapping': True},
+    {'holding_period': 3, 'overlapping': False},
+    {'holding_period': 2, 'delisting_column': 'dlret'},
+])
+def test_holding_period_returns_match_a_merge(options):
+    df = _stocks(n_periods=12, n_stocks=60, seed=2)
+    # A missing calendar month, stocks missing in some months and a few delistings
+    df = df[df['date'] != df['date'].unique()[5]]
+    df = df.drop(df.sample(frac=0.1, random_state=3).index).reset_index(drop=True)
+    df['dlret'] = np.nan
+    df.loc[df.sample(n=20, random_state=4).index, 'dlret'] = -0.3
+    df.loc[df.sample(n=5, random_state=5).index, 'ret'] = np.nan
+
+    analyzer = UnivariatePortfolioAnalyzer(df, 'date', 'permno')
+    portfolios = analyzer.assign_portfolios(analyzer.cal_bp('x', 3), 'x')
+    table = analyzer.holding_period_returns(portfolios, 'ret', **options).set_index('date')
+
+    expected = _merged_holding_returns(df, portfolios, **options)
+    expected.columns = [f'P{k}' for k in expected.columns]
+    assert table.index.equals(pd.DatetimeIndex(expected.index))
+    pd.testing.assert_frame_equal(table[expected.columns], expected, check_names=False, check_freq=False, rtol=1e-12)
+    assert np.allclose(table['diff'], table['P3'] - table['P1'], equal_nan=True)
+
+
+def test_annual_rebalancing_holds_june_portfolios():
+    df = _stocks(n_periods=30, n_stocks=40, seed=6)
+    analyzer = UnivariatePortfolioAnalyzer(df, 'date', 'permno')
+    portfolios = analyzer.assign_portfolios(analyzer.cal_bp('x', 3), 'x')
+    table = analyzer.holding_period_returns(portfolios, 'ret', weight_column='me', holding_period=12, rebalance='annual').set_index('date')
+
+    june = portfolios[portfolios['date'].dt.month == 6]
+    expected = _merged_holding_returns(df, june, 12, weight_column='me')
+    expected.columns = [f'P{k}' for k in expected.columns]
+    assert table.index.min() == pd.Timestamp('2000-07-31')
+    pd.testing.assert_frame_equal(table[expected.columns], expected, check_names=False, check_freq=False, rtol=1e-12)
@@ -0,0 +1,250 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nafitools.datatools import concat_frames
+from nafitools.wrdsdata import wrdsdata, SQLConnection, ConnectionPool, compact_dtypes
+
+pytest.importorskip('pyarrow')
+
+
+def _crsp_monthly():
+    dates = pd.date_range('2020-01-31', '2020-12-31', freq='ME')
+    return pd.DataFrame({
+        'date': np.repeat(dates.strftime('%Y-%m-%d'), 3),
+        'permno': np.tile([10001, 10002, 10003], len(dates)),
+        'ret': np.linspace(-0.05, 0.05, 3 * len(dates)),
+    })
+
+
+def _database(path=':memory:'):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("ATTACH DATABASE ':memory:' AS crsp")
+    connection.execute("CREATE TABLE crsp.msf (date TEXT, permno INTEGER, ret REAL)")
+    connection.executemany("INSERT INTO crsp.msf VALUES (?, ?, ?)", _crsp_monthly().itertuples(index=False, name=None))
+    connection.commit()
+    return connection
+
+
+class CountingConnection(SQLConnection):
+    def __init__(self, connection):
+        super().__init__(connection)
+        self.queries = []
+
+    def raw_sql(self, sql, date_cols=None):
+        self.queries.append(sql)
+        return super().raw_sql(sql, date_cols)
+
+
+def test_cache_hit_and_miss(tmp_path):
+    db = CountingConnection(_database())
+    data = wrdsdata(db=db, cache_dir=str(tmp_path))
+
+    first = data.get_crsp_monthly('2020-01-01', '2020-06-30')
+    assert len(db.queries) == 1
+    assert len(first) == 18
+
+    second = data.get_crsp_monthly('2020-01-01', '2020-06-30')
+    assert len(db.queries) == 1
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_partial_range_refetch(tmp_path):
+    db = CountingConnection(_database())
+    data = wrdsdata(db=db, cache_dir=str(tmp_path))
+
+    data.get_crsp_monthly('2020-03-01', '2020-04-30')
+    df = data.get_crsp_monthly('2020-01-01', '2020-06-30')
+    # Only the missing runs before and after the cached months are queried
+    assert len(db.queries) == 3
+    assert "'2020-01-01' AND '2020-02-29'" in db.queries[1]
+    assert "'2020-05-01' AND '2020-06-30'" in db.queries[2]
+    assert sorted(pd.to_datetime(df['date']).dt.month.unique()) == [1, 2, 3, 4, 5, 6]
+
+    # A sub-range of cached months is cut to the requested dates
+    df = data.get_crsp_monthly('2020-02-01', '2020-02-29')
+    assert len(db.queries) == 3
+    assert (pd.to_datetime(df['date']).dt.month == 2).all()
+
+
+def test_empty_months_are_cached(tmp_path):
+    db = CountingConnection(_database())
+    data = wrdsdata(db=db, cache_dir=str(tmp_path))
+
+    assert data.get_crsp_monthly('2019-01-01', '2019-03-31').empty
+    assert data.get_crsp_monthly('2019-01-01', '2019-03-31').empty
+    assert len(db.queries) == 1
+
+
+def test_invalidate(tmp_path):
+    db = CountingConnection(_database())
+    data = wrdsdata(db=db, cache_dir=str(tmp_path))
+    data.get_crsp_monthly('2020-01-01', '2020-06-30')
+
+    key = {'where': [], 'columns': []}
+    data.cache.invalidate('crsp.msf', key, months=[pd.Period('2020-02', 'M')])
+    data.get_crsp_monthly('2020-01-01', '2020-06-30')
+    assert len(db.queries) == 2
+    assert "'2020-02-01' AND '2020-02-29'" in db.queries[1]
+
+    data.cache.invalidate('crsp.msf')
+    data.get_crsp_monthly('2020-01-01', '2020-06-30')
+    assert len(db.queries) == 3
+
+    # Different filters are cached separately
+    data.get_crsp_monthly('2020-01-01', '2020-06-30', columns=['ret'])
+    assert len(db.queries) == 4
+
+
+def test_expired_months_are_fetched_again(tmp_path):
+    db = CountingConnection(_database())
+    data = wrdsdata(db=db, cache_dir=str(tmp_path), cache_expire_days=0)
+    data.get_crsp_monthly('2020-01-01', '2020-02-29')
+    data.get_crsp_monthly('2020-01-01', '2020-02-29')
+    assert len(db.queries) == 2
+
+
+def test_compact_dtypes_do_not_depend_on_values():
+    first = pd.DataFrame({'date': ['2020-01-31', '2020-02-29'], 'permno': [10001.0, 10002.0], 'exchcd': [1.0, np.nan],
+                          'gvkey': ['001004', '001045'], 'ret': [0.1, 1.0], 'bm': [0.5, 0.7]})
+    second = pd.DataFrame({'date': ['2020-03-31', None], 'permno': [10003, 10004], 'exchcd': [1, 2],
+                           'gvkey': ['001050', '001004'], 'ret': [0.5, np.nan], 'bm': [np.nan, 0.2]})
+    first, second = compact_dtypes(first, float32=True, date_column='date'), compact_dtypes(second, float32=True, date_column='date')
+
+    categorical = ['gvkey']
+    pd.testing.assert_series_equal(first.dtypes.drop(categorical), second.dtypes.drop(categorical))
+    combined = concat_frames([first, second])
+    assert combined['permno'].dtype == 'Int32'
+    assert combined['gvkey'].dtype == 'category'
+    assert combined['gvkey'].tolist() == ['001004', '001045', '001050', '001004']
+    # Returns stay float64, characteristics are downcast
+    assert combined['ret'].dtype == np.float64
+    assert combined['bm'].dtype == np.float32
+    assert combined['month'].dtype == 'Int32'
+    assert combined['month'].tolist()[:3] == [pd.Period(month, 'M').ordinal for month in ['2020-01', '2020-02', '2020-03']]
+    assert pd.isna(combined['month'].iloc[3])
+
+    # An explicit list only downcasts the listed characteristics
+    listed = compact_dtypes(pd.DataFrame({'bm': [0.5], 'mom': [0.1]}), float32=['bm'])
+    assert listed['bm'].dtype == np.float32 and listed['mom'].dtype == np.float64
+
+
+def _database_factory(tmp_path, opened):
+    """
+    A connection factory of SQLite stand-ins that share one crsp database file.
+    """
+    path = str(tmp_path / 'crsp.sqlite')
+    seed = sqlite3.connect(path)
+    seed.execute("CREATE TABLE msf (date TEXT, permno INTEGER, ret REAL)")
+    seed.executemany("INSERT INTO msf VALUES (?, ?, ?)", _crsp_monthly().itertuples(index=False, name=None))
+    seed.commit()
+    seed.close()
+
+    def factory():
+        connection = sqlite3.connect(':memory:', check_same_thread=False)
+        connection.execute(f"ATTACH DATABASE '{path}' AS crsp")
+        opened.append(CountingConnection(connection))
+        return opened[-1]
+    return factory
+
+
+def test_sharded_queries_on_a_pool(tmp_path):
+    opened = []
+    data = wrdsdata(connection_factory=_database_factory(tmp_path, opened), max_connections=3, shard='M')
+    df = data.get_crsp_monthly('2020-01-01', '2020-12-31')
+
+    assert 1 <= len(opened) <= 3
+    assert sum(len(connection.queries) for connection in opened) == 12
+    single = wrdsdata(db=CountingConnection(_database())).get_crsp_monthly('2020-01-01', '2020-12-31')
+    pd.testing.assert_frame_equal(df, single)
+
+
+def test_shards_are_cut_to_the_range(tmp_path):
+    opened = []
+    data = wrdsdata(connection_factory=_database_factory(tmp_path, opened), shard='Q')
+    df = data.get_crsp_monthly('2020-02-15', '2020-08-15')
+
+    queries = opened[0].queries
+    assert len(queries) == 3
+    assert "'2020-02-15' AND '2020-03-31'" in queries[0]
+    assert "'2020-07-01' AND '2020-08-15'" in queries[2]
+    assert sorted(pd.to_datetime(df['date']).dt.month.unique()) == [2, 3, 4, 5, 6, 7]
+
+
+class DeadConnection:
+    def __init__(self):
+        self.closed = False
+
+    def raw_sql(self, sql, date_cols=None):
+        raise ConnectionError('SSL connection has been closed unexpectedly')
+
+    def close(self):
+        self.closed = True
+
+
+def test_failed_query_retries_on_a_new_connection(tmp_path):
+    opened = []
+    factory = _database_factory(tmp_path, opened)
+    dead = DeadConnection()
+    data = wrdsdata(db=dead, connection_factory=factory, retries=1, retry_wait=0)
+
+    df = data.get_crsp_monthly('2020-01-01', '2020-03-31')
+    assert len(df) == 9
+    # The caller's connection is dropped from the pool but not closed
+    assert not dead.closed
+    assert len(opened) == 1
+    assert data.db is opened[0]
+
+
+def test_query_errors_are_not_retried():
+    connection = _database()
+    data = wrdsdata(db=SQLConnection(connection), retry_wait=60)
+    with pytest.raises(pd.errors.DatabaseError, match='bogus'):
+        data.get_crsp_monthly('2020-01-01', '2020-02-01', columns=['bogus'])
+
+    # The connection stays open and in use
+    assert connection.execute("SELECT COUNT(*) FROM crsp.msf").fetchone() == (36,)
+    assert len(data.get_crsp_monthly('2020-01-01', '2020-02-01')) == 3
+
+
+def test_supplied_connection_is_not_replaced_by_wrds():
+    dead = DeadConnection()
+    data = wrdsdata(db=dead, retry_wait=60)
+    with pytest.raises(ConnectionError):
+        data.get_crsp_monthly('2020-01-01', '2020-03-31')
+    assert not dead.closed
+    assert data.db is dead
+
+
+def test_retries_are_exhausted():
+    opened = []
+
+    def factory():
+        opened.append(DeadConnection())
+        return opened[-1]
+
+    data = wrdsdata(connection_factory=factory, retries=2, retry_wait=0)
+    with pytest.raises(ConnectionError):
+        data.get_crsp_monthly('2020-01-01', '2020-03-31')
+    assert len(opened) == 3
+    assert all(connection.closed for connection in opened)
+
+
+def test_discard_frees_a_slot_for_a_waiting_acquire():
+    opened = []
+
+    def factory():
+        opened.append(DeadConnection())
+        return opened[-1]
+
+    pool = ConnectionPool(factory, 1)
+    first = pool.acquire()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        waiting = executor.submit(pool.acquire)
+        pool.discard(first)
+        second = waiting.result(timeout=5)
+    assert first.closed
+    assert second is opened[1]